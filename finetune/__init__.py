@@ -9,9 +9,9 @@ import tensorflow as tf
 from tensorflow.compat.v1 import logging as tf_logging
 
 from finetune.target_models.multifield import MultiFieldClassifier, MultiFieldRegressor
-from finetune.target_models.classifier import Classifier
+from finetune.target_models.classifier import Classifier, DistillationClassifier
 from finetune.target_models.regressor import Regressor
-from finetune.target_models.sequence_labeling import SequenceLabeler
+from finetune.target_models.sequence_labeling import SequenceLabeler, DistillationSequenceLabeler
 from finetune.target_models.comparison import Comparison
 from finetune.target_models.multi_label_classifier import MultiLabelClassifier
 from finetune.target_models.multiple_choice import MultipleChoice
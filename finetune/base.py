@@ -6,12 +6,14 @@ import atexit
 import warnings
 import itertools
 import math
+import threading
 from abc import ABCMeta, abstractmethod
 from copy import deepcopy
 import tempfile
 import time
 import sys
 from contextlib import contextmanager
+from collections import defaultdict
 import pathlib
 import logging
 
@@ -25,7 +27,7 @@ import joblib
 
 from finetune.util import list_transpose
 from finetune.encoding.input_encoder import EncodedOutput
-from finetune.config import all_gpus, assert_valid_config, get_default_config
+from finetune.config import all_gpus, assert_valid_config, get_default_config, get_config
 from finetune.saver import Saver, InitializeHook
 from finetune.errors import FinetuneError
 from finetune.model import get_model_fn, PredictMode
@@ -34,20 +36,30 @@ from finetune.util.shapes import shape_list
 from finetune.util.timing import ProgressBar
 from finetune.util.in_memory_finetune import make_in_memory_finetune_hooks
 from finetune.util.indico_estimator import IndicoEstimator
+from finetune.util.predict_session import PredictSession
+from finetune.util.feature_cache import FeatureCache
+from finetune.util.input_utils import batch_dataset
 from finetune.util.gpu_info import gpu_info
+from finetune.util.grid_search import run_grid_search_trials
+from finetune.util.mmap_weights import save_weights, WEIGHTS_SUFFIX
 
 from finetune.base_models.bert.model import _BaseBert
-from finetune.base_models import GPTModel, GPTModelSmall
+from finetune.base_models import GPTModel, GPTModelSmall, GPT2Model, GPT2Model345, GPT2Model762, GPT2Model1558
 from finetune.input_pipeline import InputMode
 
 LOGGER = logging.getLogger("finetune")
 
+INT8_PREDICT_MODELS = (_BaseBert, GPTModel, GPT2Model, GPT2Model345, GPT2Model762, GPT2Model1558)
+
 
 class BaseModel(object, metaclass=ABCMeta):
     """
     A sklearn-style task agnostic base class for finetuning a Transformer language model.
     """
     defaults = dict()
+    supports_early_exit = False
+    # featurizer outputs read by the target model, set by models that can train from a feature cache
+    cached_feature_keys = None
 
     def __init__(self, **kwargs):
         """
@@ -98,6 +110,15 @@ class BaseModel(object, metaclass=ABCMeta):
         if not issubclass(config.base_model, _BaseBert) and config.float_16_predict:
             LOGGER.warning("float_16_predict only supported by bert based models")
             config.float_16_predict = False
+
+        if not issubclass(config.base_model, INT8_PREDICT_MODELS) and config.int8_predict:
+            LOGGER.warning("int8_predict only supported by bert, gpt and gpt2 based models")
+            config.int8_predict = False
+
+        if not issubclass(config.base_model, _BaseBert) and (config.predict_num_layers or config.early_exit_layers):
+            LOGGER.warning("predict_num_layers and early_exit_layers only supported by bert based models")
+            config.predict_num_layers = None
+            config.early_exit_layers = None
                                             
         for ak in auto_keys:
             if ak in ["val_size", "use_gpu_crf_predict"]:
@@ -115,6 +136,15 @@ class BaseModel(object, metaclass=ABCMeta):
             raise ValueError(
                 "If you are only finetuning a subset of the layers, you cannot finetune embeddings."
             )
+        if self.config.early_exit_layers and not self.supports_early_exit:
+            raise ValueError("early_exit_layers is only supported by Classifier models.")
+        if self.config.feature_cache_path is not None:
+            if self.cached_feature_keys is None:
+                raise ValueError("{} cannot be trained from cached features.".format(type(self).__name__))
+            if self.config.num_layers_trained != 0:
+                raise ValueError("feature_cache_path requires a frozen base model, set num_layers_trained=0.")
+            if self.config.lm_loss_coef > 0.0 or self.config.early_exit_layers:
+                raise ValueError("feature_cache_path cannot be used with lm_loss_coef or early_exit_layers.")
 
     @abstractmethod
     def _get_input_pipeline(self):
@@ -127,6 +157,7 @@ class BaseModel(object, metaclass=ABCMeta):
         # state for prediction caching
         self._cached_predict = False
         self._cached_estimator = None
+        self._estimator_lock = threading.RLock()
 
         try:
             self.estimator_dir = os.path.abspath(
@@ -147,6 +178,9 @@ class BaseModel(object, metaclass=ABCMeta):
             exclude_matches=None if self.config.save_adam_vars else "Adam",
             save_dtype=self.config.save_dtype,
             permit_uninitialized=self.config.permit_uninitialized,
+            save_workers=self.config.save_workers,
+            save_delta=self.config.save_delta,
+            save_delta_tolerance=self.config.save_delta_tolerance,
         )
 
     def init_from_checkpoint(self, checkpoint_path):
@@ -157,6 +191,9 @@ class BaseModel(object, metaclass=ABCMeta):
             exclude_matches=None if self.config.save_adam_vars else "Adam",
             save_dtype=self.config.save_dtype,
             restart_global_step=False,
+            save_workers=self.config.save_workers,
+            save_delta=self.config.save_delta,
+            save_delta_tolerance=self.config.save_delta_tolerance,
         )
 
     @abstractmethod
@@ -185,19 +222,26 @@ class BaseModel(object, metaclass=ABCMeta):
     def _pre_target_model_hook(self, featurizer_state):
         pass
 
-    def _n_steps(self, n_examples, batch_size, n_gpus):
-        steps = int(math.ceil(n_examples / (batch_size * n_gpus)))
+    def _n_steps(self, n_examples, batch_size, n_gpus, n_batches=None):
+        if n_batches is None:
+            n_batches = math.ceil(n_examples / batch_size)
+        steps = int(math.ceil(n_batches / n_gpus))
         return steps
 
     def finetune(self, Xs, Y=None, context=None, update_hook=None):
         if callable(Xs):
+            if self.config.feature_cache_path is not None:
+                raise FinetuneError("feature_cache_path is not supported when training from a generator.")
             datasets = self.input_pipeline.get_dataset_from_generator(
                 Xs, input_mode=InputMode.TRAIN, update_hook=update_hook
             )
         else:
             zipped_data_list = self.input_pipeline.zip_list_to_dict(X=Xs, Y=Y, context=context)
             datasets = self.input_pipeline.get_dataset_from_list(
-                zipped_data_list, input_mode=InputMode.TRAIN, update_hook=update_hook
+                zipped_data_list,
+                input_mode=InputMode.TRAIN,
+                update_hook=update_hook,
+                feature_cache=self._feature_cache() if Y is not None else None,
             )
                 
         if self.config.keep_best_model:
@@ -216,6 +260,7 @@ class BaseModel(object, metaclass=ABCMeta):
             n_examples=self.input_pipeline.dataset_size,
             batch_size=self.config.batch_size,
             n_gpus=max(1, len(self.resolved_gpus)),
+            n_batches=self.input_pipeline.batches_per_epoch,
         )
         num_steps = steps_per_epoch * self.config.n_epochs
 
@@ -254,6 +299,37 @@ class BaseModel(object, metaclass=ABCMeta):
         
         self._trained = True
 
+    def _feature_cache(self):
+        if self.config.feature_cache_path is None:
+            return None
+        return FeatureCache(
+            self.config.feature_cache_path,
+            keys=self.cached_feature_keys,
+            featurize_fn=self._featurize_encoded,
+            signature=(self.config.base_model.__name__, self.config.base_model_path),
+        )
+
+    def _featurize_encoded(self, examples, keys):
+        """
+        Runs the featurizer over examples already encoded by the input pipeline, yielding the requested outputs
+        ("features" and / or "sequence_features") for each.
+        """
+        predict_modes = {"features": PredictMode.FEATURIZE, "sequence_features": PredictMode.SEQUENCE}
+        feats = [example[0] if isinstance(example, tuple) else example for example in examples]
+        types, shapes = self.input_pipeline.feed_shape_type_def()
+        input_fn = batch_dataset(
+            lambda: Dataset.from_generator(lambda: iter(feats), types[0], shapes[0]),
+            batch_size=self.config.predict_batch_size,
+            shapes=shapes[0],
+        )
+        # the cache is keyed on the base model alone, so float_16_predict, int8_predict and predict_num_layers are not used
+        estimator = self._build_estimator(exact_featurizer=True)
+        predictions = estimator.predict(
+            input_fn=input_fn, predict_keys=[predict_modes[key] for key in keys], hooks=[InitializeHook(self.saver)]
+        )
+        for pred in ProgressBar(predictions, total=len(feats), desc="Caching features"):
+            yield {key: pred[predict_modes[key]] for key in keys}
+
     def _distribute_strategy(self, visible_gpus):
         """
         Select a distribution strategy based on available devices.
@@ -295,6 +371,9 @@ class BaseModel(object, metaclass=ABCMeta):
             conf.gpu_options.per_process_gpu_memory_fraction = (
                 self.config.per_process_gpu_memory_fraction
             )
+        if self.config.num_threads:
+            conf.intra_op_parallelism_threads = self.config.num_threads
+            conf.inter_op_parallelism_threads = self.config.num_threads
         optimizer_options = conf.graph_options.optimizer_options
         if self.config.xla:                                                     
             optimizer_options.global_jit_level = tf.compat.v1.OptimizerOptions.ON_1 
@@ -313,55 +392,77 @@ class BaseModel(object, metaclass=ABCMeta):
         )
         return config
 
-    def get_estimator(self, force_build_lm=False, build_explain=False, cache=False):
-        if self._cached_estimator is not None:
-            est = self._cached_estimator
-            hooks = []
-        else:
-            build_lm = force_build_lm or self.config.lm_loss_coef > 0.0
-            config = self._get_estimator_config()
-            
-            fp16_predict = self.config.float_16_predict
-            if fp16_predict:
-                if not gpu_info(config.session_config)["fp16_inference"]:
-                    LOGGER.info(
-                        "config.float_16_predict is true but the GPU does not support float16, it is being turned off"
-                    )
-                    fp16_predict = False
-            
-            model_fn = get_model_fn(
-                target_model_fn=self._target_model,
-                pre_target_model_hook=self._pre_target_model_hook,
-                predict_op=self._predict_op,
-                predict_proba_op=self._predict_proba_op,
-                build_target_model=self.input_pipeline.target_dim is not None,
-                lm_type=self.config.lm_type if build_lm else None,
-                encoder=self.input_pipeline.text_encoder,
-                target_dim=self.input_pipeline.target_dim,
-                label_encoder=self.input_pipeline.label_encoder,
-                build_explain=build_explain,
-                n_replicas=max(1, len(self.resolved_gpus)),
-                fp16_predict=fp16_predict,
-            )
-            est = IndicoEstimator(
-                model_dir=self.estimator_dir,
-                model_fn=model_fn,
-                config=config,
-                params=self.config,
-            )
+    def _build_estimator(self, force_build_lm=False, build_explain=False, build_pruning_scores=False, exact_featurizer=False):
+        build_lm = force_build_lm or self.config.lm_loss_coef > 0.0
+        config = self._get_estimator_config()
+
+        params = self.config
+        if exact_featurizer:
+            # outputs match the unmodified featurizer, as when they are written to the feature cache
+            params = deepcopy(self.config)
+            params.float_16_predict = False
+            params.int8_predict = False
+            params.predict_num_layers = None
+
+        fp16_predict = params.float_16_predict
+        if fp16_predict:
+            if not gpu_info(config.session_config)["fp16_inference"]:
+                LOGGER.info(
+                    "config.float_16_predict is true but the GPU does not support float16, it is being turned off"
+                )
+                fp16_predict = False
+
+        model_fn = get_model_fn(
+            target_model_fn=self._target_model,
+            pre_target_model_hook=self._pre_target_model_hook,
+            predict_op=self._predict_op,
+            predict_proba_op=self._predict_proba_op,
+            build_target_model=self.input_pipeline.target_dim is not None,
+            lm_type=self.config.lm_type if build_lm else None,
+            encoder=self.input_pipeline.text_encoder,
+            target_dim=self.input_pipeline.target_dim,
+            label_encoder=self.input_pipeline.label_encoder,
+            build_explain=build_explain,
+            n_replicas=max(1, len(self.resolved_gpus)),
+            fp16_predict=fp16_predict,
+            int8_predict=params.int8_predict,
+            build_pruning_scores=build_pruning_scores,
+        )
+        return IndicoEstimator(
+            model_dir=self.estimator_dir,
+            model_fn=model_fn,
+            config=config,
+            params=params,
+        )
+
+    def get_estimator(self, force_build_lm=False, build_explain=False, build_pruning_scores=False, cache=False):
+        with self._estimator_lock:
+            if self._cached_estimator is not None:
+                est = self._cached_estimator
+            else:
+                est = self._build_estimator(
+                    force_build_lm=force_build_lm,
+                    build_explain=build_explain,
+                    build_pruning_scores=build_pruning_scores,
+                )
 
+            # a new list for each caller, whichever concurrent caller builds the cached session uses its hooks
             hooks = [InitializeHook(self.saver)]
 
-        if cache:
-            self._cached_estimator = est
+            if cache:
+                self._cached_estimator = est
 
-        return est, hooks
+            return est, hooks
 
     def close(self):
         if getattr(self, "_cached_estimator", None) is not None:
-            self._cached_estimator.close_predict()
-            self._cached_estimator = None
-            gc.collect()
+            with self._estimator_lock:
+                if self._cached_estimator is not None:
+                    self._cached_estimator.close_predict()
+                    self._cached_estimator = None
+                    gc.collect()
+        if getattr(self, "input_pipeline", None) is not None:
+            self.input_pipeline.close()
         
     @contextmanager
     def cached_predict(self):
@@ -373,6 +474,16 @@ class BaseModel(object, metaclass=ABCMeta):
         self._cached_predict = False
         self.close()
 
+    def predict_session(self, max_concurrency=1):
+        """
+        Returns an open :py:class:`PredictSession`, a long-lived alternative to `cached_predict()` that builds the
+        prediction graph once, can be shared between threads and records per-call latency.
+        Call `.close()` on the session (or use it as a context manager) to release the graph.
+
+        :param max_concurrency: Number of threads allowed to predict at once, sharing a single graph and session.
+        """
+        return PredictSession(self, max_concurrency=max_concurrency).open()
+
     def _sort_by_length(self, Xs):
         """
         Returns the sorted array and the idxs to invert the sort operation
@@ -384,7 +495,13 @@ class BaseModel(object, metaclass=ABCMeta):
         invert_idxs[sorted_idxs] = np.arange(sorted_idxs.shape[0])
         return sorted_Xs, invert_idxs
 
-    def _inference(self, zipped_data, predict_keys=None, context=None, update_hook=None, chunked_length=None):
+    def _inference(
+        self, zipped_data, predict_keys=None, context=None, update_hook=None, chunked_length=None, estimator=None
+    ):
+        """
+        :param estimator: An estimator from `_build_estimator` whose graph and session are cached by the caller,
+            which is responsible for calling `close_predict()` on it. Otherwise the model's estimator is used.
+        """
         def get_zipped_data():
             return iter(zipped_data)
         
@@ -392,12 +509,18 @@ class BaseModel(object, metaclass=ABCMeta):
             get_zipped_data, input_mode=InputMode.PREDICT, update_hook=update_hook
         )["predict_dataset"]
 
-        estimator, hooks = self.get_estimator(
-            build_explain=PredictMode.EXPLAIN in predict_keys, cache=self._cached_predict
-        )
+        cached = estimator is not None or self._cached_predict
+        if estimator is not None:
+            hooks = [InitializeHook(self.saver)]
+        else:
+            estimator, hooks = self.get_estimator(
+                build_explain=PredictMode.EXPLAIN in predict_keys,
+                build_pruning_scores=PredictMode.HEAD_IMPORTANCE in predict_keys or PredictMode.FFN_IMPORTANCE in predict_keys,
+                cache=self._cached_predict,
+            )
         length = chunked_length if chunked_length is not None else len(zipped_data)
 
-        if self._cached_predict:
+        if cached:
             # Add commonly used (cheap) predict keys to the graph to prevent having to rebuild
             required_predict_keys = list(
                 {PredictMode.FEATURIZE, PredictMode.SEQUENCE, PredictMode.NORMAL, PredictMode.PROBAS} |
@@ -428,6 +551,9 @@ class BaseModel(object, metaclass=ABCMeta):
             raise FinetuneError(
                 "Cannot call `predict()` on a model that has not been fit."
             )
+        finally:
+            # releases the session and input pipeline held by the iterator if an exception stopped it early
+            prediction_iterator.close()
 
     def fit(self, *args, **kwargs):
         """ An alias for finetune. """
@@ -449,6 +575,50 @@ class BaseModel(object, metaclass=ABCMeta):
 
         return outputs
 
+    def _iter_in_windows(self, method, Xs, context=None, window_size=None, **kwargs):
+        """
+        Lazily consumes `Xs` (and `context`) in windows of `window_size` documents, applies `method` to each window
+        and yields the results one at a time in input order. Sorting by length is applied within each window and the
+        prediction graph is cached for the lifetime of the iterator so only one window is held in memory at a time.
+        Inside of `cached_predict()` the model's cached graph is used, otherwise the iterator builds its own, which is
+        released when the iterator is exhausted or closed and is not shared with other calls on the model.
+        """
+        window_size = window_size or self.config.predict_window_size
+        estimator = None if self._cached_predict else self._build_estimator()
+        if estimator is not None:
+            kwargs["estimator"] = estimator
+        X_iter = iter(Xs)
+        context_iter = iter(context) if context is not None else None
+        try:
+            while True:
+                window = list(itertools.islice(X_iter, window_size))
+                if not window:
+                    break
+                if context_iter is not None:
+                    kwargs["context"] = list(itertools.islice(context_iter, len(window)))
+                yield from method(window, **kwargs)
+        finally:
+            if estimator is not None:
+                estimator.close_predict()
+
+    def predict_iter(self, Xs, context=None, window_size=None, **kwargs):
+        """
+        Generator version of `predict` for unbounded iterables of documents, see `_iter_in_windows`.
+        """
+        return self._iter_in_windows(self.predict, Xs, context=context, window_size=window_size, **kwargs)
+
+    def predict_proba_iter(self, Xs, context=None, window_size=None, **kwargs):
+        """
+        Generator version of `predict_proba` for unbounded iterables of documents, see `_iter_in_windows`.
+        """
+        return self._iter_in_windows(self.predict_proba, Xs, context=context, window_size=window_size, **kwargs)
+
+    def featurize_iter(self, Xs, context=None, window_size=None, **kwargs):
+        """
+        Generator version of `featurize` for unbounded iterables of documents, see `_iter_in_windows`.
+        """
+        return self._iter_in_windows(self.featurize, Xs, context=context, window_size=window_size, **kwargs)
+
     def _predict_proba(self, zipped_data, **kwargs):
         """
         Produce raw numeric outputs for proba predictions
@@ -466,7 +636,7 @@ class BaseModel(object, metaclass=ABCMeta):
             zipped_data, invert_idxs = self._sort_by_length(zipped_data)
         end_sort = time.time()
 
-        raw_probas = self._predict_proba(zipped_data)
+        raw_probas = self._predict_proba(zipped_data, **kwargs)
         classes = self.input_pipeline.label_encoder.classes_
 
         formatted_predictions = []
@@ -628,7 +798,7 @@ class BaseModel(object, metaclass=ABCMeta):
         }
         return serialized_state
 
-    def save(self, path):
+    def save(self, path, mmap_weights=False):
         """
         Saves the state of the model to disk to the folder specific by `path`.  If `path` does not exist, it will be auto-created.
 
@@ -639,19 +809,25 @@ class BaseModel(object, metaclass=ABCMeta):
         Note:
             Does not serialize state of Adam optimizer.
             Should not be used to save / restore a training model.
+
+        :param path: path or file object to save the model to.
+        :param mmap_weights: If True, weights are written uncompressed to a page-aligned file alongside `path`
+            (`path` + ".weights") which :meth:`load` memory maps rather than unpickling. Both files are needed to load.
         """
         if path is None:
             return
         
         if isinstance(path, str):
             path = os.path.abspath(path)
-        self.saver.save(self, path)
+        self.saver.save(self, path, mmap_weights=mmap_weights)
 
-    def create_base_model(self, filename, exists_ok=False):
+    def create_base_model(self, filename, exists_ok=False, mmap_weights=False):
         """
         Saves the current weights into the correct file format to be used as a base model.
         :param filename: the path to save the base model relative to finetune's base model filestore.
         :param exists_ok: Whether to replace the model if it exists.
+        :param mmap_weights: Whether to also write a memory mappable copy of the weights, which is used in place of
+            the pickled weights when the base model is loaded.
         """
         base_model_path = os.path.join(os.path.dirname(__file__), "model", filename)
 
@@ -673,6 +849,11 @@ class BaseModel(object, metaclass=ABCMeta):
             if "featurizer" in k and "Adam" not in k
         }
         joblib.dump(weights_stripped, base_model_path)
+        if mmap_weights:
+            save_weights(base_model_path + WEIGHTS_SUFFIX, weights_stripped)
+        elif os.path.exists(base_model_path + WEIGHTS_SUFFIX):
+            # a stale copy would otherwise shadow the new weights
+            os.remove(base_model_path + WEIGHTS_SUFFIX)
 
     def load(path, *args, **kwargs):
         """
@@ -715,15 +896,106 @@ class BaseModel(object, metaclass=ABCMeta):
         model.input_pipeline.config = model.config
         download_data_if_required(model.config.base_model)
         saver.set_fallback(model.config.base_model_path)
+        saver.reconstruct_delta_weights()
         model._initialize()
         model.saver.variables = saver.variables
         model._trained = True
         return model
 
 
+    @classmethod
+    def _pretokenize_for_grid_search(cls, config, Xs, cache_path):
+        """
+        Tokenizes every document of a single input model once into an on-disk tokenization cache which each trial
+        then loads, so documents are not re-tokenized for every configuration and split.
+        """
+        config.tokenization_cache_size = len(Xs[0])
+        config.tokenization_cache_path = cache_path
+        pipeline = cls(**config).input_pipeline
+        for x in Xs[0]:
+            list(pipeline._text_to_ids(x))
+        pipeline.tokenization_cache.save()
+
+    @staticmethod
+    def _grid_configs(config):
+        gs = config.get_grid_searchable()
+        ranged_keys = gs.keys()
+        ranged_iterators = gs.values()
+        configs = []
+        for grid_item in itertools.product(*ranged_iterators):
+            config_ = deepcopy(config)
+            config_.update(dict(zip(ranged_keys, grid_item)))
+            configs.append(config_)
+        return configs
+
+    @classmethod
+    def iter_grid_search(
+        cls,
+        Xs,
+        Y,
+        *,
+        test_size,
+        n_splits=1,
+        eval_fn=None,
+        probs=False,
+        n_workers=None,
+        threads_per_worker=None,
+        **kwargs
+    ):
+        """
+        Runs every grid search configuration on each of `n_splits` random train / test splits and yields
+        (grid_idx, split_idx, config, eval_fn output) tuples as trials finish.
+
+        :param n_workers: If greater than 1, trials are fanned out over a pool of this many processes and results are
+            yielded in the order they finish. Documents of single input models are then tokenized once and shared
+            between the workers through a tokenization cache, unless `tokenization_cache_size` is set explicitly.
+            Otherwise trials run one after another in this process.
+        :param threads_per_worker: Limit on the number of tensorflow threads used by each worker process.
+        See :meth:`finetune_grid_search` for the remaining parameters.
+        """
+        if isinstance(Xs[0], str):
+            Xs = [Xs]
+        config = get_config(**kwargs)
+        config.val_size = 0.0
+        eval_fn = eval_fn or cls.get_eval_fn()
+
+        splits = []
+        for _ in range(n_splits):
+            trainXs, testXs, trainY, testY = train_test_split(
+                list_transpose(Xs), Y, test_size=test_size, shuffle=True
+            )
+            splits.append((list_transpose(trainXs), list_transpose(testXs), trainY, testY))
+
+        configs = cls._grid_configs(config)
+        parallel = n_workers is not None and n_workers > 1
+
+        with tempfile.TemporaryDirectory(prefix="Finetune") as tmp_dir:
+            # models with several input fields encode them together, so the cache filled from a single field is not used
+            if parallel and len(Xs) == 1 and config.tokenization_cache_size is None:
+                cache_path = os.path.join(tmp_dir, "tokenization_cache.jl")
+                cls._pretokenize_for_grid_search(deepcopy(config), Xs, cache_path)
+                for config_ in configs:
+                    config_.tokenization_cache_size = len(Xs[0])
+                    config_.tokenization_cache_path = cache_path
+
+            trial_ids = [
+                (grid_idx, split_idx)
+                for split_idx in range(n_splits)
+                for grid_idx in range(len(configs))
+            ]
+            trials = [
+                (dict(configs[grid_idx]), splits[split_idx][0], splits[split_idx][2], splits[split_idx][1])
+                for grid_idx, split_idx in trial_ids
+            ]
+            for trial_idx, res in run_grid_search_trials(
+                cls, trials, probs=probs, n_workers=n_workers, threads_per_worker=threads_per_worker
+            ):
+                grid_idx, split_idx = trial_ids[trial_idx]
+                yield grid_idx, split_idx, configs[grid_idx], eval_fn(res, splits[split_idx][3])
+
     @classmethod
     def finetune_grid_search(
-        cls, Xs, Y, *, test_size, eval_fn=None, probs=False, return_all=False, **kwargs
+        cls, Xs, Y, *, test_size, eval_fn=None, probs=False, return_all=False, n_workers=None, threads_per_worker=None, **kwargs
     ):
         """
         Performs grid search over config items defined using "GridSearchable" objects and returns either full results or
@@ -737,37 +1009,26 @@ class BaseModel(object, metaclass=ABCMeta):
         :param eval_fn: An eval function that takes 2 inputs (prediction, truth) and returns a float, with a max value being desired.
         :param probs: If true, eval_fn is passed probability outputs from predict_proba, otherwise the output of predict is used.
         :param return_all: If True, all results are returned, if False, only the best config is returned.
+        :param n_workers: Number of processes to run configurations in parallel, defaults to running sequentially.
+        :param threads_per_worker: Limit on the number of tensorflow threads used by each worker process.
         :param kwargs: Keyword arguments to pass to get_config()
         :return: default is to return the best config object. If return_all is true, it returns a list of tuples of the
             form [(config, eval_fn output), ... ]
         """
-        if isinstance(Xs[0], str):
-            Xs = [Xs]
-        config = get_config(**kwargs)
-        config.val_size = 0.0
-        eval_fn = eval_fn or cls.get_eval_fn()
-
-        trainXs, testXs, trainY, testY = train_test_split(
-            list_transpose(Xs), Y, test_size=test_size, shuffle=True
+        results = sorted(
+            cls.iter_grid_search(
+                Xs,
+                Y,
+                test_size=test_size,
+                eval_fn=eval_fn,
+                probs=probs,
+                n_workers=n_workers,
+                threads_per_worker=threads_per_worker,
+                **kwargs
+            ),
+            key=lambda x: x[0],
         )
-        trainXs = list_transpose(trainXs)
-        testXs = list_transpose(testXs)
-        gs = config.get_grid_searchable()
-        ranged_keys = gs.keys()
-        ranged_iterators = gs.values()
-        grid_gen = itertools.product(*ranged_iterators)
-        results = []
-        for grid_item in grid_gen:
-            config_ = deepcopy(config)
-            config_.update(dict(zip(ranged_keys, grid_item)))
-            instance = cls(config=config_)
-            instance.finetune(*trainXs, Y=trainY)
-            if probs:
-                res = instance.predict_proba(*testXs)
-            else:
-                res = instance.predict(*testXs)
-            results.append((config_, eval_fn(res, testY)))
-            del instance
+        results = [(config, result) for _, _, config, result in results]
 
         if return_all:
             return results
@@ -784,6 +1045,8 @@ class BaseModel(object, metaclass=ABCMeta):
         eval_fn=None,
         probs=False,
         return_all=False,
+        n_workers=None,
+        threads_per_worker=None,
         **kwargs
     ):
         """
@@ -802,41 +1065,135 @@ class BaseModel(object, metaclass=ABCMeta):
             desired. An arithmetic mean must make sense for this metric.
         :param probs: If true, eval_fn is passed probability outputs from predict_proba, otherwise the output of predict is used.
         :param return_all: If True, all results are returned, if False, only the best config is returned.
+        :param n_workers: Number of processes to run configurations and splits in parallel, defaults to running sequentially.
+        :param threads_per_worker: Limit on the number of tensorflow threads used by each worker process.
         :param kwargs: Keyword arguments to pass to get_config()
         :return: default is to return the best config object. If return_all is true, it returns a list of tuples of the
             form [(config, eval_fn output), ... ]
         """
-        results = []
-        for _ in range(n_splits):
-            res = cls.finetune_grid_search(
-                Xs,
-                Y,
-                test_size=test_size,
-                probs=probs,
-                eval_fn=eval_fn,
-                return_all=True,
-                **kwargs
-            )
-            results.append(res)
-        results = list(zip(*results))
-        aggregated_results = []
-        for configuration in results:
-            config_common = None
-            sum_res = 0
-            n_res = 0
-            for config, result in configuration:
-                config_common = config_common or config
-                assert config == config_common
-                n_res += 1
-                sum_res += result
-            aggregated_results.append((config_common, sum_res / n_res))
+        configs = dict()
+        sum_res = defaultdict(float)
+        n_res = defaultdict(int)
+        for grid_idx, _, config, result in cls.iter_grid_search(
+            Xs,
+            Y,
+            test_size=test_size,
+            n_splits=n_splits,
+            eval_fn=eval_fn,
+            probs=probs,
+            n_workers=n_workers,
+            threads_per_worker=threads_per_worker,
+            **kwargs
+        ):
+            configs[grid_idx] = config
+            n_res[grid_idx] += 1
+            sum_res[grid_idx] += result
+
+        aggregated_results = [
+            (configs[grid_idx], sum_res[grid_idx] / n_res[grid_idx]) for grid_idx in sorted(configs)
+        ]
 
         if return_all:
             return aggregated_results
 
         return max(aggregated_results, key=lambda x: x[1])[0]
 
-    def process_long_sequence(self, zipped_data):
+    @classmethod
+    def finetune_successive_halving(
+        cls,
+        Xs,
+        Y,
+        *,
+        test_size,
+        eval_fn=None,
+        probs=False,
+        min_epochs=1,
+        eta=2,
+        max_rungs=None,
+        return_all=False,
+        **kwargs
+    ):
+        """
+        Successive halving search over config items defined using "GridSearchable" objects. Every configuration is
+        trained for `min_epochs` and evaluated on a held out split, then only the best 1 / `eta` of configurations
+        are kept. Survivors resume training from their in-memory weights, so that after rung r each has been trained
+        for `min_epochs * eta ** r` epochs in total, until a single configuration remains or `max_rungs` is reached.
+
+        :param Xs: Input text. Either [num_samples] or [sequence, num_samples] for single or multi input models respectively.
+        :param Y: Targets, A list of targets, [num_samples] that correspond to each sample in Xs.
+        :param test_size: Int or float. If an int is given this number of samples is used to validate, if a float is
+         given then that fraction of samples is used.
+        :param eval_fn: An eval function that takes 2 inputs (prediction, truth) and returns a float, with a max value being desired.
+        :param probs: If true, eval_fn is passed probability outputs from predict_proba, otherwise the output of predict is used.
+        :param min_epochs: Number of epochs each configuration is trained for in the first rung.
+        :param eta: Factor by which the number of configurations is reduced and the training budget increased per rung.
+        :param max_rungs: Optional maximum number of rungs.
+        :param return_all: If True, all results are returned, if False, only the best config is returned.
+        :param kwargs: Keyword arguments to pass to get_config()
+        :return: default is to return the best config object. If return_all is true, it returns a list of tuples of the
+            form [(config, eval_fn output, epochs trained), ... ] with the last evaluation of every configuration.
+        """
+        if eta < 2:
+            raise FinetuneError("Successive halving requires eta >= 2")
+        if isinstance(Xs[0], str):
+            Xs = [Xs]
+        config = get_config(**kwargs)
+        config.val_size = 0.0
+        eval_fn = eval_fn or cls.get_eval_fn()
+
+        trainXs, testXs, trainY, testY = train_test_split(
+            list_transpose(Xs), Y, test_size=test_size, shuffle=True
+        )
+        trainXs = list_transpose(trainXs)
+        testXs = list_transpose(testXs)
+
+        configs = cls._grid_configs(config)
+        survivors = list(range(len(configs)))
+        instances = dict()
+        results = dict()
+        epochs_trained = 0
+        rung_epochs = min_epochs
+        rung = 0
+        while True:
+            for idx in survivors:
+                if idx not in instances:
+                    instances[idx] = cls(**configs[idx])
+                instance = instances[idx]
+                # each rung is a further call to finetune and is scored with eval_fn on the held out split, as in
+                # grid search, rather than through the validation metrics recorded during training.
+                instance.config.n_epochs = rung_epochs
+                instance.finetune(*trainXs, Y=trainY)
+                if probs:
+                    res = instance.predict_proba(*testXs)
+                else:
+                    res = instance.predict(*testXs)
+                results[idx] = (configs[idx], eval_fn(res, testY), epochs_trained + rung_epochs)
+            epochs_trained += rung_epochs
+            rung += 1
+            LOGGER.info(
+                "Successive halving rung {}: {} configurations trained for {} epochs".format(
+                    rung, len(survivors), epochs_trained
+                )
+            )
+
+            if len(survivors) == 1 or (max_rungs is not None and rung >= max_rungs):
+                break
+
+            ranked = sorted(survivors, key=lambda idx: results[idx][1], reverse=True)
+            survivors = ranked[:max(1, len(ranked) // eta)]
+            for idx in ranked[len(survivors):]:
+                del instances[idx]
+            gc.collect()
+            rung_epochs = min_epochs * eta ** rung - epochs_trained
+
+        instances.clear()
+        all_results = [results[idx] for idx in range(len(configs))]
+        if return_all:
+            return all_results
+        best = max(survivors, key=lambda idx: results[idx][1])
+        return results[best][0]
+
+    def process_long_sequence(self, zipped_data, **kwargs):
         arr_encoded = [
             self.input_pipeline._text_to_ids(d["X"]) for d in zipped_data
         ]
@@ -853,6 +1210,7 @@ class BaseModel(object, metaclass=ABCMeta):
                 zipped_data,
                 predict_keys=[PredictMode.PROBAS, PredictMode.NORMAL],
                 chunked_length=len(flat_array_encoded),
+                **kwargs
         ):
             normal_pred = pred[PredictMode.NORMAL]
             if not hasattr(self, 'multi_label'):
@@ -3,7 +3,7 @@ import os
 import tensorflow as tf
 from finetune.util.shapes import lengths_from_eos_idx
 from finetune.base_models.bert.roberta_encoder import RoBERTaEncoder
-from finetune.base_models.bert.modeling import BertConfig, BertModel
+from finetune.base_models.bert.modeling import BertConfig, BertModel, EarlyExit, PruningMasks
 
 def get_decay_for_half(total_num_steps):
     decay = tf.minimum(tf.cast(tf.compat.v1.train.get_global_step(), tf.float32) / (total_num_steps / 2), 1.0)
@@ -18,6 +18,11 @@ def bert_featurizer(
     reuse=None,
     context=None,
     total_num_steps=None,
+    int8_predict=False,
+    predict_num_layers=None,
+    early_exit_outputs=None,
+    early_exit_threshold=None,
+    pruning_masks=False,
     **kwargs
 ):
     """
@@ -28,10 +33,19 @@ def bert_featurizer(
     :param config: A config object, containing all parameters for the featurizer.
     :param train: If this flag is true, dropout and losses are added to the graph.
     :param reuse: Should reuse be set within this scope.
+    :param int8_predict: Whether to build the inference graph with int8 weights.
+    :param predict_num_layers: If set, only the first `predict_num_layers` layers of the encoder are built.
+    :param early_exit_outputs: Number of outputs of the exit heads attached after each of `config.early_exit_layers`.
+    :param early_exit_threshold: If set, the batch exits at the first exit head that is confident for every document.
+    :param pruning_masks: Whether to multiply masks over the attention heads and intermediate units into the encoder.
     :return: A dict containing;
         embed_weights: the word embedding matrix.
         features: The output of the featurizer_final state.
         sequence_features: The output of the featurizer at each timestep.
+        early_exit_logits: When exit heads are attached, the logits of each exit head.
+        exit_logits, exit_layer: When the batch can exit early, the logits of the exit it took and the number of
+            layers that were run.
+        pruning_masks: When `pruning_masks` is set, a tuple of the per layer head masks and intermediate masks.
     """
 
     is_roberta = issubclass(config.base_model.encoder, RoBERTaEncoder)
@@ -42,8 +56,9 @@ def bert_featurizer(
         vocab_size=encoder.vocab_size,
         hidden_size=config.n_embed,
         num_hidden_layers=config.n_layer,
-        num_attention_heads=config.n_heads,
-        intermediate_size=config.bert_intermediate_size,
+        num_attention_heads=config.bert_heads_per_layer or config.n_heads,
+        intermediate_size=config.bert_intermediate_size_per_layer or config.bert_intermediate_size,
+        attention_head_size=config.n_embed // config.n_heads,
         hidden_act=config.act_fn,
         hidden_dropout_prob=config.resid_p_drop,
         attention_probs_dropout_prob=config.attn_p_drop,
@@ -56,7 +71,10 @@ def bert_featurizer(
         reading_order_removed=config.reading_order_removed,
         anneal_reading_order=config.anneal_reading_order,
         positional_channels=config.context_channels,
+        int8_inference=int8_predict,
     )
+    if predict_num_layers is not None:
+        bert_config.num_hidden_layers = min(predict_num_layers, config.n_layer)
 
     initial_shape = tf.shape(input=X)
     X = tf.reshape(X, shape=tf.concat(([-1], initial_shape[-1:]), 0))
@@ -99,6 +117,18 @@ def bert_featurizer(
     else:
         reading_order_decay_rate = None
 
+    early_exit = None
+    if early_exit_outputs is not None and config.early_exit_layers:
+        with tf.compat.v1.variable_scope("model/early_exit", reuse=reuse) as early_exit_scope:
+            early_exit = EarlyExit(
+                exit_layers=config.early_exit_layers,
+                n_outputs=early_exit_outputs,
+                threshold=early_exit_threshold,
+                scope=early_exit_scope,
+            )
+
+    masks = PruningMasks() if pruning_masks else None
+
     with tf.compat.v1.variable_scope("model/featurizer", reuse=reuse):
         bert = BertModel(
             config=bert_config,
@@ -113,6 +143,8 @@ def bert_featurizer(
             use_token_type=config.bert_use_type_embed,
             roberta=is_roberta,
             reading_order_decay_rate=reading_order_decay_rate,
+            early_exit=early_exit,
+            pruning_masks=masks,
         )
 
         embed_weights = bert.get_embedding_table()
@@ -135,4 +167,20 @@ def bert_featurizer(
         if config.num_layers_trained == 0:
             output_state = {k: tf.stop_gradient(v) for k, v in output_state.items()}
 
+        if masks is not None:
+            output_state["pruning_masks"] = (masks.head_masks, masks.ffn_masks)
+
+        if early_exit is not None:
+            if early_exit.threshold is None:
+                # with a threshold the heads are built inside of the conditional layers and are only used there
+                output_state["early_exit_logits"] = [early_exit.logits[k] for k in sorted(early_exit.logits)]
+            n_layers = bert_config.num_hidden_layers
+            if early_exit.exit_logits is not None:
+                output_state["exit_logits"] = early_exit.exit_logits
+                output_state["exit_layer"] = early_exit.exit_layer
+            elif n_layers < config.n_layer and n_layers in early_exit.logits:
+                # truncated to an exit layer, so use its head rather than the head trained on the last layer.
+                output_state["exit_logits"] = early_exit.logits[n_layers]
+                output_state["exit_layer"] = tf.constant(n_layers)
+
         return output_state
@@ -23,6 +23,7 @@ import functools
 
 from finetune.optimizers.recompute_grads import recompute_grad
 from finetune.nn.auxiliary import embed_position
+from finetune.nn.quantization import get_dense_fn
 
 class BertConfig(object):
     """Configuration for `BertModel`."""
@@ -45,6 +46,8 @@ class BertConfig(object):
             reading_order_removed=False,
             anneal_reading_order=False,
             positional_channels=None,
+            int8_inference=False,
+            attention_head_size=None,
     ):
         """Constructs BertConfig.
 
@@ -53,9 +56,9 @@ class BertConfig(object):
         hidden_size: Size of the encoder layers and the pooler layer.
         num_hidden_layers: Number of hidden layers in the Transformer encoder.
         num_attention_heads: Number of attention heads for each attention layer in
-            the Transformer encoder.
+            the Transformer encoder, or a list with the number for each layer.
         intermediate_size: The size of the "intermediate" (i.e., feed-forward)
-            layer in the Transformer encoder.
+            layer in the Transformer encoder, or a list with the size for each layer.
         hidden_act: The non-linear activation function (function or string) in the
             encoder and pooler.
         hidden_dropout_prob: The dropout probability for all fully connected
@@ -69,6 +72,11 @@ class BertConfig(object):
             `BertModel`.
         initializer_range: The stdev of the truncated_normal_initializer for
             initializing all weight matrices.
+        int8_inference: Whether the dense layers of the encoder and pooler use
+            int8 weights. Only valid for inference.
+        attention_head_size: Size of each attention head. Defaults to
+            `hidden_size / num_attention_heads`, it must be set when the number of
+            heads varies between layers.
     """
         self.vocab_size = vocab_size
         self.hidden_size = hidden_size
@@ -86,6 +94,8 @@ class BertConfig(object):
         self.reading_order_removed = reading_order_removed
         self.anneal_reading_order = anneal_reading_order
         self.positional_channels = positional_channels
+        self.int8_inference = int8_inference
+        self.attention_head_size = attention_head_size
 
     @classmethod
     def from_dict(cls, json_object):
@@ -112,6 +122,75 @@ class BertConfig(object):
         return json.dumps(self.to_dict(), indent=2, sort_keys=True) + "\n"
 
 
+class EarlyExit(object):
+    """Lightweight exit heads attached to intermediate layers of the encoder.
+
+    Each head is a linear layer over the first token of a layer's output. The
+    heads read the encoder through `stop_gradient`, so training them does not
+    change the encoder. When `threshold` is set, `transformer_model` only runs
+    the layers after an exit if some document in the batch is predicted by that
+    exit's head with a probability below the threshold.
+    """
+
+    def __init__(self, exit_layers, n_outputs, threshold=None, scope=None):
+        """Constructs EarlyExit.
+
+        Args:
+            exit_layers: Numbers of layers after which to attach an exit head,
+                e.g. [4, 8] attaches heads after the 4th and 8th layers.
+            n_outputs: int. Number of outputs of each head.
+            threshold: (optional) float. Exit once every document in the batch
+                has a predicted probability of at least `threshold`.
+            scope: (optional) variable scope for the heads.
+        """
+        self.exit_layers = set(exit_layers)
+        self.n_outputs = n_outputs
+        self.threshold = threshold
+        self.scope = scope
+        self.logits = dict()
+        self.exit_logits = None
+        self.exit_layer = None
+
+    def __call__(self, layer_idx, layer_output, batch_size, seq_length):
+        """Returns the logits of the head after layer `layer_idx`, if there is one."""
+        n_layers = layer_idx + 1
+        if n_layers not in self.exit_layers:
+            return None
+        width = get_shape_list(layer_output)[-1]
+        first_token = tf.reshape(layer_output, [batch_size, seq_length, width])[:, 0]
+        with tf.compat.v1.variable_scope(self.scope or "early_exit", reuse=tf.compat.v1.AUTO_REUSE):
+            logits = tf.compat.v1.layers.dense(
+                tf.stop_gradient(first_token), self.n_outputs, name="exit_%d" % n_layers
+            )
+        self.logits.setdefault(n_layers, logits)
+        return logits
+
+    def is_confident(self, logits):
+        probas = tf.nn.softmax(logits, axis=-1)
+        return tf.reduce_min(input_tensor=tf.reduce_max(input_tensor=probas, axis=-1)) >= self.threshold
+
+
+class PruningMasks(object):
+    """Masks over the attention heads and intermediate units of each layer.
+
+    The masks are all ones, so they do not change the output of the encoder.
+    They have a batch dimension so that the gradient of a loss with respect to
+    them gives the importance of each head and unit for each document.
+    """
+
+    def __init__(self):
+        self.head_masks = []
+        self.ffn_masks = []
+
+    def __call__(self, batch_size, num_attention_heads, intermediate_size, dtype=tf.float32):
+        """Creates the head and intermediate masks for the next layer."""
+        head_mask = tf.ones([batch_size, num_attention_heads], dtype=dtype)
+        ffn_mask = tf.ones([batch_size, intermediate_size], dtype=dtype)
+        self.head_masks.append(head_mask)
+        self.ffn_masks.append(ffn_mask)
+        return head_mask, ffn_mask
+
+
 class BertModel(object):
     """BERT model ("Bidirectional Encoder Representations from Transformers").
 
@@ -150,6 +229,8 @@ class BertModel(object):
             roberta=False,
             use_token_type=True,
             reading_order_decay_rate=None,
+            early_exit=None,
+            pruning_masks=None,
     ):
         """Constructor for BertModel.
 
@@ -163,6 +244,10 @@ class BertModel(object):
             use_one_hot_embeddings: (optional) bool. Whether to use one-hot word
             embeddings or tf.embedding_lookup() for the word embeddings.
             scope: (optional) variable scope. Defaults to "bert".
+            early_exit: (optional) `EarlyExit` instance adding exit heads to
+                intermediate layers of the encoder.
+            pruning_masks: (optional) `PruningMasks` instance to hold masks over the
+                heads and intermediate units of the encoder.
 
         Raises:
             ValueError: The config is invalid or one of the input tensor shapes
@@ -229,12 +314,16 @@ class BertModel(object):
                     num_hidden_layers=config.num_hidden_layers,
                     num_attention_heads=config.num_attention_heads,
                     intermediate_size=config.intermediate_size,
+                    attention_head_size=config.attention_head_size,
                     intermediate_act_fn=get_activation(config.hidden_act),
                     hidden_dropout_prob=config.hidden_dropout_prob,
                     attention_probs_dropout_prob=config.attention_probs_dropout_prob,
                     initializer_range=config.initializer_range,
                     do_return_all_layers=True,
-                    low_memory_mode=config.low_memory_mode and is_training
+                    low_memory_mode=config.low_memory_mode and is_training,
+                    int8_inference=config.int8_inference,
+                    early_exit=early_exit,
+                    pruning_masks=pruning_masks,
                 )
                 self.sequence_output = self.all_encoder_layers[-1]
 
@@ -249,7 +338,7 @@ class BertModel(object):
 
                 first_token_tensor = tf.squeeze(self.sequence_output[:, 0:1, :], axis=1)
                 if use_pooler:
-                    self.pooled_output = tf.compat.v1.layers.dense(
+                    self.pooled_output = get_dense_fn(config.int8_inference)(
                         first_token_tensor,
                         config.hidden_size,
                         activation=tf.tanh,
@@ -640,6 +729,8 @@ def attention_layer(
         batch_size=None,
         from_seq_length=None,
         to_seq_length=None,
+        int8_inference=False,
+        head_mask=None,
 ):
     """Performs multi-headed attention from `from_tensor` to `to_tensor`.
 
@@ -687,6 +778,9 @@ def attention_layer(
             of the 3D version of the `from_tensor`.
         to_seq_length: (Optional) If the input is 2D, this might be the seq length
             of the 3D version of the `to_tensor`.
+        int8_inference: bool. Whether to use int8 weights for the projections.
+        head_mask: (optional) float Tensor of shape [batch_size,
+            num_attention_heads] multiplied into the output of each head.
 
     Returns:
         float Tensor of shape [batch_size, from_seq_length,
@@ -737,9 +831,10 @@ def attention_layer(
 
     from_tensor_2d = reshape_to_matrix(from_tensor)
     to_tensor_2d = reshape_to_matrix(to_tensor)
+    dense = get_dense_fn(int8_inference)
 
     # `query_layer` = [B*F, N*H]
-    query_layer = tf.compat.v1.layers.dense(
+    query_layer = dense(
         from_tensor_2d,
         num_attention_heads * size_per_head,
         activation=query_act,
@@ -748,7 +843,7 @@ def attention_layer(
     )
 
     # `key_layer` = [B*T, N*H]
-    key_layer = tf.compat.v1.layers.dense(
+    key_layer = dense(
         to_tensor_2d,
         num_attention_heads * size_per_head,
         activation=key_act,
@@ -757,7 +852,7 @@ def attention_layer(
     )
 
     # `value_layer` = [B*T, N*H]
-    value_layer = tf.compat.v1.layers.dense(
+    value_layer = dense(
         to_tensor_2d,
         num_attention_heads * size_per_head,
         activation=value_act,
@@ -816,6 +911,9 @@ def attention_layer(
     # `context_layer` = [B, N, F, H]
     context_layer = tf.matmul(attention_probs, value_layer)
 
+    if head_mask is not None:
+        context_layer *= head_mask[:, :, None, None]
+
     # `context_layer` = [B, F, N, H]
     context_layer = tf.transpose(a=context_layer, perm=[0, 2, 1, 3])
 
@@ -848,7 +946,15 @@ def full_block(
         hidden_dropout_prob=0.1,
         attention_probs_dropout_prob=0.1,
         initializer_range=0.02,
+        int8_inference=False,
+        pruning_masks=None,
 ):
+    dense = get_dense_fn(int8_inference)
+    head_mask = ffn_mask = None
+    if pruning_masks is not None:
+        head_mask, ffn_mask = pruning_masks(
+            batch_size, num_attention_heads, intermediate_size, dtype=layer_input.dtype
+        )
     with tf.compat.v1.variable_scope("attention"):
         attention_heads = []
         with tf.compat.v1.variable_scope("self"):
@@ -863,7 +969,9 @@ def full_block(
                 do_return_2d_tensor=True,
                 batch_size=batch_size,
                 from_seq_length=seq_length,
-                to_seq_length=seq_length
+                to_seq_length=seq_length,
+                int8_inference=int8_inference,
+                head_mask=head_mask,
             )
             attention_heads.append(attention_head)
 
@@ -877,7 +985,7 @@ def full_block(
         # Run a linear projection of `hidden_size` then add a residual
         # with `layer_input`.
         with tf.compat.v1.variable_scope("output"):
-            attention_output = tf.compat.v1.layers.dense(
+            attention_output = dense(
                 attention_output,
                 hidden_size,
                 kernel_initializer=create_initializer(initializer_range))
@@ -886,15 +994,20 @@ def full_block(
 
     # The activation is only applied to the "intermediate" hidden layer.
     with tf.compat.v1.variable_scope("intermediate"):
-        intermediate_output = tf.compat.v1.layers.dense(
+        intermediate_output = dense(
             attention_output,
             intermediate_size,
             activation=intermediate_act_fn,
             kernel_initializer=create_initializer(initializer_range))
+        if ffn_mask is not None:
+            intermediate_output = tf.reshape(
+                tf.reshape(intermediate_output, [batch_size, seq_length, intermediate_size]) * ffn_mask[:, None],
+                [-1, intermediate_size],
+            )
 
     # Down-project back to `hidden_size` then add the residual.
     with tf.compat.v1.variable_scope("output"):
-        layer_output = tf.compat.v1.layers.dense(
+        layer_output = dense(
             intermediate_output,
             hidden_size,
             kernel_initializer=create_initializer(initializer_range))
@@ -914,7 +1027,11 @@ def transformer_model(input_tensor,
                       attention_probs_dropout_prob=0.1,
                       initializer_range=0.02,
                       do_return_all_layers=False,
-                      low_memory_mode=False):
+                      low_memory_mode=False,
+                      int8_inference=False,
+                      early_exit=None,
+                      attention_head_size=None,
+                      pruning_masks=None):
     """Multi-headed, multi-layer Transformer from "Attention is All You Need".
 
     This is almost an exact implementation of the original Transformer encoder.
@@ -932,9 +1049,10 @@ def transformer_model(input_tensor,
             positions that should not be.
         hidden_size: int. Hidden size of the Transformer.
         num_hidden_layers: int. Number of layers (blocks) in the Transformer.
-        num_attention_heads: int. Number of attention heads in the Transformer.
+        num_attention_heads: int. Number of attention heads in the Transformer, or
+            a list with the number of heads of each layer.
         intermediate_size: int. The size of the "intermediate" (a.k.a., feed
-            forward) layer.
+            forward) layer, or a list with the size for each layer.
         intermediate_act_fn: function. The non-linear activation function to apply
             to the output of the intermediate/feed-forward layer.
         hidden_dropout_prob: float. Dropout probability for the hidden layers.
@@ -945,6 +1063,16 @@ def transformer_model(input_tensor,
         do_return_all_layers: Whether to also return all layers or just the final
             layer.
         low_memory_mode: Whether to use gradient checkpointing.
+        int8_inference: Whether to use int8 weights for the dense layers.
+        early_exit: (optional) `EarlyExit` instance. Its heads are applied after
+            each layer, and if it has a threshold the layers after each exit are
+            only run when the exit is not confident. In that case only the
+            output of the layer the batch exited at is returned and the
+            exit logits and layer are set on `early_exit`.
+        attention_head_size: (optional) int. Size of each attention head, required
+            when `num_attention_heads` is a list.
+        pruning_masks: (optional) `PruningMasks` instance, masks over the heads and
+            intermediate units of each layer are added to it.
 
     Returns:
         float Tensor of shape [batch_size, seq_length, hidden_size], the final
@@ -953,12 +1081,29 @@ def transformer_model(input_tensor,
     Raises:
         ValueError: A Tensor shape or parameter is invalid.
     """
-    if hidden_size % num_attention_heads != 0:
+    if isinstance(num_attention_heads, int):
+        layer_heads = [num_attention_heads] * num_hidden_layers
+    else:
+        layer_heads = list(num_attention_heads)
+    if isinstance(intermediate_size, int):
+        layer_intermediate_sizes = [intermediate_size] * num_hidden_layers
+    else:
+        layer_intermediate_sizes = list(intermediate_size)
+    if len(layer_heads) < num_hidden_layers or len(layer_intermediate_sizes) < num_hidden_layers:
         raise ValueError(
-            "The hidden size (%d) is not a multiple of the number of attention "
-            "heads (%d)" % (hidden_size, num_attention_heads))
+            "Per layer attention heads and intermediate sizes must be given for "
+            "each of the %d layers" % num_hidden_layers)
 
-    attention_head_size = int(hidden_size / num_attention_heads)
+    if attention_head_size is None:
+        if not isinstance(num_attention_heads, int):
+            raise ValueError(
+                "attention_head_size must be set when the number of attention heads "
+                "varies between layers")
+        if hidden_size % num_attention_heads != 0:
+            raise ValueError(
+                "The hidden size (%d) is not a multiple of the number of attention "
+                "heads (%d)" % (hidden_size, num_attention_heads))
+        attention_head_size = int(hidden_size / num_attention_heads)
     input_shape = get_shape_list(input_tensor, expected_rank=3)
     batch_size = input_shape[0]
     seq_length = input_shape[1]
@@ -976,31 +1121,58 @@ def transformer_model(input_tensor,
     # help the optimizer.
     prev_output = reshape_to_matrix(input_tensor)
 
-    all_layer_outputs = []
-    for layer_idx in range(num_hidden_layers):
+    def layer_fn(layer_idx, layer_input, pruning_masks=None):
         with tf.compat.v1.variable_scope("layer_%d" % layer_idx):
-            layer_input = prev_output
-
             block_fn = functools.partial(full_block,
                                          attention_head_size=attention_head_size,
                                          batch_size=batch_size,
                                          seq_length=seq_length,
                                          attention_mask=attention_mask,
                                          hidden_size=hidden_size,
-                                         num_attention_heads=num_attention_heads,
-                                         intermediate_size=intermediate_size,
+                                         num_attention_heads=layer_heads[layer_idx],
+                                         intermediate_size=layer_intermediate_sizes[layer_idx],
                                          intermediate_act_fn=intermediate_act_fn,
                                          hidden_dropout_prob=hidden_dropout_prob,
                                          attention_probs_dropout_prob=attention_probs_dropout_prob,
                                          initializer_range=initializer_range,
+                                         int8_inference=int8_inference,
+                                         pruning_masks=pruning_masks,
             )
 
             if low_memory_mode:
                 block_fn = recompute_grad(block_fn, use_entire_scope=True)
 
-            layer_output = block_fn(layer_input)
-            prev_output = layer_output
-            all_layer_outputs.append(layer_output)
+            return block_fn(layer_input)
+
+    if early_exit is not None and early_exit.threshold is not None:
+        def run_from(start, layer_input, exit_logits):
+            output = layer_input
+            for layer_idx in range(start, num_hidden_layers - 1):
+                output = layer_fn(layer_idx, output)
+                logits = early_exit(layer_idx, output, batch_size, seq_length)
+                if logits is not None:
+                    return tf.cond(
+                        pred=early_exit.is_confident(logits),
+                        true_fn=lambda: (output, logits, tf.constant(layer_idx + 1)),
+                        false_fn=lambda: run_from(layer_idx + 1, output, logits),
+                    )
+            output = layer_fn(num_hidden_layers - 1, output)
+            logits = early_exit(num_hidden_layers - 1, output, batch_size, seq_length)
+            if logits is not None:
+                exit_logits = logits
+            return output, exit_logits, tf.constant(num_hidden_layers)
+
+        # Each layer is built once, after the exit before it, so computation
+        # stops at the first confident exit.
+        prev_output, early_exit.exit_logits, early_exit.exit_layer = run_from(0, prev_output, None)
+        all_layer_outputs = [prev_output]
+    else:
+        all_layer_outputs = []
+        for layer_idx in range(num_hidden_layers):
+            prev_output = layer_fn(layer_idx, prev_output, pruning_masks=pruning_masks)
+            all_layer_outputs.append(prev_output)
+            if early_exit is not None:
+                early_exit(layer_idx, prev_output, batch_size, seq_length)
 
     if do_return_all_layers:
         final_outputs = []
@@ -7,6 +7,7 @@ from finetune.optimizers.recompute_grads import recompute_grad
 from finetune.util.shapes import shape_list, lengths_from_eos_idx
 from finetune.nn.activations import act_fns
 from finetune.nn.nn_utils import dropout, norm
+from finetune.nn.quantization import quantized_weight_variables, int8_matmul
 
 
 def mask_attn_weights(w):
@@ -98,9 +99,17 @@ def conv1d(
     b_init=tf.compat.v1.constant_initializer(0),
     pad="VALID",
     train=False,
+    int8=False,
 ):
     with tf.compat.v1.variable_scope(scope):
         nx = shape_list(x)[-1]
+        if int8 and rf == 1:  # inference with int8 weights
+            w_q, w_scale = quantized_weight_variables("w", nx, nf)
+            b = tf.compat.v1.get_variable("b", [nf], initializer=b_init)
+            return tf.reshape(
+                int8_matmul(tf.reshape(x, [-1, nx]), w_q, w_scale) + b,
+                shape_list(x)[:-1] + [nf],
+            )
         w = tf.compat.v1.get_variable("w", [rf, nx, nf], initializer=w_init)
         b = tf.compat.v1.get_variable("b", [nf], initializer=b_init)
         if rf == 1:  # faster 1x1 conv
@@ -113,8 +122,8 @@ def conv1d(
         return c
 
 
-def multihead_qkv(x, n_state, n_head, train, explain=False):
-    c = conv1d(x, "c_attn", n_state * 3, 1, train=train)
+def multihead_qkv(x, n_state, n_head, train, explain=False, int8=False):
+    c = conv1d(x, "c_attn", n_state * 3, 1, train=train, int8=int8)
     q, k, v = tf.split(c, 3, 2)
     q = split_heads(q, n_head)
     k = split_heads(k, n_head, k=True)
@@ -134,25 +143,26 @@ def attn(
     mask=True,
     explain=False,
     lengths=None,
+    int8=False,
 ):
     assert n_state % n_head == 0
     with tf.compat.v1.variable_scope(scope):
-        q, k, v = multihead_qkv(x, n_state, n_head, train, explain)
+        q, k, v = multihead_qkv(x, n_state, n_head, train, explain, int8=int8)
         w = attn_weights(q, k, v, scale=scale, mask=mask, explain=explain, lengths=lengths)
         w = dropout(w, attn_pdrop, train)
         a = tf.matmul(w, v)
         a = merge_heads(a)
-        a = conv1d(a, "c_proj", n_state, 1, train=train)
+        a = conv1d(a, "c_proj", n_state, 1, train=train, int8=int8)
         a = dropout(a, resid_pdrop, train)
         return a
 
 
-def mlp(x, scope, n_state, act_fn, resid_pdrop, train=False):
+def mlp(x, scope, n_state, act_fn, resid_pdrop, train=False, int8=False):
     with tf.compat.v1.variable_scope(scope):
         nx = shape_list(x)[-1]
         act = act_fns[act_fn]
-        h = act(conv1d(x, "c_fc", n_state, 1, train=train))
-        h2 = conv1d(h, "c_proj", nx, 1, train=train)
+        h = act(conv1d(x, "c_fc", n_state, 1, train=train, int8=int8))
+        h2 = conv1d(h, "c_proj", nx, 1, train=train, int8=int8)
         h2 = dropout(h2, resid_pdrop, train)
         return h2
 
@@ -172,6 +182,7 @@ def block(
     train=False,
     scale=False,
     explain=False,
+    int8=False,
 ):
     with tf.compat.v1.variable_scope(scope):
         nx = shape_list(x)[-1]
@@ -185,9 +196,10 @@ def block(
             train=train,
             scale=scale,
             explain=explain,
+            int8=int8,
         )
         n = norm(x + a, "ln_1")
-        m = mlp(n, "mlp", nx * 4, act_fn, resid_pdrop, train=train)
+        m = mlp(n, "mlp", nx * 4, act_fn, resid_pdrop, train=train, int8=int8)
         h = norm(n + m, "ln_2")
         return h
 
@@ -218,6 +230,7 @@ def gpt_featurizer(
     train=False,
     reuse=None,
     explain=False,
+    int8_predict=False,
     **kwargs
 ):
     """
@@ -228,6 +241,7 @@ def gpt_featurizer(
     :param config: A config object, containing all parameters for the featurizer.
     :param train: If this flag is true, dropout and losses are added to the graph.
     :param reuse: Should reuse be set within this scope.
+    :param int8_predict: Whether to build the inference graph with int8 weights.
     :return: A dict containing;
         embed_weights: the word embedding matrix.
         features: The output of the featurizer_final state.
@@ -279,6 +293,7 @@ def gpt_featurizer(
                     train=train_layer,
                     scale=True,
                     explain=explain,
+                    int8=int8_predict,
                 )
                 if config.low_memory_mode and train_layer:
                     block_fn = recompute_grad(block_fn, use_entire_scope=True)
@@ -291,7 +306,7 @@ def gpt_featurizer(
             if layer == config.n_layer - 1:
                 with tf.compat.v1.variable_scope("h%d_/h%d/attn" % (layer, layer), reuse=True):
                     q, k, v = multihead_qkv(
-                        h, n_state=shape_list(h)[-1], n_head=config.n_heads, train=train
+                        h, n_state=shape_list(h)[-1], n_head=config.n_heads, train=train, int8=int8_predict
                     )
                     w = attn_weights(q, k, v, scale=True)
 
@@ -6,6 +6,7 @@ from finetune.util.shapes import shape_list, lengths_from_eos_idx
 from finetune.optimizers.recompute_grads import recompute_grad
 from finetune.nn.activations import gelu
 from finetune.base_models.gpt.featurizer import norm, dropout, get_pos_values
+from finetune.nn.quantization import quantized_weight_variables, int8_matmul
 
 
 def softmax(x, axis=-1):
@@ -26,9 +27,13 @@ def merge_states(x):
     return tf.reshape(x, start + [a * b])
 
 
-def conv1d(x, scope, nf, *, w_init_stdev=0.02):
+def conv1d(x, scope, nf, *, w_init_stdev=0.02, int8=False):
     with tf.compat.v1.variable_scope(scope):
         *start, nx = shape_list(x)
+        if int8:
+            w_q, w_scale = quantized_weight_variables("w", nx, nf)
+            b = tf.compat.v1.get_variable("b", [nf], initializer=tf.compat.v1.constant_initializer(0))
+            return tf.reshape(int8_matmul(tf.reshape(x, [-1, nx]), w_q, w_scale) + b, start + [nf])
         w = tf.compat.v1.get_variable(
             "w",
             [1, nx, nf],
@@ -52,7 +57,7 @@ def attention_mask(nd, ns, *, dtype):
     return tf.cast(m, dtype)
 
 
-def attn(x, scope, n_state, *, past, hparams, train=False):
+def attn(x, scope, n_state, *, past, hparams, train=False, int8=False):
     assert x.shape.ndims == 3  # Should be [batch, sequence, features]
     assert n_state % hparams.n_heads == 0
     if past is not None:
@@ -88,7 +93,7 @@ def attn(x, scope, n_state, *, past, hparams, train=False):
         return a
 
     with tf.compat.v1.variable_scope(scope):
-        c = conv1d(x, "c_attn", n_state * 3)
+        c = conv1d(x, "c_attn", n_state * 3, int8=int8)
         q, k, v = map(split_heads, tf.split(c, 3, axis=2))
         if past is not None:
             pk, pv = tf.unstack(past, axis=1)
@@ -96,25 +101,25 @@ def attn(x, scope, n_state, *, past, hparams, train=False):
             v = tf.concat([pv, v], axis=-2)
         a = multihead_attn(q, k, v, hparams.attn_p_drop, train=train)
         a = merge_heads(a)
-        a = conv1d(a, "c_proj", n_state)
+        a = conv1d(a, "c_proj", n_state, int8=int8)
         a = dropout(a, hparams.resid_p_drop, train=train)
         return a
 
 
-def mlp(x, scope, n_state, *, hparams, train=False):
+def mlp(x, scope, n_state, *, hparams, train=False, int8=False):
     with tf.compat.v1.variable_scope(scope):
         nx = x.shape[-1]
-        h = gelu(conv1d(x, "c_fc", n_state))
-        h2 = conv1d(h, "c_proj", nx)
+        h = gelu(conv1d(x, "c_fc", n_state, int8=int8))
+        h2 = conv1d(h, "c_proj", nx, int8=int8)
         h2 = dropout(h2, hparams.resid_p_drop, train=train)
         return h2
 
 
-def block(x, *, past, hparams, train=False):
+def block(x, *, past, hparams, train=False, int8=False):
     nx = x.shape[-1]
-    a = attn(norm(x, "ln_1"), "attn", nx, past=past, hparams=hparams, train=train)
+    a = attn(norm(x, "ln_1"), "attn", nx, past=past, hparams=hparams, train=train, int8=int8)
     x = x + a
-    m = mlp(norm(x, "ln_2"), "mlp", nx * 4, hparams=hparams, train=train)
+    m = mlp(norm(x, "ln_2"), "mlp", nx * 4, hparams=hparams, train=train, int8=int8)
     x = x + m
     return x
 
@@ -155,6 +160,7 @@ def gpt2_featurizer(
     config,
     train=False,
     reuse=None,
+    int8_predict=False,
     **kwargs
 ):
     initial_shape = tf.shape(input=X)
@@ -190,7 +196,7 @@ def gpt2_featurizer(
 
             with tf.compat.v1.variable_scope("h%d" % layer):
                 block_fn = functools.partial(
-                    block, past=past, hparams=config, train=train
+                    block, past=past, hparams=config, train=train, int8=int8_predict
                 )
                 if config.low_memory_mode and train_layer:
                     block_fn = recompute_grad(block_fn, use_entire_scope=True)
@@ -70,6 +70,12 @@ class Settings(dict):
     :param low_memory_mode: When True, only store partial gradients on forward pass
         and recompute remaining gradients incrementally in order to save memory.  Defaults to `False`.
     :param float_16_predict: Whether to run prediction in float 16 mode, this is only available for bert based models and will likely only yield performance improvements on GPUs with native float16 support such as Volta and Tesla.
+    :param int8_predict: Whether to run prediction with int8 weights for the dense and attention projections of bert, gpt and gpt2 based models. Weights are quantized per output channel when the model is loaded and activations are quantized on the fly. Intended for CPU inference, check the accuracy of your model with speed_benchmarks/int8_quantization.py before enabling.
+    :param predict_num_layers: When set, prediction only runs the first `predict_num_layers` layers of bert based models, trading accuracy for speed. If there is an exit head after that layer (see `early_exit_layers`) it is used for classification. Defaults to `None`, which runs every layer.
+    :param early_exit_layers: List of layer numbers of a bert based `Classifier` after which to train a lightweight exit head, e.g. `[4, 8]`. The heads are trained alongside the model without changing it. Defaults to `None`.
+    :param early_exit_threshold: When set along with `early_exit_layers`, prediction stops at the first exit head that predicts every document in the batch with at least this probability. This only changes predictions, not features. Can be set when loading a model. Defaults to `None`.
+    :param bert_heads_per_layer: List of the number of attention heads kept in each layer of a bert based model that has been pruned with `finetune.util.pruning.prune`. Defaults to `None`, every layer has `n_heads` heads.
+    :param bert_intermediate_size_per_layer: List of the intermediate sizes kept in each layer of a pruned bert based model. Defaults to `None`, every layer has `bert_intermediate_size` units.
     :param optimize_for: Optimize auto parameters for either `accuracy`, `speed`, or `predict_speed` Defaults to `accuracy`
     :param embed_p_drop: Embedding dropout probability.  Defaults to `0.1`.
     :param attn_p_drop: Attention dropout probability.  Defaults to `0.1`.
@@ -120,7 +126,38 @@ class Settings(dict):
     :param regression_loss: the loss to use for regression models. One of `L1` or `L2`, defaults to `L2`.
     :param debugging_logs: if True, output tensorflow logs and turn off TQDM logging. Defaults to `False`.
     :param val_set: Where it is neccessary to use an explicit validation set, provide it here as a tuple (text, labels)
+    :param predict_window_size: Number of documents tokenized, sorted by length and predicted together by the
+        `predict_iter` family of methods. Bounds memory usage when predicting on unbounded streams. Defaults to `1000`.
+    :param tokenize_workers: Number of worker processes used to tokenize documents in the input pipeline.
+        Values of `None` or `1` tokenize in the calling thread. Workers are spawned the first time they are needed
+        and shut down by `model.close()`. Defaults to `None`.
+    :param tokenization_cache_size: Maximum number of encoded documents to keep in an LRU cache keyed by document content,
+        so repeated documents skip tokenization. `None` or `0` disables the cache. Defaults to `None`.
+    :param tokenization_cache_path: File the tokenization cache is loaded from if it exists.
+        Call `model.input_pipeline.tokenization_cache.save()` to persist the cache. Defaults to `None`.
+    :param feature_cache_path: Directory to cache the outputs of a frozen base model (`num_layers_trained=0`) in. The training
+        and validation documents are featurized once and stored in float16, then every epoch trains only the target model
+        from the cache. Later fits on the same documents with the same base model reuse the cache. Defaults to `None`.
+    :param length_bucketing: Group training examples of similar token length into the same batch to reduce padding.
+        Batches within each bucket are formed in the shuffled order of the training data. Defaults to `False`.
+    :param n_length_buckets: Number of length buckets to use when `length_bucketing` is enabled. Defaults to `8`.
+    :param predict_batch_tokens: When set, prediction batches are formed by a budget on the padded number of tokens
+        (batch size * longest sequence) rather than a fixed number of examples, and `predict_batch_size` is ignored.
+        Works best alongside `sort_by_length`. Defaults to `None`.
+    :param offset_sequence_reconstruction: Build sequence labeling annotations directly from subtoken character offsets
+        and snap them to regex based word boundaries, rather than re-running spacy over each predicted document.
+        Linear in document length, but word boundaries can differ slightly from spacy's. Defaults to `False`.
+    :param save_workers: Number of threads used to compare weights against the base model when saving,
+        so that only changed weights are written. Values of `None` or `1` compare in the calling thread. Defaults to `None`.
+    :param save_delta: Save weights as compressed differences against the base model weights, which must be available
+        when the model is loaded. Defaults to `False`.
+    :param save_delta_tolerance: When set, delta checkpoints are quantized so that each weight is reconstructed to within
+        this absolute tolerance, giving much smaller files. When `None` weights are reconstructed exactly. Defaults to `None`.
+    :param distillation_temperature: Softmax temperature applied to the teacher's probabilities and the student's logits
+        by `DistillationClassifier` and `DistillationSequenceLabeler`. Defaults to `2.0`.
     :param per_process_gpu_memory_fraction: fraction of the overall amount of memory that each visible GPU should be allocated, defaults to `1.0`.
+    :param num_threads: Number of threads tensorflow uses within an op and to run ops in parallel. Defaults to `None`,
+        which lets tensorflow use every core.
     """
 
     def get_grid_searchable(self):
@@ -186,6 +223,10 @@ def get_default_config():
         # General Settings
         low_memory_mode=False,
         float_16_predict=False,
+        int8_predict=False,
+        predict_num_layers=None,
+        early_exit_layers=None,
+        early_exit_threshold=None,
         save_adam_vars=False,
         shuffle_buffer_size=100,
         dataset_size=None,
@@ -199,10 +240,23 @@ def get_default_config():
         save_dtype=None,
         val_set=None,
         per_process_gpu_memory_fraction=None,
+        num_threads=None,
         distribution_strategy="central_storage",
         xla=False,
         optimize_for="accuracy", 
         sort_by_length=True,
+        predict_window_size=1000,
+        tokenize_workers=None,
+        tokenization_cache_size=None,
+        tokenization_cache_path=None,
+        feature_cache_path=None,
+        length_bucketing=False,
+        n_length_buckets=8,
+        predict_batch_tokens=None,
+        save_workers=None,
+        save_delta=False,
+        save_delta_tolerance=None,
+        distillation_temperature=2.0,
         collapse_whitespace=False,
         permit_uninitialized=None,
 
@@ -272,6 +326,7 @@ def get_default_config():
         filter_empty_examples=False,
         crf_sequence_labeling=True,
         use_gpu_crf_predict="auto",
+        offset_sequence_reconstruction=False,
 
         # Regression Params
         regression_loss="L2",
@@ -309,6 +364,8 @@ def get_default_config():
 
         # BERT only
         bert_intermediate_size=None,
+        bert_heads_per_layer=None,  # set by `finetune.util.pruning.prune`
+        bert_intermediate_size_per_layer=None,
         bert_use_pooler=True,
         bert_use_type_embed=True,
 
@@ -1,3 +1,4 @@
+import re
 import warnings
 
 import numpy as np
@@ -53,6 +54,47 @@ def round_to_nearest_start_and_end(label, token_starts, token_ends, text):
     label["text"] = text[label["start"] : label["end"]]
 
 
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def word_boundaries(text):
+    """
+    Approximates spacy tokenization with a single regex pass: runs of word characters and individual
+    punctuation characters. Returns sorted arrays of word starts and ends.
+    """
+    bounds = np.asarray([match.span() for match in WORD_PATTERN.finditer(text)], dtype=np.int64).reshape(-1, 2)
+    return bounds[:, 0], bounds[:, 1]
+
+
+def _nearest(sorted_values, target, limit=None):
+    # Equivalent to sorted_values[np.argmin(np.abs(sorted_values[:limit] - target))] in O(log n)
+    if limit is None:
+        limit = len(sorted_values)
+    idx = min(int(np.searchsorted(sorted_values[:limit], target)), limit)
+    candidates = [i for i in (idx - 1, idx) if 0 <= i < limit]
+    return sorted_values[min(candidates, key=lambda i: abs(sorted_values[i] - target))]
+
+
+def strip_whitespace(text, start, end):
+    # Shrinks the span [start, end) of `text` to exclude leading and trailing whitespace.
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def round_to_nearest_word_boundary(label, word_starts, word_ends, text):
+    # Same as round_to_nearest_start_and_end, but using binary search over precomputed sorted boundaries.
+    if len(word_ends) == 0:
+        return
+    label["end"] = int(_nearest(word_ends, label["end"]))
+    limit = int(np.searchsorted(word_starts, label["end"], side="left"))
+    if limit > 0:
+        label["start"] = int(_nearest(word_starts, label["start"], limit=limit))
+    label["text"] = text[label["start"] : label["end"]]
+
+
 def finetune_to_indico_sequence(
     raw_texts,
     subseqs,
@@ -61,6 +103,7 @@ def finetune_to_indico_sequence(
     none_value=None,
     subtoken_predictions=False,
     associations=None,
+    subseq_positions=None,
 ):
     """
     Maps from the labeled substring format into the 'indico' format. This is the exact inverse operation to
@@ -86,14 +129,30 @@ def finetune_to_indico_sequence(
     :param data: A list of segmented text of the form list(list(str))
     :param labels: Categorical labels for each sub-string in data.
     :param none_value: The none value used to encode the input format.
+    :param subseq_positions: Optional (start, end) character offsets of each sub-string in data. When provided the
+        offsets are used directly instead of searching the raw text, and annotations are snapped to word boundaries
+        from :func:`word_boundaries` instead of spacy tokens, making this linear in document length.
     :return: Texts, annoatations both in the 'indico' format.
     """
     annotations = []
-    spacy_docs = get_spacy().pipe(raw_texts)
-    loop_vals = zip(raw_texts, spacy_docs, subseqs, labels, probs or [None] * len(raw_texts))
-    for doc_idx, (raw_text, spacy_tokens, doc_seq, label_seq, prob_seq) in enumerate(loop_vals):
-        spacy_token_starts = np.asarray([token.idx for token in spacy_tokens])
-        spacy_token_ends = np.asarray([token.idx + len(token.text) for token in spacy_tokens])
+    if subseq_positions is None:
+        spacy_docs = get_spacy().pipe(raw_texts)
+    else:
+        spacy_docs = [None] * len(raw_texts)
+    loop_vals = zip(
+        raw_texts,
+        spacy_docs,
+        subseqs,
+        labels,
+        probs or [None] * len(raw_texts),
+        subseq_positions or [None] * len(raw_texts),
+    )
+    for doc_idx, (raw_text, spacy_tokens, doc_seq, label_seq, prob_seq, doc_positions) in enumerate(loop_vals):
+        if doc_positions is None:
+            spacy_token_starts = np.asarray([token.idx for token in spacy_tokens])
+            spacy_token_ends = np.asarray([token.idx + len(token.text) for token in spacy_tokens])
+        else:
+            word_starts, word_ends = word_boundaries(raw_text)
         doc_annotations = []
         annotation_ranges = set()
         raw_annotation_start = 0
@@ -112,7 +171,15 @@ def finetune_to_indico_sequence(
             for label_idx, label in enumerate(label_list):
                 stripped_text = sub_str.strip()
 
-                if subtoken_predictions:
+                if doc_positions is not None:
+                    raw_annotation_start, raw_annotation_end = doc_positions[i]
+                    if not subtoken_predictions:
+                        # subtoken offsets can include the whitespace before a word, which would round to the
+                        # previous word
+                        raw_annotation_start, raw_annotation_end = strip_whitespace(
+                            raw_text, raw_annotation_start, raw_annotation_end
+                        )
+                elif subtoken_predictions:
                     raw_annotation_start = raw_text.find(sub_str, raw_annotation_start)
                     raw_annotation_end = raw_annotation_start + len(sub_str)
                 else:
@@ -164,9 +231,12 @@ def finetune_to_indico_sequence(
                 # if we don't want to allow subtoken predictions, adjust start and end to match
                 # the start and ends of the nearest full tokens
                 if not subtoken_predictions:
-                    round_to_nearest_start_and_end(
-                        annotation, spacy_token_starts, spacy_token_ends, raw_text
-                    )
+                    if doc_positions is not None:
+                        round_to_nearest_word_boundary(annotation, word_starts, word_ends, raw_text)
+                    else:
+                        round_to_nearest_start_and_end(
+                            annotation, spacy_token_starts, spacy_token_ends, raw_text
+                        )
 
                 if confidences is not None:
                     annotation["confidence"] = [confidences]
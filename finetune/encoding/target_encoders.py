@@ -105,6 +105,15 @@ class NoisyLabelEncoder(LabelEncoder, BaseEncoder):
         return list(dataframe.T.to_dict().values())
 
 
+class SoftLabelEncoder(NoisyLabelEncoder):
+    """
+    Encodes probability distributions over classes as targets, decoding predictions to the most likely class.
+    """
+
+    def inverse_transform(self, probabilities):
+        return [self.classes_[i] for i in np.argmax(probabilities, axis=-1)]
+
+
 class Seq2SeqLabelEncoder(BaseEncoder):
     def __init__(self, encoder, max_len, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -266,6 +275,44 @@ class SequenceMultiLabelingEncoder(SequenceLabelingEncoder):
         return [tuple(c for c, l_i in zip(self.classes_, l) if l_i) for l in y]
 
 
+class SoftSequenceLabelingEncoder(SequenceLabelingEncoder):
+    """
+    Encodes per-token probabilities, such as those produced by a teacher model with `predict(X, per_token=True)`,
+    as a probability distribution over classes for each subtoken. Each label is a dict with `start`, `end` and
+    `probabilities`. Subtokens that no label overlaps are assigned to the pad token.
+    """
+
+    def fit(self, labels):
+        classes = dict()
+        for lab in labels:
+            for lab_i in lab:
+                classes.update(dict.fromkeys(lab_i["probabilities"]))
+        classes[self.pad_token] = None
+        self.classes_ = list(classes)
+        self.lookup = {c: i for i, c in enumerate(self.classes_)}
+
+    def transform(self, out, labels):
+        labels_out = np.zeros([len(out.tokens), len(self.classes_)], dtype=np.float32)
+        labels_out[:, self.lookup[self.pad_token]] = 1.0
+        labels = sorted(labels, key=lambda lab: lab["start"])
+        label_idx = 0
+        for i, (start, end) in enumerate(zip(out.token_starts, out.token_ends)):
+            if end == -1:
+                continue
+            while label_idx < len(labels) and labels[label_idx]["end"] <= start:
+                label_idx += 1
+            if label_idx < len(labels) and labels[label_idx]["start"] < end:
+                labels_out[i] = 0.0
+                for label, proba in labels[label_idx]["probabilities"].items():
+                    labels_out[i, self.lookup[label]] = proba
+        return labels_out
+
+    def inverse_transform(self, y):
+        if np.ndim(y) == 2:
+            y = np.argmax(y, axis=-1)
+        return super().inverse_transform(y)
+
+
 class MultilabelClassificationEncoder(MultiLabelBinarizer, BaseEncoder):
     pass
 
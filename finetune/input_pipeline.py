@@ -1,5 +1,7 @@
 import itertools
 import logging
+import multiprocessing
+import threading
 import sys
 import math
 import os
@@ -21,10 +23,49 @@ import finetune
 from finetune.errors import FinetuneError
 from finetune.encoding.input_encoder import EncodedOutput, tokenize_context
 from finetune.util.imbalance import compute_class_weights
-from finetune.util.input_utils import InputMode, validation_settings, wrap_tqdm, Chunker, has_targets, batch_dataset
+from finetune.util.tokenization_cache import TokenizationCache
+from finetune.util.feature_cache import add_cached_feature_types
+from finetune.util.input_utils import (
+    InputMode,
+    validation_settings,
+    wrap_tqdm,
+    Chunker,
+    has_targets,
+    batch_dataset,
+    length_bucket_boundaries,
+    padding_stats,
+    token_budget_batches,
+)
 
 LOGGER = logging.getLogger("finetune")
 
+TOKENIZE_CHUNKSIZE = 8
+_WORKER_PIPELINE = None
+# when set for a thread, `_text_to_ids` raises `_CacheMiss` rather than encoding a document missing from the cache
+_CACHE_ONLY = threading.local()
+
+
+class _CacheMiss(Exception):
+    pass
+
+
+def _init_tokenize_worker(pipeline):
+    global _WORKER_PIPELINE
+    _WORKER_PIPELINE = pipeline
+
+
+def _tokenize_worker(d):
+    """
+    Returns the encoded outputs for `d` along with any new tokenization cache entries, which are added to the
+    cache of the parent process rather than kept by the worker.
+    """
+    pipeline = _WORKER_PIPELINE
+    if pipeline.config.tokenization_cache_size:
+        pipeline._tokenization_cache = TokenizationCache(max_size=sys.maxsize)
+    out = list(pipeline.text_to_tokens_mask(**d))
+    cache = pipeline._tokenization_cache
+    return out, cache.items() if cache is not None else []
+
 
 class BasePipeline(metaclass=ABCMeta):
     def __init__(self, config):
@@ -35,6 +76,13 @@ class BasePipeline(metaclass=ABCMeta):
         self.pad_idx_ = None
         self.rebuild = False
         self._chunker = None
+        self._tokenization_cache = None
+        # bumped whenever the label encoder changes, so that tokenization workers holding an older copy are replaced
+        self._encoder_version = 0
+        self._tokenize_pool_ = None
+        self._tokenize_pool_lock = threading.Lock()
+        # number of training batches per epoch when it differs from ceil(dataset_size / batch_size)
+        self.batches_per_epoch = None
 
     @property
     def text_encoder(self):
@@ -114,12 +162,91 @@ class BasePipeline(metaclass=ABCMeta):
             else:
                 yield feats, self.label_encoder.transform([Y])[0]
 
+    def tokenize_all(self, data):
+        """
+        Applies `text_to_tokens_mask` to each dict in `data`, yielding the encoded outputs in input order.
+        When `config.tokenize_workers` is greater than 1 documents are encoded by a long-lived pool of spawned worker
+        processes, see `_tokenize_pool`. Documents found in the tokenization cache are encoded in this process and
+        the encodings computed by the workers are added to its cache.
+        """
+        n_workers = self.config.tokenize_workers
+        if not n_workers or n_workers <= 1:
+            for d in data:
+                yield from self.text_to_tokens_mask(**d)
+            return
+        pool = self._tokenize_pool()
+        data = iter(data)
+        while True:
+            block = list(itertools.islice(data, TOKENIZE_CHUNKSIZE * n_workers))
+            if not block:
+                return
+            outputs = [self._tokenize_cached(d) for d in block]
+            misses = [i for i, out in enumerate(outputs) if out is None]
+            if misses:
+                results = pool.map(_tokenize_worker, [block[i] for i in misses], chunksize=TOKENIZE_CHUNKSIZE)
+                cache = self.tokenization_cache
+                for i, (out, cache_items) in zip(misses, results):
+                    outputs[i] = out
+                    if cache is not None:
+                        for key, value in cache_items:
+                            cache.put(key, value)
+            for out in outputs:
+                yield from out
+
+    def _tokenize_cached(self, d):
+        """
+        Returns the encoded outputs for `d` if all of its encodings are in the tokenization cache, otherwise None.
+        """
+        if self.tokenization_cache is None:
+            return None
+        _CACHE_ONLY.enabled = True
+        try:
+            return list(self.text_to_tokens_mask(**d))
+        except _CacheMiss:
+            return None
+        finally:
+            _CACHE_ONLY.enabled = False
+
+    def _tokenize_pool(self):
+        """
+        The pool of worker processes used by `tokenize_all`. Workers are spawned rather than forked, since forking a
+        process running the tensorflow runtime can deadlock, and each holds a copy of this pipeline. The pool is
+        reused between calls and only rebuilt when the settings used to encode documents or the label encoder change.
+        """
+        key = (self.config.tokenize_workers, self._encoding_signature(), self._encoder_version)
+        replaced = None
+        with self._tokenize_pool_lock:
+            pool, pool_key = self._tokenize_pool_ or (None, None)
+            if pool is None or pool_key != key:
+                replaced = pool
+                pool = multiprocessing.get_context("spawn").Pool(
+                    self.config.tokenize_workers, initializer=_init_tokenize_worker, initargs=(self,)
+                )
+                self._tokenize_pool_ = (pool, key)
+        if replaced is not None:
+            # lets any other thread's pending work finish before the old workers exit
+            replaced.close()
+            replaced.join()
+        return pool
+
+    def close(self):
+        """
+        Shuts down the tokenization worker pool, if one was started.
+        """
+        with self._tokenize_pool_lock:
+            if self._tokenize_pool_ is not None:
+                pool, _ = self._tokenize_pool_
+                pool.terminate()
+                pool.join()
+                self._tokenize_pool_ = None
+
     def _post_data_initialization(self, dataset=None):
         if "Y" in dataset[0]:
             ys = [data["Y"] for data in dataset]
             if self.label_encoder is None:
                 self.label_encoder = self._target_encoder()
                 self.label_encoder.fit(ys)
+                self._encoder_version += 1
             
             self.config.pad_idx = self.pad_idx
 
@@ -164,8 +291,7 @@ class BasePipeline(metaclass=ABCMeta):
 
     def get_dataset_from_generator(self, generator_fn, input_mode, update_hook=None):
         def chunked_and_tokenized_dataset():
-            for d in generator_fn():
-                yield from self.text_to_tokens_mask(**d)
+            yield from self.tokenize_all(generator_fn())
 
         types, shapes = self.feed_shape_type_def()
         
@@ -178,6 +304,21 @@ class BasePipeline(metaclass=ABCMeta):
             types = types[0]
             shapes = shapes[0]
         
+        if input_mode == InputMode.PREDICT and self.config.predict_batch_tokens:
+            # batches are formed while examples are generated, since their size depends on the lengths in each batch
+            batched_dataset = self.make_dataset_fn(
+                data_fn=lambda: token_budget_batches(
+                    chunked_and_tokenized_dataset(), self.config.predict_batch_tokens
+                ),
+                tqdm_mode=tqdm_mode,
+                update_hook=update_hook,
+                types=types,
+                shapes={k: tf.TensorShape([None]).concatenate(v) for k, v in shapes.items()},
+            )
+            return {
+                "predict_dataset": lambda: batched_dataset().prefetch(tf.data.experimental.AUTOTUNE)
+            }
+
         raw_dataset = self.make_dataset_fn(
             data_fn=chunked_and_tokenized_dataset,
             tqdm_mode=tqdm_mode,
@@ -186,6 +327,7 @@ class BasePipeline(metaclass=ABCMeta):
             shapes=shapes,
             skip_val=input_mode == InputMode.TRAIN
         )
+
         if input_mode == InputMode.PREDICT:
             return {
                 "predict_dataset": batch_dataset(
@@ -233,12 +375,20 @@ class BasePipeline(metaclass=ABCMeta):
             .skip(self.config.val_size)
         )
 
+        # the lengths of generated examples are not known up front, so steps are counted from dataset_size
+        self.batches_per_epoch = None
+        if self.config.length_bucketing:
+            bucket_boundaries = length_bucket_boundaries(self.config.max_length, self.config.n_length_buckets)
+        else:
+            bucket_boundaries = None
+
         return {
             "train_dataset": batch_dataset(
                 train_dataset,
                 batch_size=self.config.batch_size,
                 shapes=shapes,
-                n_epochs=self.config.n_epochs
+                n_epochs=self.config.n_epochs,
+                bucket_boundaries=bucket_boundaries,
             ),
             "val_dataset": batch_dataset(
                 val_dataset,
@@ -248,7 +398,11 @@ class BasePipeline(metaclass=ABCMeta):
         }
 
 
-    def get_dataset_from_list(self, data_list, input_mode, update_hook=None):
+    def get_dataset_from_list(self, data_list, input_mode, update_hook=None, feature_cache=None):
+        """
+        :param feature_cache: Optional `FeatureCache`, when given the examples are fed with the cached outputs of the
+            featurizer, which the model trains from in place of running the featurizer.
+        """
         assert input_mode == InputMode.TRAIN, "use the generator path for prediction"
         
         data_list = list(data_list)
@@ -268,19 +422,11 @@ class BasePipeline(metaclass=ABCMeta):
             train_split = dataset_shuffle(data_list, random_state=self.config.seed)
             val_split = self.config.val_set or []
 
-        tokenized_train_split = list(
-            itertools.chain.from_iterable(
-                self.text_to_tokens_mask(**d) for d in train_split
-            )
-        )
+        tokenized_train_split = list(self.tokenize_all(train_split))
 
         self.config.dataset_size = len(tokenized_train_split)
 
-        tokenized_val_split = list(
-            itertools.chain.from_iterable(
-                self.text_to_tokens_mask(**d) for d in val_split
-            )
-        )
+        tokenized_val_split = list(self.tokenize_all(val_split))
         
         if self.config.class_weights is not None:
             class_counts = self._compute_class_counts(tokenized_train_split)
@@ -290,6 +436,11 @@ class BasePipeline(metaclass=ABCMeta):
             )
             
         types, shapes = self.feed_shape_type_def()
+        if feature_cache is not None:
+            tokenized_train_split = feature_cache.load_or_compute(tokenized_train_split)
+            tokenized_val_split = feature_cache.load_or_compute(tokenized_val_split)
+            add_cached_feature_types(types[0], shapes[0], tokenized_train_split[0])
+
         if not has_targets(lambda: tokenized_train_split):
             types = types[0]
             shapes = shapes[0]
@@ -308,12 +459,35 @@ class BasePipeline(metaclass=ABCMeta):
             shapes=shapes
         )
         
+        bucket_boundaries = None
+        self.batches_per_epoch = None
+        if self.config.length_bucketing:
+            lengths = [
+                len(example[0]["tokens"] if isinstance(example, tuple) else example["tokens"])
+                for example in tokenized_train_split
+            ]
+            bucket_boundaries = length_bucket_boundaries(
+                self.config.max_length, self.config.n_length_buckets, lengths=lengths
+            )
+            unbucketed = padding_stats(lengths, self.config.batch_size)
+            bucketed = padding_stats(lengths, self.config.batch_size, bucket_boundaries)
+            LOGGER.info(
+                "Length bucketing reduces padding from {} to {} tokens per epoch ({:.1f}% of padding removed)".format(
+                    unbucketed["padding"],
+                    bucketed["padding"],
+                    100 * (1 - bucketed["padding"] / max(unbucketed["padding"], 1)),
+                )
+            )
+            # every bucket is flushed at the end of an epoch, leaving up to one partial batch per bucket
+            self.batches_per_epoch = bucketed["batches"]
+
         return {
 	    "train_dataset": batch_dataset(
                 train_dataset_unbatched,
 		batch_size=self.config.batch_size,
                 shapes=shapes,
-                n_epochs=self.config.n_epochs
+                n_epochs=self.config.n_epochs,
+                bucket_boundaries=bucket_boundaries,
             ),
             "val_dataset": batch_dataset(
 		val_dataset_unbatched,
@@ -348,7 +522,44 @@ class BasePipeline(metaclass=ABCMeta):
         """
         return [X]
 
+    @property
+    def tokenization_cache(self):
+        if not self.config.tokenization_cache_size:
+            return None
+        if getattr(self, "_tokenization_cache", None) is None:
+            self._tokenization_cache = TokenizationCache(
+                max_size=self.config.tokenization_cache_size,
+                path=self.config.tokenization_cache_path,
+            )
+        return self._tokenization_cache
+
+    def _encoding_signature(self):
+        return (
+            type(self).__name__,
+            type(self.text_encoder).__name__,
+            self.config.max_length,
+            self.config.chunk_long_sequences,
+            self.config.chunk_context,
+            self.config.chunk_alignment,
+            self.config.add_eos_bos_to_chunk,
+            self.config.collapse_whitespace,
+        )
+
     def _text_to_ids(self, Xs, pad_token=None):
+        cache = self.tokenization_cache
+        if cache is None:
+            yield from self._encode_chunks(Xs)
+            return
+        key = cache.key(Xs, self._encoding_signature())
+        encoded = cache.get(key)
+        if encoded is None:
+            if getattr(_CACHE_ONLY, "enabled", False):
+                raise _CacheMiss()
+            encoded = list(self._encode_chunks(Xs))
+            cache.put(key, encoded)
+        yield from encoded
+
+    def _encode_chunks(self, Xs):
         Xs = self._format_for_encoding(Xs)
         if self.config.chunk_long_sequences and len(Xs) == 1:
             # can only chunk single sequence inputs
@@ -401,5 +612,16 @@ class BasePipeline(metaclass=ABCMeta):
     def __getstate__(self):
         state = self.__dict__.copy()
         del state["_text_encoder"]
+        state.pop("_tokenization_cache", None)
+        state.pop("_tokenize_pool_", None)
+        state.pop("_tokenize_pool_lock", None)
         return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._text_encoder = None
+        self._encoder_version = state.get("_encoder_version", 0)
+        self.batches_per_epoch = state.get("batches_per_epoch")
+        self._tokenize_pool_ = None
+        self._tokenize_pool_lock = threading.Lock()
         
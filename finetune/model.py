@@ -10,6 +10,7 @@ from finetune.util.text_generation import sample_with_temperature
 from finetune.util.optimize_loss import optimize_loss
 
 from finetune.util.imbalance import class_weight_tensor
+from finetune.util.feature_cache import cached_featurizer_state
 from finetune.errors import FinetuneError
 from finetune.base_models import GPTModel, GPTModelSmall
 
@@ -27,6 +28,8 @@ class PredictMode:
     ASSOCIATION = "ASSOCIATION"
     ASSOCIATION_PROBAS = "ASSOCIATION_PROBA"
     EXPLAIN = "EXPLAIN"
+    HEAD_IMPORTANCE = "HEAD_IMPORTANCE"
+    FFN_IMPORTANCE = "FFN_IMPORTANCE"
 
 def fp16_variable_getter(getter, name, shape=None, dtype=None,
                          initializer=None, regularizer=None,
@@ -125,6 +128,8 @@ def get_model_fn(
     build_explain,
     n_replicas,
     fp16_predict,
+    int8_predict=False,
+    build_pruning_scores=False,
 ):
     def target_model_op(featurizer_state, Y, params, mode, **kwargs):
         weighted_tensor = None
@@ -164,28 +169,40 @@ def get_model_fn(
         Y = labels
         pred_op = None
 
-        if estimator_mode == tf.estimator.ModeKeys.PREDICT:
+        predicting = estimator_mode == tf.estimator.ModeKeys.PREDICT
+        if predicting:
             total_num_steps = None
         else:
             total_num_steps = params.n_epochs * params.dataset_size // (params.batch_size * n_replicas)
             
         with tf.compat.v1.variable_scope(tf.compat.v1.get_variable_scope(), custom_getter=var_getter):
             train_loss = 0.0
-            featurizer_state = params.base_model.get_featurizer(
-                X,
-                encoder=encoder,
-                config=params,
-                train=train,
-                explain=build_explain,
-                context=context,
-                total_num_steps=total_num_steps,
-            )
+            if "cached_lengths" in features:
+                # the frozen featurizer was run ahead of training, see `finetune.util.feature_cache`.
+                featurizer_state = cached_featurizer_state(features)
+            else:
+                featurizer_state = params.base_model.get_featurizer(
+                    X,
+                    encoder=encoder,
+                    config=params,
+                    train=train,
+                    explain=build_explain,
+                    context=context,
+                    total_num_steps=total_num_steps,
+                    int8_predict=int8_predict and predicting,
+                    predict_num_layers=params.predict_num_layers if predicting else None,
+                    early_exit_outputs=target_dim if build_target_model and params.early_exit_layers else None,
+                    early_exit_threshold=(
+                        params.early_exit_threshold if predicting and not build_pruning_scores else None
+                    ),
+                    pruning_masks=build_pruning_scores and predicting,
+                )
             predictions = {
-                PredictMode.FEATURIZE: featurizer_state["features"], 
-                PredictMode.SEQUENCE: featurizer_state["sequence_features"]
+                PredictMode.FEATURIZE: featurizer_state.get("features"),
+                PredictMode.SEQUENCE: featurizer_state.get("sequence_features"),
             }
 
-            if params.base_model in [GPTModel, GPTModelSmall]:
+            if params.base_model in [GPTModel, GPTModelSmall] and "attention_weights" in featurizer_state:
                 predictions[PredictMode.ATTENTION] = featurizer_state[
                     "attention_weights"
                 ]
@@ -228,6 +245,19 @@ def get_model_fn(
                             "explanation"
                         ]
 
+                    if build_pruning_scores and predicting:
+                        # Taylor importance of each head and intermediate unit, the magnitude of the gradient of
+                        # the loss of the predicted class with respect to a mask over it.
+                        log_probas = tf.nn.log_softmax(tf.cast(logits, tf.float32))
+                        pseudo_loss = -tf.reduce_sum(input_tensor=tf.reduce_max(input_tensor=log_probas, axis=-1))
+                        head_masks, ffn_masks = featurizer_state["pruning_masks"]
+                        predictions[PredictMode.HEAD_IMPORTANCE] = tf.abs(
+                            tf.concat(tf.gradients(ys=pseudo_loss, xs=head_masks), axis=1)
+                        )
+                        predictions[PredictMode.FFN_IMPORTANCE] = tf.abs(
+                            tf.concat(tf.gradients(ys=pseudo_loss, xs=ffn_masks), axis=1)
+                        )
+
             if lm_type is not None:
                 if lm_type.lower() == 'lm':
                     lm_predict_op, language_model_state = language_model_op(
@@ -37,6 +37,45 @@ def viterbi_decode(score, transition_params):
     return viterbi, np_softmax(trellis, axis=-1)
 
 
+def batch_viterbi_decode(scores, transition_params, sequence_lengths=None):
+    """Decode the highest scoring sequence of tags for a batch of sequences outside of TensorFlow.
+    Vectorized over the batch and tag dimensions, so only the loop over timesteps runs in python.
+    Positions beyond a sequence's length carry the trellis forward unchanged, so each sequence is decoded as if it
+    were truncated to its length.
+    Args:
+        scores: A [batch_size, seq_len, num_tags] array of unary potentials.
+        transition_params: A [num_tags, num_tags] matrix of binary potentials.
+        sequence_lengths: An optional [batch_size] array of sequence lengths, defaults to seq_len for all sequences.
+    Returns:
+        viterbi: A [batch_size, seq_len] int32 array containing the highest scoring tag indices.
+        viterbi_probs: A [batch_size, seq_len, num_tags] array of softmaxed trellis scores.
+    """
+    batch_size, seq_len, num_tags = scores.shape
+    if sequence_lengths is None:
+        sequence_lengths = np.full([batch_size], seq_len)
+    sequence_lengths = np.asarray(sequence_lengths)
+    trellis = np.zeros_like(scores)
+    backpointers = np.zeros(scores.shape, dtype=np.int32)
+    trellis[:, 0] = scores[:, 0]
+    identity = np.arange(num_tags, dtype=np.int32)
+
+    for t in range(1, seq_len):
+        v = np.expand_dims(trellis[:, t - 1], 2) + transition_params  # [batch, from, to]
+        best_prev = np.argmax(v, 1).astype(np.int32)
+        best_score = np.take_along_axis(v, np.expand_dims(best_prev, 1), 1)[:, 0]
+        active = np.expand_dims(t < sequence_lengths, 1)
+        trellis[:, t] = np.where(active, scores[:, t] + best_score, trellis[:, t - 1])
+        backpointers[:, t] = np.where(active, best_prev, identity)
+
+    batch_idxs = np.arange(batch_size)
+    viterbi = np.zeros([batch_size, seq_len], dtype=np.int32)
+    viterbi[:, -1] = np.argmax(trellis[:, -1], -1)
+    for t in range(seq_len - 1, 0, -1):
+        viterbi[:, t - 1] = backpointers[batch_idxs, t, viterbi[:, t]]
+
+    return viterbi, np_softmax(trellis, axis=-1)
+
+
 def sequence_decode(logits, transition_matrix, sequence_length, use_gpu_op, use_crf):
     """ A simple py_func wrapper around the Viterbi decode allowing it to be included in the tensorflow graph. """
     if not use_crf:
@@ -51,13 +90,14 @@ def sequence_decode(logits, transition_matrix, sequence_length, use_gpu_op, use_
         probs = tf.nn.softmax(logits, -1)
         return tags, probs
     else:
-        def _sequence_decode(logits, transition_matrix):
-            all_predictions = []
-            all_logits = []
-            for logit in logits:
-                viterbi_sequence, viterbi_logits = viterbi_decode(logit, transition_matrix)
-                all_predictions.append(viterbi_sequence)
-                all_logits.append(viterbi_logits)
-            return np.array(all_predictions, dtype=np.int32), np.array(all_logits, dtype=np.float32)
-        
-        return tf.compat.v1.py_func(_sequence_decode, [logits, transition_matrix], [tf.int32, tf.float32])
+        def _sequence_decode(logits, transition_matrix, sequence_length):
+            if logits.shape[1] == 0:
+                return np.zeros(logits.shape[:2], dtype=np.int32), logits.astype(np.float32)
+            viterbi_sequences, viterbi_probs = batch_viterbi_decode(logits, transition_matrix, sequence_length)
+            return viterbi_sequences, viterbi_probs.astype(np.float32)
+
+        if sequence_length is None:
+            sequence_length = tf.fill(tf.shape(input=logits)[:1], tf.shape(input=logits)[1])
+        return tf.compat.v1.py_func(
+            _sequence_decode, [logits, transition_matrix, sequence_length], [tf.int32, tf.float32]
+        )
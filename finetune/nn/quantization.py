@@ -0,0 +1,136 @@
+"""
+Post-training dynamic int8 quantization for CPU inference.
+
+Weights are quantized per output channel when a model is loaded: each column of a kernel is divided by its largest
+absolute value and stored as uint8 with a zero point of 128. Activations are quantized per batch from their observed
+range, the product is accumulated in int32 by `QuantizedMatMul` and rescaled back to floating point.
+"""
+import numpy as np
+import tensorflow as tf
+
+ZERO_POINT = 128
+LEVELS = 127.0
+
+# quint8 range for the normalized weights, chosen so that 0.0 maps exactly onto the zero point.
+WEIGHT_MIN = -ZERO_POINT / LEVELS
+WEIGHT_MAX = 1.0
+
+# maps each quantized variable to the float variable it is computed from and which part of the quantization it holds.
+QUANTIZED_SUFFIXES = {
+    "kernel_int8:0": ("kernel:0", "int8"),
+    "kernel_scale:0": ("kernel:0", "scale"),
+    "w_int8:0": ("w:0", "int8"),
+    "w_scale:0": ("w:0", "scale"),
+}
+
+
+def quantize_per_channel(kernel):
+    """
+    Quantizes a kernel with output channels on its last axis.
+
+    :param kernel: float array of shape [..., units], leading axes are flattened.
+    :return: (quantized, scale) where quantized is a uint8 array of shape [-1, units] and scale is a float32 array
+        of shape [units].
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    kernel = kernel.reshape(-1, kernel.shape[-1])
+    scale = np.max(np.abs(kernel), axis=0)
+    scale[scale == 0] = 1.0
+    quantized = np.rint(kernel / scale * LEVELS) + ZERO_POINT
+    return np.clip(quantized, 0, 255).astype(np.uint8), scale.astype(np.float32)
+
+
+def dequantize_per_channel(quantized, scale):
+    return (quantized.astype(np.float32) - ZERO_POINT) / LEVELS * scale
+
+
+def quantized_source_name(name):
+    """
+    If `name` is a variable created by `quantized_dense` or an int8 `conv1d`, returns the name of the float
+    variable it is derived from and whether it holds the quantized values or the scale. Otherwise returns None.
+    """
+    for suffix, (source_suffix, part) in QUANTIZED_SUFFIXES.items():
+        if name.endswith("/" + suffix):
+            return name[: -len(suffix)] + source_suffix, part
+    return None
+
+
+class QuantizedWeights:
+    """
+    Computes the values of quantized variables from float weights at load time, quantizing each source kernel once.
+    """
+
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.cache = dict()
+
+    def get(self, name):
+        source = quantized_source_name(name)
+        if source is None:
+            return None
+        source_name, part = source
+        if source_name not in self.cache:
+            kernel = self.lookup(source_name)
+            if kernel is None:
+                return None
+            quantized, scale = quantize_per_channel(kernel)
+            self.cache[source_name] = {"int8": quantized, "scale": scale}
+        return self.cache[source_name][part]
+
+
+def int8_matmul(x, quantized_kernel, scale):
+    """
+    Computes `x @ kernel` for a 2d `x` from a kernel quantized by `quantize_per_channel`.
+    """
+    dtype = x.dtype
+    x = tf.cast(x, tf.float32)
+    min_x = tf.minimum(tf.reduce_min(input_tensor=x), 0.0)
+    max_x = tf.maximum(tf.reduce_max(input_tensor=x), 0.0)
+    x_q, min_x, max_x = tf.quantization.quantize(x, min_x, max_x, tf.quint8, mode="MIN_FIRST")
+    out, _, max_out = tf.raw_ops.QuantizedMatMul(
+        a=x_q,
+        b=tf.bitcast(quantized_kernel, tf.quint8),
+        min_a=min_x,
+        max_a=max_x,
+        min_b=WEIGHT_MIN,
+        max_b=WEIGHT_MAX,
+        Toutput=tf.qint32,
+    )
+    out = tf.cast(tf.bitcast(out, tf.int32), tf.float32) * (max_out / np.iinfo(np.int32).max)
+    return tf.cast(out * tf.cast(scale, tf.float32), dtype)
+
+
+def quantized_weight_variables(name, n_in, n_out):
+    quantized_kernel = tf.compat.v1.get_variable(
+        name + "_int8",
+        [n_in, n_out],
+        dtype=tf.uint8,
+        initializer=tf.compat.v1.constant_initializer(ZERO_POINT),
+        trainable=False,
+    )
+    scale = tf.compat.v1.get_variable(
+        name + "_scale", [n_out], initializer=tf.compat.v1.ones_initializer(), trainable=False
+    )
+    return quantized_kernel, scale
+
+
+def quantized_dense(inputs, units, activation=None, name=None, kernel_initializer=None):
+    """
+    Inference only drop in replacement for `tf.compat.v1.layers.dense` using int8 weights. Variables are scoped
+    the same way so the quantized weights are derived from the float `kernel` when the model is loaded.
+    """
+    with tf.compat.v1.variable_scope(name, default_name="dense"):
+        n_in = inputs.shape[-1]
+        quantized_kernel, scale = quantized_weight_variables("kernel", n_in, units)
+        bias = tf.compat.v1.get_variable("bias", [units], initializer=tf.compat.v1.zeros_initializer())
+        input_shape = tf.shape(input=inputs)
+        output = int8_matmul(tf.reshape(inputs, [-1, n_in]), quantized_kernel, scale) + bias
+        output = tf.reshape(output, tf.concat([input_shape[:-1], [units]], 0))
+        output.set_shape(inputs.shape[:-1].concatenate([units]))
+        if activation is not None:
+            output = activation(output)
+        return output
+
+
+def get_dense_fn(int8_inference=False):
+    return quantized_dense if int8_inference else tf.compat.v1.layers.dense
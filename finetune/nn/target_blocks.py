@@ -192,6 +192,25 @@ def classifier(hidden, targets, n_targets, config, train=False, reuse=None, **kw
         return {"logits": clf_logits, "losses": clf_losses}
 
 
+def distillation_loss(logits, soft_targets, temperature=1.0):
+    """
+    Cross entropy between the teacher's probabilities softened by `temperature` and the student's logits at the same
+    temperature. The loss is scaled by `temperature ** 2` so that the size of the gradients does not depend on the
+    temperature.
+
+    :param logits: The student's logits. [..., n_classes]
+    :param soft_targets: The teacher's probabilities. [..., n_classes]
+    :param temperature: Softmax temperature, values above 1 bring out the relative probabilities of unlikely classes.
+    :return: The loss for each distribution. [...]
+    """
+    logits = tf.cast(logits, tf.float32)
+    teacher_log_probas = tf.math.log(tf.maximum(tf.cast(soft_targets, tf.float32), 1e-8))
+    softened_targets = tf.nn.softmax(teacher_log_probas / temperature, axis=-1)
+    return temperature ** 2 * tf.nn.softmax_cross_entropy_with_logits(
+        labels=tf.stop_gradient(softened_targets), logits=logits / temperature
+    )
+
+
 def multi_choice_question(
     hidden, 
     targets, 
@@ -1,4 +1,6 @@
 import os
+import time
+import weakref
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import sys
@@ -14,6 +16,10 @@ from tensorflow_estimator.python.estimator.early_stopping import _StopOnPredicat
 from finetune.errors import FinetuneError
 from finetune.config import get_config
 from finetune.util.metrics import read_eval_metrics
+from finetune.util.delta_weights import DeltaWeights
+from finetune.util.mmap_weights import save_weights, load_weights, WEIGHTS_SUFFIX
+from finetune.util.base_weight_pool import BASE_WEIGHT_POOL
+from finetune.nn.quantization import QuantizedWeights
 
 LOGGER = logging.getLogger("finetune")
 
@@ -142,30 +148,50 @@ class Saver:
         save_dtype=None,
         restart_global_step=True,
         permit_uninitialized=None,
+        save_workers=None,
+        save_delta=False,
+        save_delta_tolerance=None,
     ):
         self.variable_transforms = variable_transforms or []
         self.exclude_matches = exclude_matches
         self.variables = None
         self.save_dtype = save_dtype
+        self.save_workers = save_workers
+        self.save_delta = save_delta
+        self.save_delta_tolerance = save_delta_tolerance
+        self.save_timings = None
         if fallback_filename is not None:
             self.set_fallback(fallback_filename)
         self.restart_global_step = restart_global_step
         self.permit_uninitialized = permit_uninitialized
 
     def set_fallback(self, fallback_filename):
-        self.tpe = ThreadPoolExecutor()
         if not os.path.exists(fallback_filename):
             raise FileNotFoundError("Error loading base model {} - file not found.".format(fallback_filename))
+        self.release_fallback()
         self.fallback_filename = fallback_filename
-        self.fallback_future = self.tpe.submit(joblib.load, fallback_filename)
+        # base weights are shared read-only with every other saver using the same file
+        key, self.fallback_future = BASE_WEIGHT_POOL.acquire(fallback_filename)
+        self._fallback_release = weakref.finalize(self, BASE_WEIGHT_POOL.release, key)
+        self.fallback_ = None
+
+    def release_fallback(self):
+        """
+        Drops this saver's reference to the shared base weights, which are freed once no saver is using them.
+        """
+        if getattr(self, "_fallback_release", None) is not None:
+            self._fallback_release()
+            self._fallback_release = None
+        self.fallback_future = None
         self.fallback_ = None
 
     @property
     def fallback(self):
         if self.fallback_ is None:
+            if getattr(self, "fallback_future", None) is None:
+                raise FinetuneError("Base model weights are not loaded.")
             self.fallback_ = self.fallback_future.result()
             self.fallback_future = None
-            self.tpe.shutdown()
         return self.fallback_
 
     def get_saver_hook(
@@ -192,9 +218,11 @@ class Saver:
             return self.fallback.get("global_step:0", 0)
         return 0
 
-    def save(self, finetune_obj, path, mkdir=True):
+    def save(self, finetune_obj, path, mkdir=True, mmap_weights=False):
         if self.variables is None:
             raise FinetuneError("Cowardly refusing to save default model.")
+        timings = dict()
+        start = time.perf_counter()
         if self.exclude_matches is not None:
             variables = {
                 k: v for k, v in self.variables.items() if self.exclude_matches not in k
@@ -209,22 +237,65 @@ class Saver:
         if self.save_dtype is not None:
             LOGGER.info("Saving with {} precision.".format(self.save_dtype.__name__))
             values = [a.astype(self.save_dtype) for a in values]
+        timings["cast"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fallback = self.fallback
+        timings["load_fallback"] = time.perf_counter() - start
 
+        start = time.perf_counter()
         var_names_reduced, vals_reduced = self.remove_unchanged(
-            names, values, self.fallback
+            names, values, fallback
         )
+        timings["remove_unchanged"] = time.perf_counter() - start
         var_dict = dict(zip(var_names_reduced, vals_reduced))
         assert len(vals_reduced) == len(var_names_reduced) == len(var_dict)
-        joblib.dump((var_dict, finetune_obj), path)
+        if self.save_delta:
+            if mmap_weights:
+                raise FinetuneError("Delta checkpoints cannot be saved with mmap_weights.")
+            start = time.perf_counter()
+            var_dict = DeltaWeights.encode(var_dict, fallback, tolerance=self.save_delta_tolerance)
+            timings["encode_delta"] = time.perf_counter() - start
+        start = time.perf_counter()
+        if mmap_weights:
+            if not isinstance(path, str):
+                raise FinetuneError("Saving with mmap_weights requires a path rather than a file object.")
+            # the pickle holds the weights filename in place of the variables dict
+            weights_path = path + WEIGHTS_SUFFIX
+            save_weights(weights_path, var_dict)
+            joblib.dump((os.path.basename(weights_path), finetune_obj), path)
+        else:
+            joblib.dump((var_dict, finetune_obj), path)
+        timings["write"] = time.perf_counter() - start
+
+        self.save_timings = timings
+        LOGGER.info(
+            "Saved {} of {} variables. Time taken: {}".format(
+                len(var_dict),
+                len(variables),
+                ", ".join("{} {:.2f}s".format(k, v) for k, v in timings.items()),
+            )
+        )
 
     def load(self, path):
         self.variables, finetune_obj = joblib.load(path)
+        if isinstance(self.variables, str):
+            if not isinstance(path, str):
+                raise FinetuneError("Models saved with mmap_weights must be loaded from a path.")
+            self.variables = load_weights(os.path.join(os.path.dirname(path), self.variables))
         finetune_obj.config = get_config(
             error_on_invalid_keywords=False, 
             **dict(finetune_obj.config)
         )
         return finetune_obj
 
+    def reconstruct_delta_weights(self):
+        """
+        Decodes variables loaded from a delta checkpoint against the fallback weights. Must be called after set_fallback.
+        """
+        if isinstance(self.variables, DeltaWeights):
+            self.variables = self.variables.reconstruct(self.fallback)
+
     def get_scaffold_init_fn(self):
 
         def init_fn(scaffold, session):
@@ -239,6 +310,16 @@ class Saver:
 
             global_step_var = tf.compat.v1.train.get_global_step()
 
+            def lookup(name):
+                saved_var = variables_sv.get(name, self.fallback.get(name))
+                if saved_var is not None:
+                    for func in self.variable_transforms:
+                        saved_var = func(name, saved_var)
+                return saved_var
+
+            # int8 inference graphs hold quantized copies of the float kernels, which are computed here.
+            quantized_weights = QuantizedWeights(lookup)
+
             for var in all_vars:
                 if self.restart_global_step and global_step_var is not None and global_step_var.name == var.name:
                     continue
@@ -252,6 +333,8 @@ class Saver:
                     for func in self.variable_transforms:
                         saved_var = func(name, saved_var)
                     var_loader.add(var, saved_var)
+                elif quantized_weights.get(name) is not None:
+                    var_loader.add(var, quantized_weights.get(name))
                 else:
                     if name.startswith("model/featurizer"):
                         permitted = self.permit_uninitialized is not None and re.findall(self.permit_uninitialized, name)
@@ -261,18 +344,34 @@ class Saver:
             var_loader.run(session)
         return init_fn
 
+    def _is_unchanged(self, var_name, var_val, fb_var):
+        for func in self.variable_transforms:
+            fb_var = func(var_name, fb_var)
+        if fb_var.shape != var_val.shape:
+            return False
+        # Finetuned variables usually differ almost everywhere, so a strided sample rejects them without
+        # comparing the full arrays. A sample that is not close implies the full arrays are not close.
+        fb_flat, var_flat = np.ravel(fb_var), np.ravel(var_val)
+        stride = max(1, fb_flat.size // 1024)
+        if not np.allclose(fb_flat[::stride], var_flat[::stride]):
+            return False
+        return np.array_equal(fb_var, var_val) or np.allclose(fb_var, var_val)
+
     def remove_unchanged(self, variable_names, variable_values, fallback_vars):
-        skips = []
-        for var_val, var_name in zip(variable_values, variable_names):
-            skip = False
-            for fb_var_name, fb_var in fallback_vars.items():
-                if fb_var_name == var_name:
-                    for func in self.variable_transforms:
-                        fb_var = func(var_name, fb_var)
-                    if fb_var.shape == var_val.shape and np.allclose(fb_var, var_val):
-                        skip = True
-                        break
-            skips.append(skip)
+        variable_names, variable_values = list(variable_names), list(variable_values)
+
+        def is_unchanged(name_and_value):
+            var_name, var_val = name_and_value
+            fb_var = fallback_vars.get(var_name)
+            return fb_var is not None and self._is_unchanged(var_name, var_val, fb_var)
+
+        pairs = zip(variable_names, variable_values)
+        if self.save_workers and self.save_workers > 1:
+            # numpy releases the GIL during comparisons so threads compare variables in parallel
+            with ThreadPoolExecutor(self.save_workers) as executor:
+                skips = list(executor.map(is_unchanged, pairs))
+        else:
+            skips = [is_unchanged(pair) for pair in pairs]
         return (
             [var for skip, var in zip(skips, variable_names) if not skip],
             [var_val for skip, var_val in zip(skips, variable_values) if not skip],
@@ -1,13 +1,19 @@
 import gc
+import time
 import logging
 import functools
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import psutil
 
 import tensorflow as tf
 from finetune.base import BaseModel
-from finetune.custom_ops import BytesInUse, BytesLimit, MaxBytesInUse
+from finetune.custom_ops import BytesInUse, BytesLimit, MaxBytesInUse, ops_exist
 from finetune.errors import FinetuneSchedulerError
+from finetune.util.eviction import ModelStats, get_eviction_policy
+from finetune.util.micro_batching import MicroBatcher
 
 LOGGER = logging.getLogger("finetune")
 
@@ -19,35 +25,86 @@ def bytes_to_meg(x):
 def scheduled(fn):
     @functools.wraps(fn)
     def scheduled_predict(self, model_file, x, *args, **kwargs):
+        if self._batcher is not None and not args and not kwargs:
+            return self._batcher.submit((fn.__name__, model_file), x)
+        return _run_scheduled(self, model_file, x, *args, **kwargs)
+
+    def _run_scheduled(self, model_file, x, *args, **kwargs):
         model = self._rotate_in_model(model_file)
         try:
-            preds = fn(self, model_file=model_file, x=x, *args, model=model, **kwargs)
+            with self._predict_lock:
+                preds = fn(self, model_file=model_file, x=x, *args, model=model, **kwargs)
         except Exception as orig_except:
             LOGGER.warning(
                 "Exception '{}' raised. Closing all models and retrying".format(
                     orig_except
                 )
             )
+            self._release(model_file)
             self.close_all()
+            acquired = False
             try:
-                preds = fn(
-                    self, model_file=model_file, x=x, *args, model=model, **kwargs
-                )
+                model = self._rotate_in_model(model_file)
+                acquired = True
+                with self._predict_lock:
+                    preds = fn(
+                        self, model_file=model_file, x=x, *args, model=model, **kwargs
+                    )
             except Exception as e:
+                if acquired:
+                    self._release(model_file)
                 raise FinetuneSchedulerError(
                     "Original Error: {}, Retry Error: {}".format(
                         str(orig_except), str(e)
                     )
                 )
         self._update_memory_limit(model)
+        self._record_access(model_file, model)
+        self._release(model_file)
         return preds
 
+    scheduled_predict.unbatched = _run_scheduled
     return scheduled_predict
 
 
 class Scheduler:
+    """
+    Keeps recently used models loaded so that predictions do not pay the cost of loading a model each time.
+
+    :param max_models: Maximum number of models to keep loaded.
+    :param config: Config overrides applied to every loaded model.
+    :param reserved: Bytes of accelerator memory to keep free when deciding whether another model fits.
+    :param ram_max_frac: Maximum fraction of host memory to use before models are evicted.
+    :param eviction_policy: One of "lru", "lfu" or "greedy_dual", or an instance of
+        :class:`finetune.util.eviction.EvictionPolicy`, used to pick which model to close when another needs loading.
+    :param warmup_x: Input used to warm up models loaded by :meth:`prefetch` by running a prediction, so that the
+        graph is built before the first request. Defaults to `None`, no warm up.
+    :param request_workers: Number of threads serving the `*_async` methods.
+    :param batch_window: When set, concurrent calls for the same model and method are coalesced into a single call.
+        A call runs at once unless another batch for the model and method is running, in which case it waits for that
+        batch to finish, for up to this many seconds, gathering other calls. Only calls without extra arguments are
+        batched.
+    :param max_batch_size: Number of documents after which a batch runs without waiting for the rest of the window.
+    :param max_concurrency: Number of predictions allowed to run at once, including on the same model.
+    :param keep_weights: Whether loaded models keep their weights in host memory once their graph is built, along with
+        a reference to the base model weights they share with other models. These are only used if the graph is built
+        again. Defaults to `False`, the weights are dropped after the first prediction and the shared base weights are
+        freed once no model holds them.
+    """
+
     def __init__(
-        self, max_models=None, config=None, reserved=750000000, ram_max_frac=0.8
+        self,
+        max_models=None,
+        config=None,
+        reserved=750000000,
+        ram_max_frac=0.8,
+        eviction_policy="lru",
+        warmup_x=None,
+        request_workers=4,
+        batch_window=None,
+        max_batch_size=64,
+        max_concurrency=1,
+        keep_weights=False,
     ):
         self.loaded_models = list()
         self.max_models = max_models
@@ -59,10 +116,47 @@ class Scheduler:
         self.config = config or {}
         self.reserved = reserved
         self.ram_max_frac = ram_max_frac
+        self.eviction_policy = get_eviction_policy(eviction_policy)
+        self.model_stats = dict()
+        self._pending_loads = dict()
+        self._clock = 0
+        # the memory ops are unavailable on CPU-only hosts, where admission is based on host memory alone
+        self.device_memory_available = ops_exist() and bool(tf.config.list_physical_devices("GPU"))
+        self.warmup_x = list(warmup_x) if warmup_x is not None else None
+        self.request_workers = request_workers
+        self.keep_weights = keep_weights
+        # guards the scheduler state, models are loaded and predicted on without holding it
+        self._lock = threading.RLock()
+        # limits concurrent predictions, background loads and evictions run alongside predictions
+        self._predict_lock = threading.BoundedSemaphore(max_concurrency)
+        self._in_use = Counter()
+        self._loading = dict()
+        self._loads_in_progress = set()
+        self._load_executor = ThreadPoolExecutor(max_workers=1)
+        self._request_executor = None
+        self._batcher = None
+        if batch_window is not None:
+            self._batcher = MicroBatcher(self._run_batch, window=batch_window, max_batch_size=max_batch_size)
 
-    def _memory_for_one_more(self):
-        if self.gpu_memory_limit is None:
-            return True # first run
+    def _host_in_use(self):
+        return psutil.Process().memory_info().rss
+
+    def _estimated_footprint(self, model, attr):
+        # the footprint measured the last time this model was loaded, otherwise the largest seen so far
+        stats = self.model_stats.get(model)
+        if stats is not None and getattr(stats, attr) is not None:
+            return getattr(stats, attr)
+        known = [getattr(s, attr) for s in self.model_stats.values() if getattr(s, attr) is not None]
+        return max(known) if known else 0
+
+    def _memory_estimate(self, model=None):
+        """
+        The host and device memory expected to be taken by loading `model`. Updates the running device memory
+        statistics, so is called once per load.
+        """
+        host_estimate = self._estimated_footprint(model, "host_bytes")
+        if not self.device_memory_available or self.gpu_memory_limit is None:
+            return host_estimate, None  # CPU only or first run
         in_use = BytesInUse()
         peak = MaxBytesInUse()
         if self.max_above_resting is None or (peak - in_use) > self.max_above_resting:
@@ -75,60 +169,201 @@ class Scheduler:
             self.max_model_size = in_use - self.previous_in_use
 
         self.previous_in_use = in_use
-        cpu_percent = psutil.virtual_memory().percent
+        model_size = self._estimated_footprint(model, "device_bytes") or self.max_model_size
         LOGGER.info(
             (
                 "models loaded: {num_models}, in_use: {in_use}, max_above_resting: {mar},"
-                " max_model_size: {mms}, gpu_memory_limit: {mem_limit}, cpu percent used: {cpu_percent}"
+                " max_model_size: {mms}, predicted model size: {pms}, gpu_memory_limit: {mem_limit}"
             ).format(
                 num_models=len(self.loaded_models),
                 in_use=bytes_to_meg(in_use),
                 mar=bytes_to_meg(self.max_above_resting),
                 mms=bytes_to_meg(self.max_model_size),
+                pms=bytes_to_meg(model_size),
                 mem_limit=bytes_to_meg(self.gpu_memory_limit),
-                cpu_percent=cpu_percent,
             )
         )
-        if cpu_percent > self.ram_max_frac * 100:
+        return host_estimate, model_size
+
+    def _memory_for_one_more(self, host_estimate, device_estimate):
+        vm = psutil.virtual_memory()
+        if vm.percent > self.ram_max_frac * 100:
+            return False
+        if vm.total - vm.available + host_estimate > self.ram_max_frac * vm.total:
             return False
+
+        if device_estimate is None:
+            return True
         return (
-            in_use + self.max_above_resting + self.max_model_size + self.reserved
+            BytesInUse() + self.max_above_resting + device_estimate + self.reserved
         ) < self.gpu_memory_limit
 
-    def _close_oldest_model(self):
-        name = self.loaded_models.pop(0)
+    def _close_model(self, name):
+        self.loaded_models.remove(name)
         self.model_cache[name].close()
+        self.model_cache[name].saver.release_fallback()
         del self.model_cache[name]
+        self._pending_loads.pop(name, None)
+        self.eviction_policy.on_evict(name, self.model_stats)
         gc.collect()
 
-    def _rotate_in_model(self, model):
-        if model not in self.loaded_models:
-            if (
-                self.max_models is not None
-                and len(self.loaded_models) + 1 > self.max_models
-                or not self._memory_for_one_more()
-            ):
-                self._close_oldest_model()
-            out_model = BaseModel.load(model, **self.config)
-            self.model_cache[model] = out_model
-        else:
-            out_model = self.model_cache[model]
-            self.loaded_models.remove(model)  # put it back at the end of the queue
+    def _close_oldest_model(self):
+        # models with requests in flight are never evicted
+        candidates = [name for name in self.loaded_models if not self._in_use[name]]
+        if not candidates:
+            return False
+        self._close_model(self.eviction_policy.victim(candidates, self.model_stats))
+        return True
+
+    def _make_room(self, model):
+        host_estimate, device_estimate = self._memory_estimate(model)
+        # queued prefetches do not take a slot until they start loading
+        while self.loaded_models and (
+            self.max_models is not None
+            and len(self.loaded_models) + len(self._loads_in_progress) > self.max_models
+            or not self._memory_for_one_more(host_estimate, device_estimate)
+        ):
+            if not self._close_oldest_model():
+                break
 
-        self.loaded_models.append(model)
+    def _load_model(self, model):
+        try:
+            return self._load_and_warm(model)
+        except Exception:
+            with self._lock:
+                # allow the load to be retried by the next request
+                del self._loading[model]
+                self._loads_in_progress.discard(model)
+            raise
+
+    def _load_and_warm(self, model):
+        with self._lock:
+            self._loads_in_progress.add(model)
+            self._make_room(model)
+        start = (
+            time.perf_counter(),
+            BytesInUse() if self.device_memory_available else None,
+            self._host_in_use(),
+        )
+        out_model = BaseModel.load(model, **self.config)
         out_model._cached_predict = True
+        warm = False
+        if self.warmup_x is not None:
+            try:
+                with self._predict_lock:
+                    out_model.predict(self.warmup_x)
+                    self._update_memory_limit(out_model)
+                warm = True
+            except Exception as e:
+                LOGGER.warning("Failed to warm up model {}: {}".format(model, e))
 
+        with self._lock:
+            self.model_cache[model] = out_model
+            self.loaded_models.append(model)
+            self.model_stats.setdefault(model, ModelStats()).loads += 1
+            # footprint and load cost include building the graph, either during warm up or on the first prediction
+            self._pending_loads[model] = start
+            if warm:
+                self._measure_load(model)
+            del self._loading[model]
+            self._loads_in_progress.discard(model)
         return out_model
 
+    def prefetch(self, model_file):
+        """
+        Loads and warms up a model on a background thread, evicting other models if required.
+        Returns a future which resolves to the loaded model. Requests for the model wait on the same load.
+        """
+        with self._lock:
+            if model_file in self.model_cache:
+                future = Future()
+                future.set_result(self.model_cache[model_file])
+                return future
+            if model_file not in self._loading:
+                self._loading[model_file] = self._load_executor.submit(self._load_model, model_file)
+            return self._loading[model_file]
+
+    def _rotate_in_model(self, model):
+        with self._lock:
+            stats = self.model_stats.setdefault(model, ModelStats())
+            stats.requests += 1
+            if model in self.model_cache:
+                stats.hits += 1
+        while True:
+            with self._lock:
+                if model in self.model_cache:
+                    out_model = self.model_cache[model]
+                    self.loaded_models.remove(model)  # put it back at the end of the queue
+                    self.loaded_models.append(model)
+                    out_model._cached_predict = True
+                    self._in_use[model] += 1
+                    return out_model
+                future = self.prefetch(model)
+            # wait outside of the lock so that other requests are not blocked by the load
+            future.result()
+
+    def _release(self, model_file):
+        with self._lock:
+            self._in_use[model_file] -= 1
+            if self._in_use[model_file] <= 0:
+                del self._in_use[model_file]
+
+    def _measure_load(self, model_file):
+        stats = self.model_stats[model_file]
+        start, device_before, host_before = self._pending_loads.pop(model_file)
+        stats.load_cost = time.perf_counter() - start
+        if device_before is not None:
+            stats.device_bytes = max(BytesInUse() - device_before, 0)
+        stats.host_bytes = max(self._host_in_use() - host_before, 0)
+
+    def _record_access(self, model_file, model):
+        with self._lock:
+            if model_file in self._pending_loads:
+                self._measure_load(model_file)
+            self._clock += 1
+            self.model_stats[model_file].last_used = self._clock
+            self.eviction_policy.on_access(model_file, self.model_stats)
+
     def _update_memory_limit(self, model):
-        if hasattr(model.saver, "variables"):
+        if not self.keep_weights and hasattr(model.saver, "variables"):
             del model.saver.variables
-            del model.saver.fallback_
-        self.gpu_memory_limit = BytesLimit() # delay this so that any options get applied from finetune.
+            model.saver.release_fallback()
+        if self.device_memory_available:
+            self.gpu_memory_limit = BytesLimit() # delay this so that any options get applied from finetune.
 
     def close_all(self):
-        while self.loaded_models:
-            self._close_oldest_model()
+        with self._lock:
+            while self.loaded_models and self._close_oldest_model():
+                pass
+
+    def _run_batch(self, key, x):
+        method, model_file = key
+        return getattr(type(self), method).unbatched(self, model_file, x)
+
+    def _submit(self, fn, model_file, x, *args, **kwargs):
+        with self._lock:
+            if self._request_executor is None:
+                self._request_executor = ThreadPoolExecutor(max_workers=self.request_workers)
+        return self._request_executor.submit(fn, model_file, x, *args, **kwargs)
+
+    def predict_async(self, model_file, x, *args, **kwargs):
+        """
+        Same as :meth:`predict`, but returns a future immediately. If the model is not loaded it is loaded in the
+        background, and requests for other models which are loaded are served in the meantime.
+        """
+        return self._submit(self.predict, model_file, x, *args, **kwargs)
+
+    def predict_proba_async(self, model_file, x, *args, **kwargs):
+        """
+        Same as :meth:`predict_proba`, but returns a future immediately.
+        """
+        return self._submit(self.predict_proba, model_file, x, *args, **kwargs)
+
+    def featurize_async(self, model_file, x, *args, **kwargs):
+        """
+        Same as :meth:`featurize`, but returns a future immediately.
+        """
+        return self._submit(self.featurize, model_file, x, *args, **kwargs)
 
     @scheduled
     def predict(self, model_file, x, *args, model=None, **kwargs):
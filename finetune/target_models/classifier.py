@@ -8,8 +8,8 @@ from imblearn.over_sampling import RandomOverSampler
 from sklearn.utils import shuffle
 
 from finetune.base import BaseModel
-from finetune.encoding.target_encoders import OneHotLabelEncoder, NoisyLabelEncoder
-from finetune.nn.target_blocks import classifier
+from finetune.encoding.target_encoders import OneHotLabelEncoder, NoisyLabelEncoder, SoftLabelEncoder
+from finetune.nn.target_blocks import classifier, distillation_loss
 from finetune.input_pipeline import BasePipeline
 from finetune.model import PredictMode
 from finetune.base_models.gpt.encoder import finetune_to_indico_explain
@@ -40,6 +40,12 @@ class NoisyClassificationPipeline(BasePipeline):
     def _target_encoder(self):
         return NoisyLabelEncoder()
 
+
+class DistillationPipeline(BasePipeline):
+
+    def _target_encoder(self):
+        return SoftLabelEncoder()
+
 class Classifier(BaseModel):
     """
     Classifies a single document into 1 of N categories.
@@ -47,6 +53,9 @@ class Classifier(BaseModel):
     :param \**kwargs: key-value pairs of config items to override.
     """
 
+    supports_early_exit = True
+    cached_feature_keys = ("features",)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -153,6 +162,19 @@ class Classifier(BaseModel):
                 ),
                 -1,
             )
+        if targets is not None and featurizer_state.get("early_exit_logits"):
+            exit_losses = [
+                tf.nn.softmax_cross_entropy_with_logits(logits=exit_logits, labels=tf.stop_gradient(targets))
+                for exit_logits in featurizer_state["early_exit_logits"]
+            ]
+            clf_out["losses"] = clf_out["losses"] + tf.add_n(exit_losses)
+        if "exit_logits" in featurizer_state:
+            clf_logits = clf_out["logits"]
+            clf_out["logits"] = tf.cond(
+                pred=featurizer_state["exit_layer"] < config.n_layer,
+                true_fn=lambda: tf.cast(featurizer_state["exit_logits"], clf_logits.dtype),
+                false_fn=lambda: clf_logits,
+            )
         return clf_out
 
     def explain(self, Xs, context=None):
@@ -209,3 +231,33 @@ class NoisyClassifier(Classifier, BaseModel):
 
     def _get_input_pipeline(self):
         return NoisyClassificationPipeline(self.config)
+
+
+class DistillationClassifier(Classifier):
+    """
+    Classifies a single document into 1 of N categories, learning from the class probabilities of a teacher model
+    (a dictionary with float values, as returned by `predict_proba`). The teacher's probabilities are softened by
+    `config.distillation_temperature`. See :py:func:`finetune.util.distillation.cache_soft_targets`.
+
+    :param config: A :py:class:`finetune.config.Settings` object or None (for default config).
+    :param \**kwargs: key-value pairs of config items to override.
+    """
+
+    supports_early_exit = False
+
+    def _get_input_pipeline(self):
+        return DistillationPipeline(self.config)
+
+    def _target_model(self, *, config, featurizer_state, targets, n_outputs, train=False, reuse=None, **kwargs):
+        clf_out = super()._target_model(
+            config=config,
+            featurizer_state=featurizer_state,
+            targets=None,
+            n_outputs=n_outputs,
+            train=train,
+            reuse=reuse,
+            **kwargs
+        )
+        if targets is not None:
+            clf_out["losses"] = distillation_loss(clf_out["logits"], targets, config.distillation_temperature)
+        return clf_out
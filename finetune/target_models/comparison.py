@@ -83,6 +83,7 @@ class Comparison(Classifier):
     """
 
     defaults = {"chunk_long_sequences": False}
+    cached_feature_keys = None
 
     def __init__(self, **kwargs):
         d = copy.deepcopy(Comparison.defaults)
@@ -145,11 +146,11 @@ class Comparison(Classifier):
         """
         return BaseModel.predict_proba(self, pairs, context=context, **kwargs)
 
-    def featurize(self, pairs):
+    def featurize(self, pairs, **kwargs):
         """
         Embeds inputs in learned feature space. Can be called before or after calling :meth:`finetune`.
 
         :param pairs: Array of text, shape [batch, 2]
         :returns: np.array of features of shape (n_examples, embedding_size).
         """
-        return BaseModel.featurize(self, pairs)
+        return BaseModel.featurize(self, pairs, **kwargs)
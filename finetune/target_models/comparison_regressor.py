@@ -65,7 +65,7 @@ class ComparisonRegressor(BaseModel):
         raw_preds = self._inference(zipped_data, predict_keys=[PredictMode.NORMAL], context=context, **kwargs)
         return self.input_pipeline.label_encoder.inverse_transform(np.asarray(raw_preds))
     
-    def predict_proba(self, pairs, context=None):
+    def predict_proba(self, pairs, context=None, **kwargs):
         """
         Not implemented in regression task.
         """
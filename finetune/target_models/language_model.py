@@ -19,7 +19,7 @@ class LanguageModel(Classifier):
         """
         return self._inference(X, predict_keys=[PredictMode.LM_PERPLEXITY], context=context, **kwargs)
 
-    def predict_proba(self, X, context=None):
+    def predict_proba(self, X, context=None, **kwargs):
         raise ValueError("Predict Proba is not defined for the language model")
 
     def finetune(self, X, Y=None, batch_size=None, context=None, **kwargs):
@@ -32,6 +32,8 @@ class MultiLabelClassifier(BaseModel):
     :param \**kwargs: key-value pairs of config items to override.
     """
 
+    cached_feature_keys = ("features",)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.threshold_placeholder = None
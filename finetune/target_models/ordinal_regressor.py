@@ -30,6 +30,8 @@ class OrdinalRegressor(BaseModel):
     :param \**kwargs: key-value pairs of config items to override.
     """
 
+    cached_feature_keys = ("features",)
+
     def __init__(self, shared_threshold_weights=True, **kwargs):
         super().__init__(**kwargs)
         self.config.shared_threshold_weights = shared_threshold_weights
@@ -126,6 +128,7 @@ class ComparisonOrdinalRegressor(OrdinalRegressor):
     :param \**kwargs: key-value pairs of config items to override.
     """
     defaults = {"chunk_long_sequences": False}
+    cached_feature_keys = None
 
     def predict(self, pairs, **kwargs):
         """
@@ -21,6 +21,8 @@ class Regressor(BaseModel):
     :param \**kwargs: key-value pairs of config items to override.
     """
 
+    cached_feature_keys = ("features",)
+
     def _get_input_pipeline(self):
         return RegressionPipeline(self.config)
 
@@ -9,8 +9,9 @@ from finetune.base import BaseModel
 from finetune.encoding.target_encoders import (
     SequenceLabelingEncoder,
     SequenceMultiLabelingEncoder,
+    SoftSequenceLabelingEncoder,
 )
-from finetune.nn.target_blocks import sequence_labeler
+from finetune.nn.target_blocks import sequence_labeler, distillation_loss
 from finetune.nn.crf import sequence_decode
 from finetune.encoding.sequence_encoder import (
     finetune_to_indico_sequence,
@@ -18,6 +19,7 @@ from finetune.encoding.sequence_encoder import (
 from finetune.encoding.input_encoder import get_spacy
 from finetune.input_pipeline import BasePipeline
 from finetune.encoding.input_encoder import tokenize_context
+from finetune.errors import FinetuneError
 
 
 class SequencePipeline(BasePipeline):
@@ -78,6 +80,18 @@ class SequencePipeline(BasePipeline):
         return SequenceLabelingEncoder(pad_token=self.config.pad_token)
 
 
+class DistillationSequencePipeline(SequencePipeline):
+    def __init__(self, config):
+        super().__init__(config, multi_label=False)
+
+    def feed_shape_type_def(self):
+        (types, target_type), (shapes, _) = super().feed_shape_type_def()
+        return (types, target_type), (shapes, tf.TensorShape([None, self.label_encoder.target_dim]))
+
+    def _target_encoder(self):
+        return SoftSequenceLabelingEncoder(pad_token=self.config.pad_token)
+
+
 def _combine_and_format(subtokens, start, end, raw_text):
     """
     Combine predictions on many subtokens into a single token prediction.
@@ -137,6 +151,7 @@ class SequenceLabeler(BaseModel):
     """
 
     defaults = {"add_eos_bos_to_chunk": False}
+    cached_feature_keys = ("sequence_features",)
 
     def __init__(self, **kwargs):
         """
@@ -232,6 +247,7 @@ class SequenceLabeler(BaseModel):
                     assert doc_starts[-1] <= end_idx, "Start: {}, End: {}".format(doc_starts[-1], end_idx)
                     doc_subseqs[-1] = raw_text[doc_idx][doc_starts[-1]: end_idx]
                     doc_probs[-1].append(proba)
+                    doc_positions[-1] = (doc_starts[-1], end_idx)
 
             if end_of_doc:
                 # last chunk in a document
@@ -257,6 +273,7 @@ class SequenceLabeler(BaseModel):
             probs=all_probs,
             none_value=self.config.pad_token,
             subtoken_predictions=self.config.subtoken_predictions,
+            subseq_positions=all_positions if self.config.offset_sequence_reconstruction else None,
         )
 
         if per_token:
@@ -345,3 +362,43 @@ class SequenceLabeler(BaseModel):
 
     def _predict_proba_op(self, logits, **kwargs):
         return tf.no_op()
+
+
+class DistillationSequenceLabeler(SequenceLabeler):
+    """
+    Labels each token in a sequence as belonging to 1 of N token classes, learning from the per-token class
+    probabilities of a teacher model. Labels are lists of dicts with `start`, `end` and `probabilities` keys, as
+    returned in `tokens` by `SequenceLabeler.predict(X, per_token=True)`. The teacher's probabilities are softened by
+    `config.distillation_temperature`. See :py:func:`finetune.util.distillation.cache_soft_targets`.
+
+    :param config: A :py:class:`finetune.config.Settings` object or None (for default config).
+    :param \**kwargs: key-value pairs of config items to override.
+    """
+
+    defaults = {"add_eos_bos_to_chunk": False, "crf_sequence_labeling": False}
+
+    def _get_input_pipeline(self):
+        if self.config.multi_label_sequences:
+            raise FinetuneError("DistillationSequenceLabeler does not support multi_label_sequences.")
+        return DistillationSequencePipeline(config=self.config)
+
+    def _target_model(
+        self, *, config, featurizer_state, targets, n_outputs, train=False, reuse=None, **kwargs
+    ):
+        seq_out = super()._target_model(
+            config=config,
+            featurizer_state=featurizer_state,
+            targets=None,
+            n_outputs=n_outputs,
+            train=train,
+            reuse=reuse,
+            **kwargs
+        )
+        if targets is not None:
+            lengths = featurizer_state["lengths"]
+            token_losses = distillation_loss(seq_out["logits"], targets, config.distillation_temperature)
+            mask = tf.sequence_mask(lengths, maxlen=tf.shape(input=token_losses)[1], dtype=tf.float32)
+            seq_out["losses"] = tf.reduce_sum(input_tensor=token_losses * mask, axis=1) / tf.maximum(
+                tf.cast(lengths, tf.float32), 1.0
+            )
+        return seq_out
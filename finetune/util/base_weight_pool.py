@@ -0,0 +1,84 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+from finetune.util.mmap_weights import load_weights, is_mmap_weights_file, WEIGHTS_SUFFIX
+
+LOGGER = logging.getLogger("finetune")
+
+
+def load_base_weights(filename):
+    """
+    Loads a base model weight file, preferring a memory mappable copy alongside it if one exists.
+    The arrays are marked read-only as they may be shared between models.
+    """
+    mmap_filename = filename + WEIGHTS_SUFFIX
+    if is_mmap_weights_file(mmap_filename):
+        weights = load_weights(mmap_filename)
+    else:
+        weights = joblib.load(filename)
+    for value in weights.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return weights
+
+
+class BaseWeightPool:
+    """
+    Process-wide, reference counted cache of base model weights keyed by file path.
+
+    Each Saver acquires the weights for its fallback file and releases them when it is done with them, so any number
+    of models built on the same base model share a single read-only copy, which is freed once the last is released.
+    Loads happen in a background thread and are shared by everyone who acquires the same file while it is loading.
+    """
+
+    def __init__(self, max_workers=2):
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def key(filename):
+        return os.path.realpath(filename)
+
+    def acquire(self, filename):
+        """
+        Returns a (key, future) pair, where the future resolves to the weight dict. Pass the key to :meth:`release`.
+        """
+        key = self.key(filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            failed = entry is not None and entry[0].done() and entry[0].exception() is not None
+            if entry is None or failed:
+                refcount = entry[1] if entry is not None else 0
+                entry = [self._executor.submit(load_base_weights, filename), refcount]
+                self._entries[key] = entry
+            else:
+                LOGGER.debug("Sharing loaded base weights for {}".format(filename))
+            entry[1] += 1
+            return key, entry[0]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._entries[key]
+
+    def refcount(self, filename):
+        with self._lock:
+            entry = self._entries.get(self.key(filename))
+            return 0 if entry is None else entry[1]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+BASE_WEIGHT_POOL = BaseWeightPool()
@@ -0,0 +1,97 @@
+"""
+Stores finetuned weights as compressed differences against the base model weights.
+
+Lossless deltas XOR the bit patterns of the finetuned and base tensors, so bits that did not move become zeros.
+Lossy deltas quantize the arithmetic difference to a grid of width 2 * tolerance, so every reconstructed value is
+within `tolerance` of the finetuned value, up to rounding to the saved dtype. In both cases the bytes are shuffled
+into planes before compression so that the mostly-zero high bytes compress well.
+"""
+import zlib
+
+import numpy as np
+
+_UINT_TYPES = {2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+def _shuffle(arr):
+    return np.ascontiguousarray(arr.view(np.uint8).reshape(-1, arr.dtype.itemsize).T).tobytes()
+
+
+def _unshuffle(buffer, dtype, shape):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(buffer, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+def _quantized_dtype(max_abs):
+    for dtype in [np.int8, np.int16, np.int32]:
+        if max_abs <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class DeltaWeights:
+    """
+    A dict of encoded variables, decoded against the base model weights by :meth:`reconstruct`.
+    Variables which are not floating point, or which have no base weight of the same shape, are stored in full.
+    """
+
+    def __init__(self, tolerance=None, compression_level=6):
+        self.tolerance = tolerance
+        self.compression_level = compression_level
+        self.full = dict()
+        self.deltas = dict()
+
+    @classmethod
+    def encode(cls, variables, fallback, tolerance=None, compression_level=6):
+        delta_weights = cls(tolerance=tolerance, compression_level=compression_level)
+        for name, value in variables.items():
+            value = np.asarray(value)
+            base = fallback.get(name)
+            if (
+                base is None
+                or base.shape != value.shape
+                or not np.issubdtype(value.dtype, np.floating)
+                or value.dtype.itemsize not in _UINT_TYPES
+            ):
+                delta_weights.full[name] = value
+            else:
+                delta_weights.deltas[name] = delta_weights._encode_delta(value, np.asarray(base))
+        return delta_weights
+
+    def _encode_delta(self, value, base):
+        base = base.astype(value.dtype)
+        if self.tolerance is None:
+            uint_type = _UINT_TYPES[value.dtype.itemsize]
+            delta = np.bitwise_xor(value.view(uint_type), base.view(uint_type))
+        else:
+            step = 2 * self.tolerance
+            delta = np.rint((value.astype(np.float64) - base) / step)
+            delta = delta.astype(_quantized_dtype(np.max(np.abs(delta), initial=0)))
+        return (
+            zlib.compress(_shuffle(np.ascontiguousarray(delta)), self.compression_level),
+            value.dtype.str,
+            delta.dtype.str,
+            value.shape,
+        )
+
+    def _decode_delta(self, encoded, base):
+        buffer, dtype, delta_dtype, shape = encoded
+        dtype = np.dtype(dtype)
+        delta = _unshuffle(zlib.decompress(buffer), delta_dtype, shape)
+        base = np.asarray(base).astype(dtype)
+        if self.tolerance is None:
+            uint_type = _UINT_TYPES[dtype.itemsize]
+            return np.bitwise_xor(delta, base.view(uint_type)).view(dtype)
+        return (base + delta.astype(np.float64) * (2 * self.tolerance)).astype(dtype)
+
+    def reconstruct(self, fallback):
+        variables = dict(self.full)
+        for name, encoded in self.deltas.items():
+            if name not in fallback:
+                raise KeyError("Base weight {} required to reconstruct the delta checkpoint is missing.".format(name))
+            variables[name] = self._decode_delta(encoded, fallback[name])
+        return variables
+
+    def __len__(self):
+        return len(self.full) + len(self.deltas)
@@ -0,0 +1,70 @@
+"""
+Caches a teacher model's predicted probabilities so that any number of student models can be trained on them
+with :py:class:`finetune.DistillationClassifier` or :py:class:`finetune.DistillationSequenceLabeler`.
+"""
+import os
+import logging
+
+import joblib
+
+from finetune.errors import FinetuneError
+
+LOGGER = logging.getLogger("finetune")
+
+
+def _soft_targets(teacher, X):
+    # lazy import to avoid circular dependency
+    from finetune.target_models.classifier import Classifier
+    from finetune.target_models.sequence_labeling import SequenceLabeler
+
+    if isinstance(teacher, SequenceLabeler):
+        if teacher.multi_label:
+            raise FinetuneError("Soft targets cannot be produced by multi label sequence labelers.")
+        return [
+            [{"start": t["start"], "end": t["end"], "probabilities": t["probabilities"]} for t in doc["tokens"]]
+            for doc in teacher.predict(X, per_token=True)
+        ]
+    if isinstance(teacher, Classifier):
+        return teacher.predict_proba(X)
+    raise FinetuneError(
+        "Soft targets can only be produced by Classifier and SequenceLabeler models, not {}".format(
+            type(teacher).__name__
+        )
+    )
+
+
+def cache_soft_targets(teacher, X, path, chunk_size=1000):
+    """
+    Predicts the probabilities of each class with `teacher` and saves them to `path` alongside the text.
+
+    Classifier teachers produce a dict of class probabilities per document, as returned by `predict_proba`.
+    SequenceLabeler teachers produce a list per document of tokens with `start`, `end` and `probabilities`, the per
+    token probabilities returned by `predict(X, per_token=True)`.
+
+    :param teacher: A fit Classifier or SequenceLabeler.
+    :param X: list or array of (unlabeled) text.
+    :param path: File to save the text and soft targets to.
+    :param chunk_size: Number of documents to predict between progress logs.
+    :return: `path`
+    """
+    X = list(X)
+    soft_targets = []
+    with teacher.cached_predict():
+        for start in range(0, len(X), chunk_size):
+            soft_targets.extend(_soft_targets(teacher, X[start : start + chunk_size]))
+            LOGGER.info("Computed soft targets for {}/{} documents".format(len(soft_targets), len(X)))
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    joblib.dump({"X": X, "soft_targets": soft_targets, "teacher": type(teacher).__name__}, path)
+    return path
+
+
+def load_soft_targets(path):
+    """
+    Loads text and soft targets saved by :py:func:`cache_soft_targets`.
+
+    :return: (X, soft_targets), which can be passed directly to a student's `fit`.
+    """
+    cache = joblib.load(path)
+    return cache["X"], cache["soft_targets"]
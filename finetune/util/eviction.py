@@ -0,0 +1,118 @@
+"""
+Eviction policies used by :class:`finetune.scheduler.Scheduler` to pick which loaded model to close.
+"""
+from finetune.errors import FinetuneError
+
+
+class ModelStats:
+    """
+    Per-model statistics tracked by the scheduler. These persist after a model is evicted so that its load cost and
+    memory footprint are known the next time it is requested.
+
+    load_cost: seconds taken by the most recent load, including building the graph on the first prediction.
+    device_bytes / host_bytes: measured increase in accelerator and process memory from the most recent load.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.loads = 0
+        self.load_cost = None
+        self.device_bytes = None
+        self.host_bytes = None
+        self.last_used = 0
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.requests if self.requests else 0.0
+
+    def __repr__(self):
+        return "ModelStats(requests={}, hits={}, loads={}, load_cost={}, device_bytes={}, host_bytes={})".format(
+            self.requests, self.hits, self.loads, self.load_cost, self.device_bytes, self.host_bytes
+        )
+
+
+class EvictionPolicy:
+    """
+    Base class for eviction policies. `on_access` is called after every request served by a model, once its stats
+    are updated, and `on_evict` when it is closed. `victim` picks one of `candidates` to evict.
+    """
+
+    def on_access(self, name, stats):
+        pass
+
+    def on_evict(self, name, stats):
+        pass
+
+    def victim(self, candidates, stats):
+        raise NotImplementedError
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    Evicts the least recently used model.
+    """
+
+    def victim(self, candidates, stats):
+        return min(candidates, key=lambda name: stats[name].last_used)
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    Evicts the model with the fewest requests, breaking ties by least recent use.
+    """
+
+    def victim(self, candidates, stats):
+        return min(candidates, key=lambda name: (stats[name].requests, stats[name].last_used))
+
+
+class GreedyDualSizePolicy(EvictionPolicy):
+    """
+    GreedyDual-Size-Frequency. Each model's priority is `L + requests * load_cost / size`, where `L` is raised to the
+    priority of each evicted model so that models which are not used age out. Models that are cheap to reload or
+    take a lot of memory are evicted first.
+    """
+
+    def __init__(self):
+        self.inflation = 0.0
+        self.priorities = dict()
+
+    @staticmethod
+    def _size(model_stats, all_stats):
+        size = model_stats.device_bytes or model_stats.host_bytes
+        if size:
+            return size
+        known = [s.device_bytes or s.host_bytes for s in all_stats.values() if s.device_bytes or s.host_bytes]
+        return sum(known) / len(known) if known else 1.0
+
+    def priority(self, name, stats):
+        model_stats = stats[name]
+        return self.inflation + model_stats.requests * (model_stats.load_cost or 1.0) / self._size(model_stats, stats)
+
+    def on_access(self, name, stats):
+        self.priorities[name] = self.priority(name, stats)
+
+    def on_evict(self, name, stats):
+        self.inflation = self.priorities.pop(name, self.inflation)
+
+    def victim(self, candidates, stats):
+        return min(candidates, key=lambda name: (self.priorities.get(name, self.inflation), stats[name].last_used))
+
+
+EVICTION_POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "greedy_dual": GreedyDualSizePolicy,
+}
+
+
+def get_eviction_policy(policy):
+    if isinstance(policy, EvictionPolicy):
+        return policy
+    if policy not in EVICTION_POLICIES:
+        raise FinetuneError(
+            "Unknown eviction policy {}, expected one of {} or an EvictionPolicy instance.".format(
+                policy, list(EVICTION_POLICIES)
+            )
+        )
+    return EVICTION_POLICIES[policy]()
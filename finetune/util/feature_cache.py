@@ -0,0 +1,143 @@
+"""
+On-disk cache of the outputs of a frozen featurizer for the encoded training examples.
+
+When the base model is not trained (`num_layers_trained == 0`) its outputs for a document never change, so the
+training set is featurized once and every epoch trains only the target model from the cache. Features are stored in
+float16 with `save_weights` and memory mapped on load. Files are keyed by a hash of the encoded examples and the base
+model, so later fits on the same documents, such as a sweep over target model settings, reuse them.
+"""
+import os
+import hashlib
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+from finetune.util.mmap_weights import save_weights, load_weights
+
+LOGGER = logging.getLogger("finetune")
+
+FEATURE_CACHE_SUFFIX = ".features"
+
+# featurizer output -> name of the input feature holding the cached value
+CACHED_INPUTS = {
+    "features": "cached_features",
+    "sequence_features": "cached_sequence_features",
+}
+
+
+def _feats(example):
+    return example[0] if isinstance(example, tuple) else example
+
+
+def feature_cache_key(examples, signature):
+    digest = hashlib.sha1(repr(signature).encode("utf-8"))
+    for example in examples:
+        feats = _feats(example)
+        for name in sorted(feats):
+            value = np.ascontiguousarray(feats[name])
+            digest.update(repr((name, value.shape)).encode("utf-8"))
+            digest.update(value.tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Adds the cached outputs of a frozen featurizer to encoded examples, computing and saving them on the first use.
+
+    :param path: Directory to keep the cache files in.
+    :param keys: Featurizer outputs to cache, a subset of ("features", "sequence_features").
+    :param featurize_fn: Callable taking a list of encoded examples and the keys, returning an iterable with a dict of
+        the featurizer outputs for each example.
+    :param signature: Identifies the featurizer, examples are only featurized again when it changes.
+    """
+
+    def __init__(self, path, keys, featurize_fn, signature):
+        self.path = path
+        self.keys = tuple(keys)
+        self.featurize_fn = featurize_fn
+        self.signature = signature
+
+    def filename(self, examples):
+        return os.path.join(
+            self.path, feature_cache_key(examples, (self.signature, self.keys)) + FEATURE_CACHE_SUFFIX
+        )
+
+    def _compute(self, examples):
+        lengths = np.asarray([len(_feats(example)["tokens"]) for example in examples], dtype=np.int32)
+        outputs = {key: [] for key in self.keys}
+        for length, featurized in zip(lengths, self.featurize_fn(examples, self.keys)):
+            if "features" in self.keys:
+                outputs["features"].append(np.asarray(featurized["features"], dtype=np.float16))
+            if "sequence_features" in self.keys:
+                # padding added when batching is not stored
+                outputs["sequence_features"].append(
+                    np.asarray(featurized["sequence_features"][:length], dtype=np.float16)
+                )
+        arrays = {"lengths": lengths}
+        if "features" in self.keys:
+            arrays["features"] = np.stack(outputs["features"])
+        if "sequence_features" in self.keys:
+            arrays["sequence_features"] = np.concatenate(outputs["sequence_features"])
+            arrays["offsets"] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        return arrays
+
+    def load_or_compute(self, examples):
+        """
+        :return: A copy of `examples` with the cached featurizer outputs added to the input features of each.
+        """
+        if not examples:
+            return []
+        filename = self.filename(examples)
+        if os.path.exists(filename):
+            arrays = load_weights(filename)
+            LOGGER.info("Loaded cached features for {} examples from {}".format(len(examples), filename))
+        else:
+            arrays = self._compute(examples)
+            os.makedirs(self.path, exist_ok=True)
+            # written under a temporary name so an interrupted write is never mistaken for a complete cache
+            save_weights(filename + ".tmp", arrays)
+            os.replace(filename + ".tmp", filename)
+            LOGGER.info(
+                "Cached features for {} examples in {} ({:.1f}MB)".format(
+                    len(examples), filename, os.path.getsize(filename) / 2 ** 20
+                )
+            )
+
+        cached_examples = []
+        for i, example in enumerate(examples):
+            feats = dict(_feats(example))
+            feats["cached_lengths"] = arrays["lengths"][i]
+            if "features" in arrays:
+                feats[CACHED_INPUTS["features"]] = arrays["features"][i]
+            if "sequence_features" in arrays:
+                start, end = arrays["offsets"][i], arrays["offsets"][i + 1]
+                feats[CACHED_INPUTS["sequence_features"]] = arrays["sequence_features"][start:end]
+            cached_examples.append((feats,) + example[1:] if isinstance(example, tuple) else feats)
+        return cached_examples
+
+
+def add_cached_feature_types(types, shapes, example):
+    """
+    Adds the types and shapes of the cached featurizer outputs held by `example` to the dataset definition.
+    """
+    feats = _feats(example)
+    types["cached_lengths"] = tf.int32
+    shapes["cached_lengths"] = tf.TensorShape([])
+    for name in CACHED_INPUTS.values():
+        if name in feats:
+            types[name] = tf.float16
+            shapes[name] = tf.TensorShape([None] * (np.ndim(feats[name]) - 1) + [np.shape(feats[name])[-1]])
+    return types, shapes
+
+
+def cached_featurizer_state(features):
+    """
+    The featurizer state for a batch of examples with cached featurizer outputs, in place of running the featurizer.
+    """
+    lengths = features["cached_lengths"]
+    state = {"lengths": lengths, "eos_idx": lengths - 1}
+    for key, name in CACHED_INPUTS.items():
+        if name in features:
+            state[key] = tf.cast(features[name], tf.float32)
+    return state
@@ -0,0 +1,60 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+LOGGER = logging.getLogger("finetune")
+
+
+def _init_grid_search_worker(threads_per_worker):
+    # tensorflow's own thread pools are limited through config.num_threads, this covers the libraries it calls into
+    if threads_per_worker:
+        os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+
+
+def grid_search_trial(model_cls, config, trainXs, trainY, testXs, probs):
+    """
+    Fits a single grid search configuration and returns its predictions on the held out split.
+    Evaluation is left to the caller so that eval functions do not need to be picklable.
+    """
+    instance = model_cls(**config)
+    instance.finetune(*trainXs, Y=trainY)
+    if probs:
+        res = instance.predict_proba(*testXs)
+    else:
+        res = instance.predict(*testXs)
+    del instance
+    return res
+
+
+def run_grid_search_trials(model_cls, trials, probs, n_workers=None, threads_per_worker=None):
+    """
+    Runs grid search trials, each a tuple of (config, trainXs, trainY, testXs), and yields (trial_idx, predictions)
+    as trials finish. If n_workers is greater than 1, trials run in a pool of n_workers spawned processes, each limited
+    to threads_per_worker tensorflow threads; otherwise they run sequentially in this process, in order.
+    """
+    if not n_workers or n_workers <= 1:
+        for trial_idx, (config, trainXs, trainY, testXs) in enumerate(trials):
+            yield trial_idx, grid_search_trial(model_cls, config, trainXs, trainY, testXs, probs)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_grid_search_worker,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                grid_search_trial,
+                model_cls,
+                dict(config, num_threads=threads_per_worker) if threads_per_worker else config,
+                trainXs,
+                trainY,
+                testXs,
+                probs,
+            ): trial_idx
+            for trial_idx, (config, trainXs, trainY, testXs) in enumerate(trials)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
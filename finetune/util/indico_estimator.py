@@ -1,3 +1,5 @@
+import threading
+
 import numpy as np
 import tensorflow as tf
 
@@ -12,6 +14,30 @@ def parse_input_fn_result(result):
     return result, init
 
 
+class FeatureBatches:
+    """
+    Iterates over the feature batches produced by an input session, closing the session when exhausted or closed.
+    Unlike a generator, closing it closes the session even if no batch has been read yet.
+    """
+
+    def __init__(self, sess, features):
+        self.sess = sess
+        self.features = features
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.sess.run(self.features)
+        except tf.errors.OutOfRangeError:
+            self.close()
+            raise StopIteration
+
+    def close(self):
+        self.sess.close()
+
+
 class IndicoEstimator(tf.estimator.Estimator):
     def __init__(self, *args, **kwargs):
         self.estimator_spec = None
@@ -21,34 +47,63 @@ class IndicoEstimator(tf.estimator.Estimator):
         self.predictions = None
         self.mon_sess = None
         self._cached_predict = False
+        # the graph and session are built once and shared by concurrent calls to cached_predict
+        self._build_lock = threading.Lock()
+        # session -> number of references to it, held by the cache and by each call to cached_predict running on it
+        self._session_refs = {}
+        self._session_refs_lock = threading.Lock()
         super().__init__(*args, **kwargs)
 
     def get_features_from_fn(self, input_fn, predict=True):
-        with tf.Graph().as_default() as g:
+        """
+        Builds the input pipeline in its own graph and session and returns a `FeatureBatches` iterator that yields
+        feature batches as they are produced, alongside the feature tensors used to build placeholders.
+        The input session is closed when the iterator is exhausted or closed.
+        """
+        g = tf.Graph()
+        with g.as_default():
             result = self._call_input_fn(input_fn, tf.estimator.ModeKeys.PREDICT)
             features, initializer = parse_input_fn_result(result)
             if type(features) == tuple and predict:
                 features = features[0]
-            with tf.compat.v1.Session(config=self._session_config) as sess:
-                sess.run(initializer)
-                output = []
-                while True:
-                    try:
-                        output.append(sess.run(features))
-                    except tf.errors.OutOfRangeError:
-                        break
-            return output, features
+        sess = tf.compat.v1.Session(graph=g, config=self._session_config)
+        sess.run(initializer)
+        return FeatureBatches(sess, features), features
 
     def close_predict(self):
+        """
+        Drops the cached graph and session, the next call to cached_predict builds them again.
+        The session is closed once the predictions still running on it finish rather than waiting for them here,
+        so a prediction generator that is never exhausted or closed cannot block this call.
+        """
         #tf.reset_default_graph()
+        with self._build_lock:
+            mon_sess = self._close_predict()
+        if mon_sess is not None:
+            self._release_session(mon_sess)
+
+    def _close_predict(self):
+        mon_sess = self.mon_sess
         self.estimator_spec = None
         self.features_real = None
         self.placeholder_feats = None
         self.predictions = None
         self.g = None
-        if self.mon_sess is not None:
-            self.mon_sess.close()
         self.mon_sess = None
+        return mon_sess
+
+    def _acquire_session(self, mon_sess):
+        with self._session_refs_lock:
+            self._session_refs[mon_sess] = self._session_refs.get(mon_sess, 0) + 1
+
+    def _release_session(self, mon_sess):
+        with self._session_refs_lock:
+            self._session_refs[mon_sess] -= 1
+            closing = self._session_refs[mon_sess] == 0
+            if closing:
+                del self._session_refs[mon_sess]
+        if closing:
+            mon_sess.close()
 
     def cached_predict(self,
                 input_fn,
@@ -57,43 +112,56 @@ class IndicoEstimator(tf.estimator.Estimator):
                 checkpoint_path=None,
                 yield_single_examples=True):
         # Check that model has been trained.
-        self.g = self.g or tf.Graph()
-        tf.compat.v1.set_random_seed(self._config.tf_random_seed)
         features_real, features = self.get_features_from_fn(input_fn)
-        with self.g.as_default():
-            if self.estimator_spec is None:
-                self._create_and_assert_global_step(self.g)
-                if not checkpoint_path:
-                    checkpoint_path = tf.train.latest_checkpoint(self._model_dir)
-                if not checkpoint_path:
-                    tf.compat.v1.logging.info('Could not find trained model in model_dir: {}, running '
-                                    'initialization to predict.'.format(self._model_dir))
-
-                self.placeholder_feats = tf.nest.map_structure(placeholder_like, features)
-                self.estimator_spec = self._call_model_fn(
-                    self.placeholder_feats, None, tf.estimator.ModeKeys.PREDICT, self.config)
-                # Call to warm_start has to be after model_fn is called.
-                self._maybe_warm_start(checkpoint_path)
-
-                self.predictions = self._extract_keys(
-                    self.estimator_spec.predictions, predict_keys)
-                all_hooks = hooks or []
-                all_hooks.extend(list(self.estimator_spec.prediction_hooks or []))
-
-                self.mon_sess = tf.compat.v1.train.MonitoredSession(
-                    session_creator=tf.compat.v1.train.ChiefSessionCreator(
-                        checkpoint_filename_with_path=checkpoint_path,
-                        master=self._config.master,
-                        scaffold=self.estimator_spec.scaffold,
-                        config=self._session_config),
-                    hooks=all_hooks)
+        try:
+            with self._build_lock:
+                self.g = self.g or tf.Graph()
+                with self.g.as_default():
+                    tf.compat.v1.set_random_seed(self._config.tf_random_seed)
+                    if self.estimator_spec is None:
+                        self._create_and_assert_global_step(self.g)
+                        if not checkpoint_path:
+                            checkpoint_path = tf.train.latest_checkpoint(self._model_dir)
+                        if not checkpoint_path:
+                            tf.compat.v1.logging.info('Could not find trained model in model_dir: {}, running '
+                                            'initialization to predict.'.format(self._model_dir))
+
+                        self.placeholder_feats = tf.nest.map_structure(placeholder_like, features)
+                        self.estimator_spec = self._call_model_fn(
+                            self.placeholder_feats, None, tf.estimator.ModeKeys.PREDICT, self.config)
+                        # Call to warm_start has to be after model_fn is called.
+                        self._maybe_warm_start(checkpoint_path)
+
+                        self.predictions = self._extract_keys(
+                            self.estimator_spec.predictions, predict_keys)
+                        all_hooks = list(hooks or [])
+                        all_hooks.extend(list(self.estimator_spec.prediction_hooks or []))
+
+                        self.mon_sess = tf.compat.v1.train.MonitoredSession(
+                            session_creator=tf.compat.v1.train.ChiefSessionCreator(
+                                checkpoint_filename_with_path=checkpoint_path,
+                                master=self._config.master,
+                                scaffold=self.estimator_spec.scaffold,
+                                config=self._session_config),
+                            hooks=all_hooks)
+                        # the reference held by the cache, released by close_predict
+                        self._acquire_session(self.mon_sess)
+                # hold references so that a concurrent close_predict cannot pull the session out from under this call
+                mon_sess, placeholder_feats, predictions = self.mon_sess, self.placeholder_feats, self.predictions
+                self._acquire_session(mon_sess)
+        except BaseException:
+            # no batch has been read, so the input session is not closed by the loop below
+            features_real.close()
+            raise
 
+        try:
+            # session.run is thread-safe, each call feeds its own batches through the shared placeholders
             for feats in features_real:
-                feed_dict = {self.placeholder_feats[k]: v for k, v in feats.items()}
-                preds_evaluated = self.mon_sess.run(self.predictions, feed_dict=feed_dict)
+                feed_dict = {placeholder_feats[k]: v for k, v in feats.items()}
+                preds_evaluated = mon_sess.run(predictions, feed_dict=feed_dict)
                 if not yield_single_examples:
                     yield preds_evaluated
-                elif not isinstance(self.predictions, dict):
+                elif not isinstance(predictions, dict):
                     for pred in preds_evaluated:
                         yield pred
                 else:
@@ -102,4 +170,6 @@ class IndicoEstimator(tf.estimator.Estimator):
                             key: value[i]
                             for key, value in preds_evaluated.items()
                         }
-        
+        finally:
+            features_real.close()
+            self._release_session(mon_sess)
@@ -1,5 +1,6 @@
 import math
 
+import numpy as np
 import tensorflow as tf
 
 from finetune.util.timing import ProgressBar
@@ -51,16 +52,109 @@ def has_targets(generator):
     return isinstance(sample, tuple) and len(sample) == 2
 
 
-def batch_dataset(dataset, batch_size, shapes, n_epochs=1):
+def _element_length(*element):
+    feats = element[0]
+    return tf.shape(feats["tokens"])[0]
+
+
+def batch_dataset(dataset, batch_size, shapes, n_epochs=1, bucket_boundaries=None):
+    """
+    Pads and batches a dataset fn. If bucket_boundaries are provided, examples are grouped into batches of
+    similar token length, each bucket is filled in the (shuffled) order examples arrive in and is flushed at
+    the end of every epoch.
+    """
     def batched_dataset():
+        if bucket_boundaries:
+            batched = dataset().apply(
+                tf.data.experimental.bucket_by_sequence_length(
+                    _element_length,
+                    bucket_boundaries=list(bucket_boundaries),
+                    bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1),
+                    padded_shapes=shapes,
+                    drop_remainder=False,
+                )
+            )
+        else:
+            batched = dataset().padded_batch(batch_size, padded_shapes=shapes, drop_remainder=False)
         return (
-            dataset()
-            .padded_batch(batch_size, padded_shapes=shapes, drop_remainder=False)
+            batched
             .repeat(n_epochs)
             .prefetch(tf.data.experimental.AUTOTUNE)
         )
     return batched_dataset
 
+
+def _pad_and_stack(examples):
+    batch = dict()
+    for key in examples[0]:
+        arrs = [np.asarray(example[key]) for example in examples]
+        max_len = max(arr.shape[0] for arr in arrs)
+        padded = np.zeros((len(arrs), max_len) + arrs[0].shape[1:], dtype=arrs[0].dtype)
+        for i, arr in enumerate(arrs):
+            padded[i, :arr.shape[0]] = arr
+        batch[key] = padded
+    return batch
+
+
+def token_budget_batches(examples, max_tokens):
+    """
+    Groups a stream of feature dicts into zero-padded batches such that the padded size of each batch,
+    batch_size * longest sequence, does not exceed max_tokens. Examples longer than max_tokens form a batch on their own.
+    Used with sorted inputs this packs short sequences into large batches and long sequences into small ones.
+    """
+    batch = []
+    batch_max_len = 0
+    for example in examples:
+        length = len(example["tokens"])
+        new_max_len = max(batch_max_len, length)
+        if batch and new_max_len * (len(batch) + 1) > max_tokens:
+            yield _pad_and_stack(batch)
+            batch = []
+            new_max_len = length
+        batch.append(example)
+        batch_max_len = new_max_len
+    if batch:
+        yield _pad_and_stack(batch)
+
+
+def length_bucket_boundaries(max_length, n_buckets, lengths=None):
+    """
+    Boundaries for length bucketing. Uses quantiles of the observed lengths when available,
+    otherwise splits [1, max_length] evenly.
+    """
+    if lengths is not None and len(lengths):
+        boundaries = np.quantile(lengths, np.linspace(0, 1, n_buckets + 1)[1:-1])
+    else:
+        boundaries = np.linspace(1, max_length, n_buckets + 1)[1:-1]
+    # bucket_by_sequence_length buckets on length < boundary
+    return sorted(set(int(b) + 1 for b in boundaries))
+
+
+def padding_stats(lengths, batch_size, bucket_boundaries=None):
+    """
+    Simulates batching examples of the given lengths, in order, and returns the number of
+    real and padding tokens and of batches produced.
+    """
+    buckets = dict()
+    n_padding = 0
+    n_batches = 0
+
+    def flush(bucket):
+        return max(bucket) * len(bucket) - sum(bucket)
+
+    for length in lengths:
+        bucket_id = int(np.searchsorted(bucket_boundaries, length, side="right")) if bucket_boundaries else 0
+        bucket = buckets.setdefault(bucket_id, [])
+        bucket.append(length)
+        if len(bucket) == batch_size:
+            n_padding += flush(bucket)
+            n_batches += 1
+            buckets[bucket_id] = []
+    remainders = [bucket for bucket in buckets.values() if bucket]
+    n_padding += sum(flush(bucket) for bucket in remainders)
+    n_batches += len(remainders)
+    return {"tokens": int(sum(lengths)), "padding": int(n_padding), "batches": n_batches}
+
 def wrap_tqdm(gen, mode, n_epochs, val_size, dataset_size, skip_val=False, silent=False, update_hook=None):
     assert mode in {"train", "predict", "evaluate"}
     if mode == "predict":
@@ -1,6 +1,7 @@
 import os
-import copy
-from functools import partial
+import bisect
+import itertools
+from functools import partial, lru_cache
 from collections import defaultdict, OrderedDict
 
 import numpy as np
@@ -21,22 +22,25 @@ def _get_unique_classes(true, predicted):
         [seq['label'] for seqs in true_and_pred for seq in seqs]
     ))
 
+@lru_cache(maxsize=65536)
+def _spacy_token_offsets(text):
+    return tuple((token.idx, token.text) for token in get_spacy()(text))
+
+
 def _convert_to_token_list(annotations, doc_idx=None):
-    nlp = get_spacy()
     tokens = []
-    annotations = copy.deepcopy(annotations)
 
     for annotation in annotations:
         start_idx = annotation.get('start')
         tokens.extend([
             {
-                'start': start_idx + token.idx,
-                'end': start_idx + token.idx + len(token.text),
-                'text': token.text,
+                'start': start_idx + token_idx,
+                'end': start_idx + token_idx + len(token_text),
+                'text': token_text,
                 'label': annotation.get('label'),
                 'doc_idx': doc_idx
             }
-            for token in nlp(annotation.get('text'))
+            for token_idx, token_text in _spacy_token_offsets(annotation.get('text'))
         ])
 
     return tokens
@@ -102,29 +106,26 @@ def sequence_labeling_token_counts(true, predicted):
         true_tokens = _convert_to_token_list(true_list, doc_idx=i)
         pred_tokens = _convert_to_token_list(pred_list, doc_idx=i)
 
+        # first predicted token for each span, matching the order of a linear scan
+        pred_by_span = {}
+        for pred_token in pred_tokens:
+            pred_by_span.setdefault((pred_token['start'], pred_token['end']), pred_token)
+        true_spans = set((true_token['start'], true_token['end']) for true_token in true_tokens)
+
         # correct + false negatives
         for true_token in true_tokens:
-            for pred_token in pred_tokens:
-                if (pred_token['start'] == true_token['start'] and
-                    pred_token['end'] == true_token['end']):
-
-                    if pred_token['label'] == true_token['label']:
-                        d[true_token['label']]['true_positives'].append(true_token)
-                    else:
-                        d[true_token['label']]['false_negatives'].append(true_token)
-                        d[pred_token['label']]['false_positives'].append(pred_token)
-                    
-                    break
+            pred_token = pred_by_span.get((true_token['start'], true_token['end']))
+            if pred_token is None:
+                d[true_token['label']]['false_negatives'].append(true_token)
+            elif pred_token['label'] == true_token['label']:
+                d[true_token['label']]['true_positives'].append(true_token)
             else:
                 d[true_token['label']]['false_negatives'].append(true_token)
+                d[pred_token['label']]['false_positives'].append(pred_token)
 
         # false positives
         for pred_token in pred_tokens:
-            for true_token in true_tokens:
-                if (pred_token['start'] == true_token['start'] and
-                    pred_token['end'] == true_token['end']):
-                    break
-            else:
+            if (pred_token['start'], pred_token['end']) not in true_spans:
                 d[pred_token['label']]['false_positives'].append(pred_token)
     
     return d
@@ -328,12 +329,131 @@ def sequence_labeling_counts(true, predicted, equality_fn):
     return d
 
 
+class _SpanIndex:
+    """
+    Sorted index over (start, end) spans answering the existence queries behind
+    `sequences_overlap`, `sequence_exact_match` and `sequence_superset` in O(log n).
+    """
+
+    def __init__(self, spans):
+        spans = sorted(spans)
+        self.spans = set(spans)
+        self.starts = [start for start, _ in spans]
+        self.sorted_ends = sorted(end for _, end in spans)
+        ends = [end for _, end in spans]
+        self.prefix_max_end = list(itertools.accumulate(ends, max))
+        self.suffix_min_end = list(itertools.accumulate(reversed(ends), min))[::-1]
+
+    def any_start_in(self, lo, hi):
+        # start in [lo, hi)
+        i = bisect.bisect_left(self.starts, lo)
+        return i < len(self.starts) and self.starts[i] < hi
+
+    def any_end_in(self, lo, hi):
+        # end in (lo, hi]
+        i = bisect.bisect_right(self.sorted_ends, lo)
+        return i < len(self.sorted_ends) and self.sorted_ends[i] <= hi
+
+    def any_contains_start(self, point):
+        # start <= point < end
+        i = bisect.bisect_right(self.starts, point)
+        return i > 0 and self.prefix_max_end[i - 1] > point
+
+    def any_contains_end(self, point):
+        # start < point <= end
+        i = bisect.bisect_left(self.starts, point)
+        return i > 0 and self.prefix_max_end[i - 1] >= point
+
+    def any_covering(self, start, end):
+        # span start <= start and span end >= end
+        i = bisect.bisect_right(self.starts, start)
+        return i > 0 and self.prefix_max_end[i - 1] >= end
+
+    def any_covered_by(self, start, end):
+        # span start >= start and span end <= end
+        i = bisect.bisect_left(self.starts, start)
+        return i < len(self.starts) and self.suffix_min_end[i] <= end
+
+
+def _span(annotation, strip):
+    if strip:
+        annotation = strip_whitespace(annotation)
+    return annotation["start"], annotation["end"]
+
+
+def _true_span_matched(span_type, start, end, pred_index):
+    if span_type == "overlap":
+        return pred_index.any_start_in(start, end) or pred_index.any_end_in(start, end)
+    if span_type == "exact":
+        return (start, end) in pred_index.spans
+    return pred_index.any_covering(start, end)
+
+
+def _pred_span_matched(span_type, start, end, true_index):
+    if span_type == "overlap":
+        return true_index.any_contains_start(start) or true_index.any_contains_end(end)
+    if span_type == "exact":
+        return (start, end) in true_index.spans
+    return true_index.any_covered_by(start, end)
+
+
+def sequence_labeling_span_counts(true, predicted, span_type):
+    """
+    Return FP, FN, and TP counts for the "overlap", "exact" and "superset" span types.
+    Gives the same result as `sequence_labeling_counts` with the corresponding equality_fn, but uses a sorted
+    index per document and label so runs in O(n log n) rather than comparing all pairs of annotations.
+    """
+    assert span_type in {"overlap", "exact", "superset"}
+    strip = span_type != "overlap"
+    unique_classes = _get_unique_classes(true, predicted)
+
+    d = {
+        cls_: {
+            'false_positives': [],
+            'false_negatives': [],
+            'true_positives': []
+        }
+        for cls_ in unique_classes
+    }
+
+    for i, (true_annotations, predicted_annotations) in enumerate(zip(true, predicted)):
+        # add doc idx to make verification easier
+        for annotations in [true_annotations, predicted_annotations]:
+            for annotation in annotations:
+                annotation['doc_idx'] = i
+
+        true_spans = [_span(annotation, strip) for annotation in true_annotations]
+        pred_spans = [_span(annotation, strip) for annotation in predicted_annotations]
+        true_by_label = defaultdict(list)
+        pred_by_label = defaultdict(list)
+        for annotation, span in zip(true_annotations, true_spans):
+            true_by_label[annotation['label']].append(span)
+        for annotation, span in zip(predicted_annotations, pred_spans):
+            pred_by_label[annotation['label']].append(span)
+        true_index = {label: _SpanIndex(spans) for label, spans in true_by_label.items()}
+        pred_index = {label: _SpanIndex(spans) for label, spans in pred_by_label.items()}
+
+        for true_annotation, (start, end) in zip(true_annotations, true_spans):
+            label = true_annotation['label']
+            if label in pred_index and _true_span_matched(span_type, start, end, pred_index[label]):
+                d[label]['true_positives'].append(true_annotation)
+            else:
+                d[label]['false_negatives'].append(true_annotation)
+
+        for pred_annotation, (start, end) in zip(predicted_annotations, pred_spans):
+            label = pred_annotation['label']
+            if not (label in true_index and _pred_span_matched(span_type, start, end, true_index[label])):
+                d[label]['false_positives'].append(pred_annotation)
+
+    return d
+
+
 def get_seq_count_fn(span_type="token"):
     span_type_fn_mapping = {
         "token": sequence_labeling_token_counts,
-        "overlap": partial(sequence_labeling_counts, equality_fn=sequences_overlap),
-        "exact": partial(sequence_labeling_counts, equality_fn=sequence_exact_match),
-        "superset": partial(sequence_labeling_counts, equality_fn=sequence_superset),
+        "overlap": partial(sequence_labeling_span_counts, span_type="overlap"),
+        "exact": partial(sequence_labeling_span_counts, span_type="exact"),
+        "superset": partial(sequence_labeling_span_counts, span_type="superset"),
     }
     return span_type_fn_mapping[span_type]
 
@@ -0,0 +1,79 @@
+import threading
+
+
+class _Batch:
+    def __init__(self):
+        self.inputs = []
+        self.n_requests = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests with the same key into a single call.
+
+    A request for a key that has no batch running is run at once. Requests arriving while a batch for the key runs are
+    collected into the next batch, which runs when the running batch finishes, `window` seconds after its first request
+    or once `max_batch_size` documents have been collected, whichever comes first. A batch calls
+    `run_fn(key, documents)` with the documents of every request in it and hands each caller back the slice of the
+    results for its own documents. If a batched call fails, each request is retried alone so that one bad request does
+    not fail the others.
+    """
+
+    def __init__(self, run_fn, window=0.005, max_batch_size=None):
+        self.run_fn = run_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._open = dict()
+        # key -> number of batches being run
+        self._running = dict()
+
+    def submit(self, key, x):
+        x = list(x)
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._open[key] = batch
+                if key not in self._running:
+                    # nothing to wait for, other requests would only be waiting on this one
+                    batch.full.set()
+            start = len(batch.inputs)
+            batch.inputs.extend(x)
+            batch.n_requests += 1
+            if self.max_batch_size is not None and len(batch.inputs) >= self.max_batch_size:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(timeout=self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self._running[key] = self._running.get(key, 0) + 1
+            try:
+                batch.results = self.run_fn(key, batch.inputs)
+            except Exception as e:
+                batch.error = e
+            finally:
+                with self._lock:
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+                        # the next batch no longer has anything to wait for
+                        if key in self._open:
+                            self._open[key].full.set()
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            if batch.n_requests == 1:
+                raise batch.error
+            return self.run_fn(key, x)
+        return batch.results[start : start + len(x)]
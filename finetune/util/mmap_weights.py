@@ -0,0 +1,81 @@
+"""
+Uncompressed, page-aligned weight storage that can be loaded with np.memmap.
+
+Layout:
+    MAGIC (8 bytes) | header length (uint64, little endian) | json header | padding | aligned raw buffers
+
+The json header maps each variable name to its dtype, shape and byte offset from the start of the file.
+"""
+import os
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"FTWEIGHT"
+PAGE_SIZE = 4096
+WEIGHTS_SUFFIX = ".weights"
+
+
+def _align(offset, alignment=PAGE_SIZE):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def is_mmap_weights_file(path):
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_weights(path, variables):
+    """
+    Writes a dict of name -> np.ndarray to `path` with every array starting on a page boundary.
+    """
+    arrays = {name: np.asarray(value) for name, value in variables.items()}
+    # offsets are relative to the start of the data section until the header size is known
+    index = dict()
+    data_offset = 0
+    for name, arr in arrays.items():
+        index[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": data_offset}
+        data_offset = _align(data_offset + arr.nbytes)
+
+    header_size = len(json.dumps(index).encode("utf-8"))
+    while True:
+        # absolute offsets change the header length, iterate until the data start is stable
+        data_start = _align(len(MAGIC) + 8 + header_size)
+        header = json.dumps(
+            {name: dict(entry, offset=entry["offset"] + data_start) for name, entry in index.items()}
+        ).encode("utf-8")
+        if _align(len(MAGIC) + 8 + len(header)) == data_start:
+            break
+        header_size = len(header)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(index[name]["offset"] + data_start)
+            f.write(arr.tobytes(order="C"))
+        f.truncate(data_start + data_offset)
+
+
+def load_weights(path):
+    """
+    Returns a dict of name -> read-only np.ndarray views into a memory map of `path`.
+    Pages are only read from disk when accessed and are shared between processes mapping the same file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a finetune weights file".format(path))
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        index = json.loads(f.read(header_len).decode("utf-8"))
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    variables = dict()
+    for name, entry in index.items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        variables[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=entry["offset"]).reshape(shape)
+    return variables
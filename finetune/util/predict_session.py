@@ -0,0 +1,109 @@
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from finetune.errors import FinetuneError
+
+LOGGER = logging.getLogger("finetune")
+
+
+class PredictSession:
+    """
+    A long-lived inference session built on top of `IndicoEstimator.cached_predict`.
+
+    The tensorflow graph is constructed and the weights are loaded the first time the session is used, subsequent
+    calls reuse the same graph and monitored session. A single session can be shared between threads, up to
+    `max_concurrency` calls run at once against the shared graph and the rest wait their turn.
+
+    :param model: A fit finetune model.
+    :param latency_window: Number of most recent per-call latencies to keep for reporting.
+    :param max_concurrency: Number of calls allowed to run concurrently. Defaults to 1, which serializes calls.
+    """
+
+    def __init__(self, model, latency_window=1000, max_concurrency=1):
+        self.model = model
+        self.latencies = deque(maxlen=latency_window)
+        self.first_latency = None
+        self._lock = threading.RLock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._open = False
+        # whether the model was already caching its graph when the session was opened, e.g. within `cached_predict()`
+        self._was_cached = False
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def open(self):
+        with self._lock:
+            if not self._open:
+                self._was_cached = self.model._cached_predict
+                self.model._cached_predict = True
+                self._open = True
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._open:
+                # only tear down a cached graph this session set up, an enclosing cache is left to its owner
+                self.model._cached_predict = self._was_cached
+                if not self._was_cached:
+                    self.model.close()
+                self._open = False
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _call(self, method_name, *args, **kwargs):
+        with self._slots:
+            if not self._open:
+                raise FinetuneError("Cannot predict using a closed PredictSession, call `open()` first.")
+            start = time.perf_counter()
+            output = getattr(self.model, method_name)(*args, **kwargs)
+            latency = time.perf_counter() - start
+        with self._lock:
+            if self.first_latency is None:
+                self.first_latency = latency
+            self.latencies.append(latency)
+        LOGGER.debug("PredictSession.{} took {:.2f}ms".format(method_name, latency * 1000))
+        return output
+
+    def predict(self, *args, **kwargs):
+        return self._call("predict", *args, **kwargs)
+
+    def predict_proba(self, *args, **kwargs):
+        return self._call("predict_proba", *args, **kwargs)
+
+    def featurize(self, *args, **kwargs):
+        return self._call("featurize", *args, **kwargs)
+
+    def featurize_sequence(self, *args, **kwargs):
+        return self._call("featurize_sequence", *args, **kwargs)
+
+    @property
+    def last_latency(self):
+        return self.latencies[-1] if self.latencies else None
+
+    def latency_stats(self):
+        """
+        Summary of the per-call latencies (in seconds) recorded by this session.
+        The first call includes graph construction and weight loading, so is reported separately as `first`.
+        """
+        if not self.latencies:
+            return {"n_calls": 0}
+        latencies = np.asarray(self.latencies)
+        return {
+            "n_calls": len(latencies),
+            "first": self.first_latency,
+            "last": float(latencies[-1]),
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        }
@@ -0,0 +1,195 @@
+"""
+Structured pruning of the attention heads and intermediate (feed-forward) units of finetuned bert based models.
+
+Heads and units are scored on held out documents by the magnitude of the gradient of the loss with respect to a mask
+over each of them (Michel et al., 2019, "Are Sixteen Heads Really Better than One?"). The lowest scoring are removed
+from the weight matrices, so the pruned model is smaller to save and load and faster to run.
+"""
+import logging
+
+import numpy as np
+
+from finetune.errors import FinetuneError
+from finetune.model import PredictMode
+from finetune.base_models.bert.model import _BaseBert
+
+LOGGER = logging.getLogger("finetune")
+
+LAYER_SCOPE = "model/featurizer/bert/encoder/layer_{}/"
+
+
+def layer_sizes(config):
+    """
+    :return: (heads, units), the number of attention heads and intermediate units in each layer.
+    """
+    heads = config.bert_heads_per_layer or [config.n_heads] * config.n_layer
+    units = config.bert_intermediate_size_per_layer or [config.bert_intermediate_size] * config.n_layer
+    return list(heads), list(units)
+
+
+def _check_prunable(model):
+    if not issubclass(model.config.base_model, _BaseBert):
+        raise FinetuneError("Pruning is only supported by bert based models, not {}".format(model.config.base_model))
+    if model.config.num_layers_trained != model.config.n_layer:
+        raise FinetuneError("Pruning requires a model finetuned with num_layers_trained == n_layer.")
+    if model.saver.variables is None:
+        raise FinetuneError("Cannot prune a model that has not been fit.")
+
+
+def importance_scores(model, X, context=None):
+    """
+    Scores each attention head and intermediate unit of a finetuned bert based model on `X`.
+    The loss is taken against the model's own predictions, so `X` does not need labels.
+
+    :return: (head_scores, unit_scores), lists with an array of scores for each layer.
+    """
+    _check_prunable(model)
+    zipped_data = model.input_pipeline.zip_list_to_dict(X=X, context=context)
+    preds = model._inference(zipped_data, predict_keys=[PredictMode.HEAD_IMPORTANCE, PredictMode.FFN_IMPORTANCE])
+    head_scores = np.mean([pred[PredictMode.HEAD_IMPORTANCE] for pred in preds], axis=0)
+    unit_scores = np.mean([pred[PredictMode.FFN_IMPORTANCE] for pred in preds], axis=0)
+    heads, units = layer_sizes(model.config)
+    return np.split(head_scores, np.cumsum(heads)[:-1]), np.split(unit_scores, np.cumsum(units)[:-1])
+
+
+def keep_indices(layer_scores, n_prune):
+    """
+    Removes the `n_prune` lowest scoring entries across all layers, never removing the highest scoring entry of a
+    layer. Scores are normalized within each layer so that layers with larger gradients are not favoured.
+
+    :return: A sorted array of the indices to keep for each layer.
+    """
+    normalized = [scores / max(np.linalg.norm(scores), 1e-12) for scores in layer_scores]
+    candidates = sorted(
+        (score, layer, idx)
+        for layer, scores in enumerate(normalized)
+        for idx, score in enumerate(scores)
+        if idx != np.argmax(scores)
+    )
+    pruned = [set() for _ in layer_scores]
+    for _, layer, idx in candidates[:n_prune]:
+        pruned[layer].add(idx)
+    return [
+        np.asarray([idx for idx in range(len(scores)) if idx not in layer_pruned], dtype=np.int64)
+        for scores, layer_pruned in zip(layer_scores, pruned)
+    ]
+
+
+def _layer_slices(layer, heads, units, head_size):
+    # columns of the query, key and value projections, and rows of the attention output projection, for each head.
+    head_idxs = (heads[:, None] * head_size + np.arange(head_size)).ravel()
+    scope = LAYER_SCOPE.format(layer)
+    slices = {
+        scope + "attention/output/dense/kernel": (head_idxs, 0),
+        scope + "intermediate/dense/kernel": (units, -1),
+        scope + "intermediate/dense/bias": (units, -1),
+        scope + "output/dense/kernel": (units, 0),
+    }
+    for projection in ["query", "key", "value"]:
+        slices[scope + "attention/self/{}/kernel".format(projection)] = (head_idxs, -1)
+        slices[scope + "attention/self/{}/bias".format(projection)] = (head_idxs, -1)
+    return slices
+
+
+def prune_variables(variables, fallback, keep_heads, keep_units, head_size):
+    """
+    Slices the attention heads and intermediate units to keep out of each layer's weights.
+
+    :param variables: Dict of variable names to values, such as `Saver.variables`.
+    :param fallback: Dict of weights to read variables missing from `variables` from, such as `Saver.fallback`.
+    :param keep_heads: For each layer, the indices of the heads to keep.
+    :param keep_units: For each layer, the indices of the intermediate units to keep.
+    :param head_size: Size of each attention head.
+    :return: A copy of `variables` holding the pruned weights.
+    """
+    variables = dict(variables)
+    for layer, (heads, units) in enumerate(zip(keep_heads, keep_units)):
+        for base_name, (idxs, axis) in _layer_slices(layer, np.asarray(heads), np.asarray(units), head_size).items():
+            name = base_name + ":0"
+            # weights unchanged by finetuning are only in the fallback, pruned copies must not be.
+            value = variables.get(name, fallback.get(name))
+            if value is None:
+                raise FinetuneError("Cannot prune {}, the variable was not found.".format(name))
+            variables[name] = np.take(value, idxs, axis=axis)
+            # optimizer slots, such as Adam moments, have the same shape as the variable
+            for slot_name in [k for k in variables if k.startswith(base_name + "/")]:
+                variables[slot_name] = np.take(variables[slot_name], idxs, axis=axis)
+    return variables
+
+
+def prune_weights(model, keep_heads, keep_units):
+    """
+    Removes attention heads and intermediate units from the weights held by `model.saver` and updates `model.config`
+    to match, so the next graph built for the model is the smaller one.
+
+    :param keep_heads: For each layer, the indices of the heads to keep.
+    :param keep_units: For each layer, the indices of the intermediate units to keep.
+    """
+    _check_prunable(model)
+    model.saver.variables = prune_variables(
+        model.saver.variables,
+        model.saver.fallback,
+        keep_heads,
+        keep_units,
+        head_size=model.config.n_embed // model.config.n_heads,
+    )
+    model.config.bert_heads_per_layer = [len(heads) for heads in keep_heads]
+    model.config.bert_intermediate_size_per_layer = [len(units) for units in keep_units]
+    model.close()
+
+
+def prune(
+    model,
+    X,
+    head_fraction=0.5,
+    ffn_fraction=0.5,
+    context=None,
+    n_iterations=1,
+    recovery_X=None,
+    recovery_Y=None,
+    recovery_context=None,
+):
+    """
+    Removes the least important attention heads and intermediate units of a finetuned bert based model, in place.
+    The pruned model is saved and loaded as usual.
+
+    :param model: A fit model with a bert based `base_model`, e.g. RoBERTa.
+    :param X: Held out documents to score heads and units on. Labels are not needed.
+    :param head_fraction: Fraction of all attention heads to remove. At least one head is kept in each layer.
+    :param ffn_fraction: Fraction of all intermediate units to remove. At least one unit is kept in each layer.
+    :param context: Context for `X`, if the model uses auxiliary info.
+    :param n_iterations: Number of steps to remove the heads and units over, re-scoring after each step.
+    :param recovery_X: If given, the model is finetuned on `recovery_X` and `recovery_Y` after each step
+        to recover from pruning.
+    :param recovery_Y: Targets for `recovery_X`.
+    :param recovery_context: Context for `recovery_X`.
+    :return: The pruned model.
+    """
+    for name, fraction in [("head_fraction", head_fraction), ("ffn_fraction", ffn_fraction)]:
+        if not 0.0 <= fraction < 1.0:
+            raise ValueError("{} must be in [0, 1), got {}".format(name, fraction))
+    _check_prunable(model)
+
+    heads, units = layer_sizes(model.config)
+    total_heads, total_units = sum(heads), sum(units)
+    for iteration in range(1, n_iterations + 1):
+        head_scores, unit_scores = importance_scores(model, X, context=context)
+        heads, units = layer_sizes(model.config)
+        target_heads = int(round(total_heads * (1 - head_fraction * iteration / n_iterations)))
+        target_units = int(round(total_units * (1 - ffn_fraction * iteration / n_iterations)))
+        keep_heads = keep_indices(head_scores, max(sum(heads) - target_heads, 0))
+        keep_units = keep_indices(unit_scores, max(sum(units) - target_units, 0))
+        prune_weights(model, keep_heads, keep_units)
+        LOGGER.info(
+            "Pruning step {}/{}: kept {}/{} heads and {}/{} intermediate units".format(
+                iteration,
+                n_iterations,
+                sum(model.config.bert_heads_per_layer),
+                total_heads,
+                sum(model.config.bert_intermediate_size_per_layer),
+                total_units,
+            )
+        )
+        if recovery_X is not None:
+            model.fit(recovery_X, recovery_Y, context=recovery_context)
+    return model
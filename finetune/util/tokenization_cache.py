@@ -0,0 +1,83 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import joblib
+
+LOGGER = logging.getLogger("finetune")
+
+
+class TokenizationCache:
+    """
+    Bounded, content-addressed LRU cache of encoded documents.
+
+    Keys are hashes of the raw document together with a signature of the encoder and chunking settings,
+    values are the list of `EncodedOutput` chunks produced for the document. Cached values are shared
+    between callers and must not be mutated.
+
+    :param max_size: Maximum number of documents to keep, the least recently used documents are evicted first.
+    :param path: Optional file to load the cache from and to persist it to with `save()`.
+    """
+
+    def __init__(self, max_size, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def key(document, signature):
+        return hashlib.sha1(repr((signature, document)).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._cache.items())
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path provided to save the tokenization cache to.")
+        with self._lock:
+            items = list(self._cache.items())
+        joblib.dump(items, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        items = joblib.load(path)
+        with self._lock:
+            for key, value in items[-self.max_size:]:
+                self._cache[key] = value
+                self._cache.move_to_end(key)
+        LOGGER.info("Loaded {} cached documents from {}".format(len(items), path))
+
+    def __len__(self):
+        return len(self._cache)
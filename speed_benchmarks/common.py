@@ -0,0 +1,49 @@
+"""
+Data loading, timing and evaluation helpers shared by the benchmarks that finetune a classifier on SST.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from finetune import Classifier
+from finetune.datasets import generic_download
+
+SST_PATH = os.path.join("Data", "Classify", "SST-binary.csv")
+
+
+def sst_data(n_samples=1000):
+    if not os.path.exists(SST_PATH):
+        generic_download(
+            url="https://s3.amazonaws.com/enso-data/SST-binary.csv",
+            text_column="Text",
+            target_column="Target",
+            filename="SST-binary.csv",
+        )
+    dataset = pd.read_csv(SST_PATH, nrows=n_samples)
+    return train_test_split(dataset.Text.values, dataset.Target.values, test_size=0.3, random_state=42)
+
+
+def time_predict(model, x, runs):
+    with model.cached_predict():
+        model.predict_proba(x[:1])  # build the graph and load weights
+        start = time.time()
+        for _ in range(runs):
+            probas = model.predict_proba(x)
+        latency = (time.time() - start) / runs
+    return probas, latency
+
+
+def to_array(probas, classes):
+    return np.asarray([[p[c] for c in classes] for p in probas])
+
+
+def evaluate(path, test_x, test_y, runs, **overrides):
+    model = Classifier.load(path, **overrides)
+    probas, latency = time_predict(model, test_x, runs)
+    model.close()
+    classes = sorted(probas[0])
+    predictions = np.asarray(classes)[np.argmax(to_array(probas, classes), 1)]
+    return np.mean(predictions == test_y), latency * 1000 / len(test_x)
@@ -0,0 +1,34 @@
+"""
+Reports the latency and accuracy tradeoff of truncating a bert based classifier to its first layers
+(predict_num_layers) and of exiting early once an exit head is confident (early_exit_threshold).
+"""
+import os
+import tempfile
+
+from tabulate import tabulate
+
+from finetune import Classifier
+from finetune.base_models import RoBERTa
+
+from common import sst_data, evaluate
+
+
+if __name__ == "__main__":
+    runs = 3
+    exit_layers = [3, 6, 9]
+    trn_x, test_x, trn_y, test_y = sst_data()
+    path = os.path.join(tempfile.mkdtemp(), "model.jl")
+    model = Classifier(base_model=RoBERTa, n_epochs=2, early_exit_layers=exit_layers)
+    model.fit(trn_x, trn_y)
+    model.save(path)
+    del model
+
+    full_accuracy, full_latency = evaluate(path, test_x, test_y, runs)
+    output = [["Full", full_accuracy, full_latency, 1.0]]
+    for n_layers in exit_layers:
+        accuracy, latency = evaluate(path, test_x, test_y, runs, predict_num_layers=n_layers)
+        output.append(["First {} layers".format(n_layers), accuracy, latency, full_latency / latency])
+    for threshold in [0.8, 0.9, 0.95, 0.99]:
+        accuracy, latency = evaluate(path, test_x, test_y, runs, early_exit_threshold=threshold)
+        output.append(["Early exit at {}".format(threshold), accuracy, latency, full_latency / latency])
+    print(tabulate(output, headers=["Mode", "Accuracy", "ms/doc", "Speedup"], floatfmt=".3f"))
@@ -0,0 +1,37 @@
+"""
+Compares training time of a classifier on a frozen base model with and without feature_cache_path.
+The first cached fit featurizes the training data, later fits with different target model settings reuse it.
+"""
+import time
+import tempfile
+
+import numpy as np
+from tabulate import tabulate
+
+from finetune import Classifier
+from finetune.base_models import RoBERTa
+
+from common import sst_data
+
+
+def fit_and_score(trn_x, test_x, trn_y, test_y, **config):
+    model = Classifier(base_model=RoBERTa, num_layers_trained=0, train_embeddings=False, n_epochs=5, **config)
+    start = time.time()
+    model.fit(trn_x, trn_y)
+    fit_time = time.time() - start
+    accuracy = np.mean(np.asarray(model.predict(test_x)) == test_y)
+    model.close()
+    return fit_time, accuracy
+
+
+if __name__ == "__main__":
+    trn_x, test_x, trn_y, test_y = sst_data()
+    cache_path = tempfile.mkdtemp()
+    output = []
+    for lr in [1e-3, 3e-4, 1e-4]:
+        for feature_cache_path in [None, cache_path]:
+            fit_time, accuracy = fit_and_score(
+                trn_x, test_x, trn_y, test_y, lr=lr, feature_cache_path=feature_cache_path
+            )
+            output.append([lr, feature_cache_path is not None, fit_time, accuracy])
+    print(tabulate(output, headers=["lr", "Feature Cache", "Fit (s)", "Accuracy"], floatfmt=".4f"))
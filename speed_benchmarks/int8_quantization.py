@@ -0,0 +1,58 @@
+"""
+Compares int8_predict against float32 prediction for models finetuned on the bundled test datasets.
+Each model is trained once, saved, and then loaded with and without int8_predict.
+"""
+import os
+import tempfile
+
+import numpy as np
+from tabulate import tabulate
+
+from finetune import Classifier
+from finetune.base_models import RoBERTa, BERTModelCased, GPT2Model
+
+from common import sst_data, time_predict, to_array
+
+
+def compare(base_model, trn_x, test_x, trn_y, test_y, runs):
+    path = os.path.join(tempfile.mkdtemp(), "model.jl")
+    model = Classifier(base_model=base_model, n_epochs=2)
+    model.fit(trn_x, trn_y)
+    model.save(path)
+    del model
+
+    results = dict()
+    for int8_predict in [False, True]:
+        model = Classifier.load(path, int8_predict=int8_predict)
+        probas, latency = time_predict(model, test_x, runs)
+        classes = sorted(probas[0])
+        probas = to_array(probas, classes)
+        accuracy = np.mean(np.asarray(classes)[np.argmax(probas, 1)] == test_y)
+        results[int8_predict] = (probas, accuracy, latency)
+        model.close()
+
+    (fp32_probas, fp32_acc, fp32_latency), (int8_probas, int8_acc, int8_latency) = results[False], results[True]
+    return [
+        base_model.__name__,
+        fp32_acc,
+        int8_acc,
+        np.mean(np.argmax(fp32_probas, 1) == np.argmax(int8_probas, 1)),
+        np.max(np.abs(fp32_probas - int8_probas)),
+        fp32_latency * 1000 / len(test_x),
+        int8_latency * 1000 / len(test_x),
+        fp32_latency / int8_latency,
+    ]
+
+
+if __name__ == "__main__":
+    runs = 3
+    trn_x, test_x, trn_y, test_y = sst_data()
+    headers = [
+        "Base Model", "fp32 Acc", "int8 Acc", "Agreement", "Max Proba Diff", "fp32 (ms/doc)", "int8 (ms/doc)",
+        "Speedup"
+    ]
+    output = [
+        compare(base_model, trn_x, test_x, trn_y, test_y, runs=runs)
+        for base_model in [RoBERTa, BERTModelCased, GPT2Model]
+    ]
+    print(tabulate(output, headers=headers, floatfmt=".3f"))
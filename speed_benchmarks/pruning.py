@@ -0,0 +1,53 @@
+"""
+Reports the size, latency and accuracy of a RoBERTa classifier with increasing fractions of its attention heads and
+intermediate units pruned, with and without recovery finetuning.
+"""
+import os
+import tempfile
+
+from tabulate import tabulate
+from sklearn.model_selection import train_test_split
+
+from finetune import Classifier
+from finetune.base_models import RoBERTa
+from finetune.util.pruning import prune
+
+from common import sst_data, evaluate
+
+
+if __name__ == "__main__":
+    runs = 3
+    trn_x, test_x, trn_y, test_y = sst_data()
+    trn_x, held_out_x, trn_y, _ = train_test_split(trn_x, trn_y, test_size=0.2, random_state=42)
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "model.jl")
+    model = Classifier(base_model=RoBERTa, n_epochs=2)
+    model.fit(trn_x, trn_y)
+    model.save(path)
+    del model
+
+    output = [["unpruned", "-", os.path.getsize(path) / 2 ** 20, *evaluate(path, test_x, test_y, runs)]]
+    for fraction in [0.25, 0.5, 0.75]:
+        for recover in [False, True]:
+            model = Classifier.load(path)
+            prune(
+                model,
+                held_out_x,
+                head_fraction=fraction,
+                ffn_fraction=fraction,
+                n_iterations=3 if recover else 1,
+                recovery_X=trn_x if recover else None,
+                recovery_Y=trn_y if recover else None,
+            )
+            pruned_path = os.path.join(folder, "pruned-{}-{}.jl".format(fraction, recover))
+            model.save(pruned_path)
+            model.close()
+            output.append(
+                [
+                    fraction,
+                    recover,
+                    os.path.getsize(pruned_path) / 2 ** 20,
+                    *evaluate(pruned_path, test_x, test_y, runs),
+                ]
+            )
+    print(tabulate(output, headers=["Pruned", "Recovery", "Size (MB)", "Accuracy", "ms/doc"], floatfmt=".3f"))
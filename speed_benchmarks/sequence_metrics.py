@@ -0,0 +1,55 @@
+import copy
+import time
+import random
+from functools import partial
+
+from tabulate import tabulate
+
+from finetune.util.metrics import (
+    get_seq_count_fn,
+    sequence_labeling_counts,
+    sequences_overlap,
+    sequence_exact_match,
+    sequence_superset,
+)
+
+PAIRWISE_COUNT_FNS = {
+    "overlap": partial(sequence_labeling_counts, equality_fn=sequences_overlap),
+    "exact": partial(sequence_labeling_counts, equality_fn=sequence_exact_match),
+    "superset": partial(sequence_labeling_counts, equality_fn=sequence_superset),
+}
+
+
+def random_annotations(text, n_annotations, labels, rng):
+    annotations = []
+    for _ in range(n_annotations):
+        start = rng.randint(0, len(text) - 2)
+        end = rng.randint(start + 1, min(len(text), start + 60))
+        annotations.append({"start": start, "end": end, "text": text[start:end], "label": rng.choice(labels)})
+    return annotations
+
+
+def time_fn(fn, true, predicted):
+    true, predicted = copy.deepcopy(true), copy.deepcopy(predicted)
+    start = time.time()
+    fn(true, predicted)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    text = "The quick brown fox jumped over the lazy dog. " * 500
+    labels = ["animal", "action", "adjective"]
+    headers = ["Docs", "Annotations / Doc", "Span Type", "Pairwise (s)", "Sorted Index (s)", "Speedup"]
+    output = []
+    for n_docs, n_annotations in [(100, 50), (100, 200), (20, 1000)]:
+        true = [random_annotations(text, n_annotations, labels, rng) for _ in range(n_docs)]
+        predicted = [random_annotations(text, n_annotations, labels, rng) for _ in range(n_docs)]
+        for span_type, pairwise_fn in PAIRWISE_COUNT_FNS.items():
+            pairwise = time_fn(pairwise_fn, true, predicted)
+            indexed = time_fn(get_seq_count_fn(span_type), true, predicted)
+            output.append([n_docs, n_annotations, span_type, pairwise, indexed, pairwise / indexed])
+        cold = time_fn(get_seq_count_fn("token"), true, predicted)
+        warm = time_fn(get_seq_count_fn("token"), true, predicted)
+        output.append([n_docs, n_annotations, "token (cold / warm spacy cache)", cold, warm, cold / warm])
+    print(tabulate(output, headers=headers, floatfmt=".3f"))
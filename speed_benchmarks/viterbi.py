@@ -0,0 +1,34 @@
+import time
+
+import numpy as np
+from tabulate import tabulate
+
+from finetune.nn.crf import viterbi_decode, batch_viterbi_decode
+
+
+def looped_decode(scores, transitions):
+    return [viterbi_decode(score, transitions) for score in scores]
+
+
+def time_fn(fn, *args, runs):
+    start = time.time()
+    for _ in range(runs):
+        fn(*args)
+    return (time.time() - start) / runs
+
+
+if __name__ == "__main__":
+    batch_size = 16
+    runs = 5
+    rng = np.random.RandomState(0)
+    headers = ["Seq Len", "Num Tags", "Looped (ms)", "Batched (ms)", "Speedup"]
+    output = []
+    for seq_len in [64, 256, 512]:
+        for num_tags in [3, 9, 33]:
+            scores = rng.randn(batch_size, seq_len, num_tags).astype(np.float32)
+            transitions = rng.randn(num_tags, num_tags).astype(np.float32)
+            lengths = np.full([batch_size], seq_len)
+            looped = time_fn(looped_decode, scores, transitions, runs=runs)
+            batched = time_fn(batch_viterbi_decode, scores, transitions, lengths, runs=runs)
+            output.append([seq_len, num_tags, looped * 1000, batched * 1000, looped / batched])
+    print(tabulate(output, headers=headers, floatfmt=".2f"))
@@ -7,7 +7,8 @@ import gc
 from copy import copy
 import time
 from pathlib import Path
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
 # prevent excessive warning logs
@@ -21,9 +22,13 @@ import pandas as pd
 import numpy as np
 from sklearn.metrics import accuracy_score, recall_score
 
-from finetune import Classifier
+from finetune import Classifier, SequenceLabeler, DistillationClassifier
 from finetune.model import PredictMode
-from finetune.base_models import GPTModelSmall, GPT
+from finetune.input_pipeline import InputMode
+from finetune.base_models import GPTModelSmall, GPT, TextCNN
+from finetune.util.pruning import prune, importance_scores
+from finetune.util.distillation import cache_soft_targets, load_soft_targets
+from finetune.util.mmap_weights import load_weights
 from finetune.datasets import generic_download
 from finetune.config import get_config
 from finetune.errors import FinetuneError
@@ -134,6 +139,281 @@ class TestClassifier(unittest.TestCase):
         second_prediction_time = second - first
         self.assertLess(second_prediction_time, first_prediction_time / 2.0)
 
+    def test_predict_session(self):
+        """
+        Ensure a predict session reuses the graph between calls and matches uncached predictions
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        preds = model.predict(valid_sample.Text.values)
+
+        with model.predict_session() as session:
+            session_preds = session.predict(valid_sample.Text.values)
+            session.predict(valid_sample.Text[:1].values)
+            stats = session.latency_stats()
+
+        self.assertEqual(list(preds), list(session_preds))
+        self.assertEqual(stats["n_calls"], 2)
+        self.assertLess(stats["last"], stats["first"] / 2.0)
+        self.assertFalse(session.is_open)
+        with self.assertRaises(FinetuneError):
+            session.predict(valid_sample.Text[:1].values)
+
+    def test_predict_session_within_cached_predict(self):
+        """
+        Ensure closing a predict session opened within `cached_predict()` leaves the enclosing cached graph in place
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+
+        with model.cached_predict():
+            model.predict(train_sample.Text[:1].values)
+            estimator = model._cached_estimator
+            with model.predict_session() as session:
+                session.predict(train_sample.Text[:1].values)
+            self.assertTrue(model._cached_predict)
+            self.assertIs(model._cached_estimator, estimator)
+            model.predict(train_sample.Text[:1].values)
+            self.assertIs(model._cached_estimator, estimator)
+
+        self.assertFalse(model._cached_predict)
+        self.assertIsNone(model._cached_estimator)
+
+    def test_predict_session_concurrent(self):
+        """
+        Ensure concurrent callers sharing a single graph and session get the same predictions as sequential calls
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        texts = list(valid_sample.Text.values)
+        expected = model.predict_proba(texts)
+
+        with model.predict_session(max_concurrency=4) as session:
+            with ThreadPoolExecutor(4) as executor:
+                results = list(executor.map(lambda text: session.predict_proba([text])[0], texts * 3))
+            estimator = model._cached_estimator
+
+        self.assertIsNone(model._cached_estimator)
+        self.assertIsNone(estimator.mon_sess)
+        for result, exp in zip(results, expected * 3):
+            for label in exp:
+                self.assertAlmostEqual(result[label], exp[label], places=4)
+
+    def test_close_with_unfinished_prediction(self):
+        """
+        Ensure closing a model does not wait on a cached prediction that is never finished, and that the session
+        is closed once that prediction is
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        zipped_data = model.input_pipeline.zip_list_to_dict(X=list(train_sample.Text.values))
+        input_fn = model.input_pipeline.get_dataset_from_generator(
+            lambda: iter(zipped_data), input_mode=InputMode.PREDICT
+        )["predict_dataset"]
+
+        estimator, hooks = model.get_estimator(cache=True)
+        predictions = estimator.cached_predict(input_fn=input_fn, predict_keys=[PredictMode.PROBAS], hooks=hooks)
+        next(predictions)
+        mon_sess = estimator.mon_sess
+        model.close()
+        self.assertIsNone(estimator.mon_sess)
+        self.assertEqual(estimator._session_refs, {mon_sess: 1})
+        predictions.close()
+        self.assertEqual(estimator._session_refs, {})
+
+    def test_cached_predict_reads_input_lazily(self):
+        """
+        Ensure cached predictions are produced as the input is read, and the input session is closed if the graph
+        cannot be built
+        """
+        model = Classifier(**self.default_config(predict_batch_size=2))
+        train_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        zipped_data = model.input_pipeline.zip_list_to_dict(X=list(train_sample.Text.values))
+
+        def data():
+            yield from zipped_data[:4]
+            raise AssertionError("the input was read past the predictions that were requested")
+
+        input_fn = model.input_pipeline.get_dataset_from_generator(data, input_mode=InputMode.PREDICT)["predict_dataset"]
+        estimator, hooks = model.get_estimator(cache=True)
+        predictions = estimator.cached_predict(input_fn=input_fn, predict_keys=[PredictMode.PROBAS], hooks=hooks)
+        self.assertEqual(len([next(predictions) for _ in range(4)]), 4)
+        with self.assertRaises(Exception):
+            next(predictions)
+        model.close()
+
+        sessions = []
+        get_features_from_fn = estimator.get_features_from_fn
+
+        def record_session(*args, **kwargs):
+            features_real, features = get_features_from_fn(*args, **kwargs)
+            sessions.append(features_real.sess)
+            return features_real, features
+
+        with patch.object(estimator, "get_features_from_fn", side_effect=record_session), patch.object(
+            estimator, "_call_model_fn", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                next(estimator.cached_predict(input_fn=input_fn, predict_keys=[PredictMode.PROBAS], hooks=hooks))
+        self.assertTrue(sessions[0]._closed)
+
+    def test_predict_iter(self):
+        """
+        Ensure the generator based predict matches predict and preserves input order
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        probas = model.predict_proba(valid_sample.Text.values)
+        text_gen = (text for text in valid_sample.Text.values)
+        probas_iter = list(model.predict_proba_iter(text_gen, window_size=3))
+        self.assertEqual(len(probas), len(probas_iter))
+        for pred, iter_pred in zip(probas, probas_iter):
+            np.testing.assert_almost_equal(list(pred.values()), list(iter_pred.values()), decimal=4)
+        self.assertFalse(model._cached_predict)
+
+    def test_predict_iter_abandoned(self):
+        """
+        Ensure a generator abandoned partway through leaves the model's own prediction cache untouched
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        texts = list(valid_sample.Text.values)
+        probas = model.predict_proba(texts)
+
+        probas_iter = model.predict_proba_iter(iter(texts), window_size=3)
+        first = [next(probas_iter) for _ in range(4)]
+        self.assertFalse(model._cached_predict)
+        self.assertIsNone(model._cached_estimator)
+        probas_iter.close()
+        for pred, iter_pred in zip(probas, first):
+            np.testing.assert_almost_equal(list(pred.values()), list(iter_pred.values()), decimal=4)
+
+        with model.cached_predict():
+            model.predict(texts[:1])
+            estimator = model._cached_estimator
+            probas_iter = model.predict_proba_iter(iter(texts), window_size=3)
+            next(probas_iter)
+            del probas_iter
+            gc.collect()
+            self.assertTrue(model._cached_predict)
+            self.assertIs(model._cached_estimator, estimator)
+            self.assertIsNotNone(estimator.mon_sess)
+            cached_probas = model.predict_proba(texts)
+        for pred, cached_pred in zip(probas, cached_probas):
+            np.testing.assert_almost_equal(list(pred.values()), list(cached_pred.values()), decimal=4)
+
+    def test_successive_halving(self):
+        """
+        Ensure each rung keeps the best 1 / eta of configurations, trains them for eta times longer and that the
+        last surviving configuration is returned
+        """
+        train_sample = self.dataset.sample(n=self.n_sample)
+        configs = [get_config(**self.default_config(lr=lr)) for lr in [1e-3, 1e-4, 1e-5, 1e-6]]
+        # rung 1 keeps configs 1 and 2, rung 2 keeps config 2 which is trained once more
+        scores = [0.1, 0.4, 0.3, 0.2, 0.5, 0.6, 0.7]
+
+        for return_all in [True, False]:
+            score_iter = iter(scores)
+            with patch.object(Classifier, "_grid_configs", return_value=configs):
+                result = Classifier.finetune_successive_halving(
+                    train_sample.Text.values,
+                    train_sample.Target.values,
+                    test_size=4,
+                    eval_fn=lambda pred, truth: next(score_iter),
+                    min_epochs=1,
+                    eta=2,
+                    return_all=return_all,
+                    **self.default_config()
+                )
+            self.assertEqual(list(score_iter), [])
+            if return_all:
+                self.assertEqual(
+                    [(config.lr, score, epochs) for config, score, epochs in result],
+                    [(1e-3, 0.1, 1), (1e-4, 0.5, 2), (1e-5, 0.7, 4), (1e-6, 0.2, 1)],
+                )
+            else:
+                self.assertEqual(result.lr, 1e-5)
+
+    def test_tokenize_workers(self):
+        """
+        Ensure multi-process tokenization gives the same predictions as in-thread tokenization
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        probas = model.predict_proba(valid_sample.Text.values)
+        model.config.tokenize_workers = 2
+        probas_parallel = model.predict_proba(valid_sample.Text.values)
+        for pred, parallel_pred in zip(probas, probas_parallel):
+            np.testing.assert_almost_equal(list(pred.values()), list(parallel_pred.values()), decimal=4)
+        model.close()
+
+    def test_tokenize_workers_training(self):
+        """
+        Ensure the training and validation splits can be tokenized by worker processes, which fill the tokenization
+        cache of the parent process and are shut down by close()
+        """
+        model = Classifier(**self.default_config(tokenize_workers=2, val_size=2, tokenization_cache_size=1000))
+        train_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+
+        pipeline = model.input_pipeline
+        # the training and validation splits are tokenized by the same workers, which are kept for later calls
+        pool, _ = pipeline._tokenize_pool_
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        self.assertIs(pipeline._tokenize_pool_[0], pool)
+
+        zipped_data = pipeline.zip_list_to_dict(X=train_sample.Text.values, Y=train_sample.Target.values)
+        pipeline.tokenization_cache.clear()
+        parallel = list(pipeline.tokenize_all(zipped_data))
+        self.assertIs(pipeline._tokenize_pool_[0], pool)
+        self.assertEqual(len(pipeline.tokenization_cache), len(set(train_sample.Text.values)))
+        pipeline.config.tokenize_workers = None
+        pipeline.tokenization_cache.clear()
+        serial = list(pipeline.tokenize_all(zipped_data))
+        self.assertEqual(len(parallel), len(serial))
+        for (parallel_feats, parallel_y), (feats, y) in zip(parallel, serial):
+            np.testing.assert_array_equal(parallel_feats["tokens"], feats["tokens"])
+            np.testing.assert_array_equal(parallel_y, y)
+
+        model.close()
+        self.assertIsNone(getattr(pipeline, "_tokenize_pool_", None))
+
+    def test_predict_batch_tokens(self):
+        """
+        Ensure token budget batching gives the same predictions as fixed size batches, with and without caching
+        """
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        probas = model.predict_proba(valid_sample.Text.values)
+        model.config.predict_batch_tokens = 256
+        with patch.object(
+            model.input_pipeline, "make_dataset_fn", wraps=model.input_pipeline.make_dataset_fn
+        ) as make_dataset_fn:
+            probas_budget = model.predict_proba(valid_sample.Text.values)
+        # batches go through the same dataset construction as fixed size batches
+        self.assertEqual(make_dataset_fn.call_count, 1)
+        self.assertEqual(make_dataset_fn.call_args[1]["tqdm_mode"], "predict")
+        with model.cached_predict():
+            probas_budget_cached = model.predict_proba(valid_sample.Text.values)
+        for pred, budget_pred, cached_pred in zip(probas, probas_budget, probas_budget_cached):
+            np.testing.assert_almost_equal(list(pred.values()), list(budget_pred.values()), decimal=4)
+            np.testing.assert_almost_equal(list(pred.values()), list(cached_pred.values()), decimal=4)
+
     def test_correct_cached_predict(self):
         model = Classifier(**self.default_config())
         train_sample = self.dataset.sample(n=self.n_sample)
@@ -299,6 +579,190 @@ class TestClassifier(unittest.TestCase):
         for i, prediction in enumerate(predictions):
             self.assertEqual(prediction, new_predictions[i])
 
+    def test_save_load_mmap_weights(self):
+        """
+        Ensure models saved with memory mapped weights give the same predictions after reload
+        """
+        save_file = "tests/saved-models/test-save-load-mmap"
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text, train_sample.Target)
+        predictions = model.predict(valid_sample.Text)
+        model.save(save_file, mmap_weights=True)
+        self.assertTrue(os.path.exists(save_file + ".weights"))
+
+        model = Classifier.load(save_file)
+        self.assertFalse(next(iter(model.saver.variables.values())).flags.writeable)
+        new_predictions = model.predict(valid_sample.Text)
+        for i, prediction in enumerate(predictions):
+            self.assertEqual(prediction, new_predictions[i])
+
+    def test_save_load_delta(self):
+        """
+        Ensure delta checkpoints reconstruct the finetuned weights exactly
+        """
+        save_file = "tests/saved-models/test-save-load-delta"
+        model = Classifier(**self.default_config(save_delta=True))
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text, train_sample.Target)
+        predictions = model.predict(valid_sample.Text)
+        model.save(save_file)
+
+        loaded = Classifier.load(save_file)
+        for name, value in loaded.saver.variables.items():
+            np.testing.assert_array_equal(value, model.saver.variables[name])
+        new_predictions = loaded.predict(valid_sample.Text)
+        for i, prediction in enumerate(predictions):
+            self.assertEqual(prediction, new_predictions[i])
+
+    def test_int8_predict(self):
+        """
+        Ensure int8 inference produces features and predictions close to float32 inference
+        """
+        save_file = "tests/saved-models/test-int8-predict"
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text, train_sample.Target)
+        features = model.featurize(valid_sample.Text)
+        probas = model.predict_proba(valid_sample.Text)
+        model.save(save_file)
+
+        int8_model = Classifier.load(save_file, int8_predict=True)
+        int8_features = int8_model.featurize(valid_sample.Text)
+        int8_probas = int8_model.predict_proba(valid_sample.Text)
+        self.assertEqual(int8_features.shape, features.shape)
+        cosine = np.sum(features * int8_features, 1) / (
+            np.linalg.norm(features, axis=1) * np.linalg.norm(int8_features, axis=1)
+        )
+        self.assertGreater(np.mean(cosine), 0.95)
+        for proba, int8_proba in zip(probas, int8_probas):
+            for label in proba:
+                self.assertAlmostEqual(proba[label], int8_proba[label], delta=0.1)
+
+    def test_early_exit(self):
+        """
+        Ensure early exit and truncated prediction use the exit heads
+        """
+        save_file = "tests/saved-models/test-early-exit"
+        model = Classifier(**self.default_config(early_exit_layers=[2]))
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text, train_sample.Target)
+        self.assertEqual(len(model.predict(valid_sample.Text)), self.n_sample)
+        model.save(save_file)
+
+        # a threshold of 0 always exits at the first exit head, which is the same as truncating to that layer.
+        exit_probas = Classifier.load(save_file, early_exit_threshold=0.0).predict_proba(valid_sample.Text)
+        truncated_probas = Classifier.load(save_file, predict_num_layers=2).predict_proba(valid_sample.Text)
+        for exit_proba, truncated_proba in zip(exit_probas, truncated_probas):
+            for label in exit_proba:
+                self.assertAlmostEqual(exit_proba[label], truncated_proba[label], places=4)
+
+        with self.assertRaises(ValueError):
+            SequenceLabeler(early_exit_layers=[2])
+
+    def test_feature_cache(self):
+        """
+        Ensure a frozen base model featurizes the training data once and later fits reuse the cached features
+        """
+        cache_path = "tests/saved-models/test-feature-cache"
+        shutil.rmtree(cache_path, ignore_errors=True)
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        config = self.default_config(num_layers_trained=0, train_embeddings=False, feature_cache_path=cache_path)
+
+        model = Classifier(**config)
+        model.fit(train_sample.Text, train_sample.Target)
+        cache_files = sorted(os.listdir(cache_path))
+        self.assertGreater(len(cache_files), 0)
+        self.assertEqual(len(model.predict(valid_sample.Text)), self.n_sample)
+
+        model = Classifier(**dict(config, lr=1e-3))
+        model.fit(train_sample.Text, train_sample.Target)
+        self.assertEqual(sorted(os.listdir(cache_path)), cache_files)
+        self.assertEqual(len(model.predict(valid_sample.Text)), self.n_sample)
+
+        with self.assertRaises(ValueError):
+            Classifier(**self.default_config(feature_cache_path=cache_path))
+
+    def test_feature_cache_ignores_predict_settings(self):
+        """
+        Ensure features are cached without the predict time approximations, which are not part of the cache key
+        """
+        train_sample = self.dataset.sample(n=self.n_sample)
+        cached = []
+        for cache_path, int8_predict in [
+            ("tests/saved-models/test-feature-cache-float", False),
+            ("tests/saved-models/test-feature-cache-int8", True),
+        ]:
+            shutil.rmtree(cache_path, ignore_errors=True)
+            model = Classifier(
+                **self.default_config(
+                    num_layers_trained=0, train_embeddings=False, feature_cache_path=cache_path, int8_predict=int8_predict
+                )
+            )
+            model.fit(train_sample.Text, train_sample.Target)
+            cached.append({name: load_weights(os.path.join(cache_path, name)) for name in os.listdir(cache_path)})
+
+        self.assertEqual(sorted(cached[0]), sorted(cached[1]))
+        for name in cached[0]:
+            np.testing.assert_array_equal(cached[0][name]["features"], cached[1][name]["features"])
+
+    def test_prune(self):
+        """
+        Ensure pruning removes heads and intermediate units from the saved weights and the model still predicts
+        """
+        save_file = "tests/saved-models/test-prune"
+        model = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        valid_sample = self.dataset.sample(n=self.n_sample)
+        model.fit(train_sample.Text, train_sample.Target)
+        n_heads, n_units = model.config.n_heads, model.config.bert_intermediate_size
+
+        head_scores, unit_scores = importance_scores(model, valid_sample.Text)
+        self.assertEqual([len(scores) for scores in head_scores], [n_heads] * model.config.n_layer)
+        self.assertEqual([len(scores) for scores in unit_scores], [n_units] * model.config.n_layer)
+
+        prune(model, valid_sample.Text, head_fraction=0.5, ffn_fraction=0.5, n_iterations=2,
+              recovery_X=train_sample.Text, recovery_Y=train_sample.Target)
+        self.assertEqual(sum(model.config.bert_heads_per_layer), n_heads * model.config.n_layer // 2)
+        self.assertEqual(sum(model.config.bert_intermediate_size_per_layer), n_units * model.config.n_layer // 2)
+        kernel = model.saver.variables["model/featurizer/bert/encoder/layer_0/intermediate/dense/kernel:0"]
+        self.assertEqual(kernel.shape[-1], model.config.bert_intermediate_size_per_layer[0])
+        self.assertEqual(len(model.predict(valid_sample.Text)), self.n_sample)
+        model.save(save_file)
+
+        model = Classifier.load(save_file)
+        self.assertEqual(len(model.predict(valid_sample.Text)), self.n_sample)
+
+    def test_distillation(self):
+        """
+        Ensure a student can be trained from a teacher's cached soft targets
+        """
+        cache_file = "tests/saved-models/test-soft-targets.jl"
+        teacher = Classifier(**self.default_config())
+        train_sample = self.dataset.sample(n=self.n_sample)
+        unlabeled_sample = self.dataset.sample(n=self.n_sample)
+        teacher.fit(train_sample.Text, train_sample.Target)
+        cache_soft_targets(teacher, unlabeled_sample.Text, cache_file)
+
+        X, soft_targets = load_soft_targets(cache_file)
+        self.assertEqual(list(X), list(unlabeled_sample.Text))
+        self.assertEqual(len(soft_targets), self.n_sample)
+        self.assertAlmostEqual(sum(soft_targets[0].values()), 1.0, places=4)
+
+        student = DistillationClassifier(**self.default_config(base_model=TextCNN, distillation_temperature=2.0))
+        student.fit(X, soft_targets)
+        predictions = student.predict(unlabeled_sample.Text)
+        self.assertEqual(len(predictions), self.n_sample)
+        for prediction in predictions:
+            self.assertIn(prediction, soft_targets[0])
+        probas = student.predict_proba(unlabeled_sample.Text)
+        self.assertEqual(set(probas[0]), set(soft_targets[0]))
+
     def test_featurize(self):
         """
         Ensure featurization returns an array of the right shape
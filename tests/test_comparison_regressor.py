@@ -69,6 +69,10 @@ class TestComparisonRegression(unittest.TestCase):
 
         self.assertGreater(naive_baseline_mse, mse)
 
+        # the windowed iterator passes its estimator through, predict_proba still raises its own error
+        with self.assertRaises(AttributeError):
+            list(model.predict_proba_iter(iter(x_te), window_size=10))
+
 
 if __name__ == '__main__':
     unittest.main()
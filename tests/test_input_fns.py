@@ -27,7 +27,7 @@ from finetune.base_models import GPTModelSmall, GPT
 from finetune.datasets import generic_download
 from finetune.config import get_config
 from finetune.errors import FinetuneError
-from finetune.util.input_utils import InputMode
+from finetune.util.input_utils import InputMode, length_bucket_boundaries, padding_stats, token_budget_batches
 
 SST_FILENAME = "SST-binary.csv"
 
@@ -138,3 +138,46 @@ class TestInputFns(unittest.TestCase):
             
 
         
+
+    def test_length_bucketing_reduces_padding(self):
+        lengths = np.random.RandomState(0).randint(1, 512, size=1000).tolist()
+        boundaries = length_bucket_boundaries(512, 8, lengths=lengths)
+        self.assertEqual(boundaries, sorted(boundaries))
+        unbucketed = padding_stats(lengths, batch_size=16)
+        bucketed = padding_stats(lengths, batch_size=16, bucket_boundaries=boundaries)
+        self.assertEqual(unbucketed["tokens"], bucketed["tokens"])
+        self.assertLess(bucketed["padding"], unbucketed["padding"] / 2)
+        self.assertEqual(unbucketed["batches"], 63)
+        self.assertGreaterEqual(bucketed["batches"], 63)
+
+    def test_fit_length_bucketing(self):
+        model = Classifier(length_bucketing=True, n_length_buckets=4, batch_size=3, n_epochs=2, val_size=0.1)
+        train_sample = self.dataset.sample(n=30)
+        model.fit(train_sample.Text.values, train_sample.Target.values)
+        self.assertEqual(len(model.predict(train_sample.Text.values)), 30)
+
+    def test_length_bucketing_steps_cover_epochs(self):
+        model = Classifier(length_bucketing=True, n_length_buckets=4, batch_size=4, n_epochs=3, val_size=0)
+        train_sample = self.dataset.sample(n=30)
+        zipped_data = model.input_pipeline.zip_list_to_dict(X=train_sample.Text.values, Y=train_sample.Target.values)
+        datasets = model.input_pipeline.get_dataset_from_list(zipped_data, InputMode.TRAIN)
+        steps_per_epoch = model._n_steps(
+            n_examples=model.input_pipeline.dataset_size,
+            batch_size=4,
+            n_gpus=1,
+            n_batches=model.input_pipeline.batches_per_epoch,
+        )
+        batches = list(datasets["train_dataset"]())
+        # the steps taken by fit read exactly n_epochs full passes over the data, partial bucket batches included
+        self.assertEqual(len(batches), steps_per_epoch * 3)
+        self.assertEqual(
+            sum(int(features["tokens"].shape[0]) for features, _ in batches), 3 * model.input_pipeline.dataset_size
+        )
+
+    def test_token_budget_batches(self):
+        examples = [{"tokens": np.arange(n) + 1} for n in [2, 3, 3, 5, 8, 8, 20, 40]]
+        batches = list(token_budget_batches(examples, max_tokens=16))
+        self.assertEqual([b["tokens"].shape for b in batches], [(3, 3), (2, 8), (1, 8), (1, 20), (1, 40)])
+        self.assertEqual(sum(b["tokens"].shape[0] for b in batches), len(examples))
+        # zero padded like padded_batch
+        np.testing.assert_array_equal(batches[0]["tokens"][0], [1, 2, 0])
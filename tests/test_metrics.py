@@ -1,10 +1,18 @@
+import copy
+import random
 import unittest
+from functools import partial
+
 from finetune.util.metrics import (
     seq_recall,
     seq_precision,
     get_seq_count_fn,
     micro_f1,
     sequence_f1,
+    sequence_labeling_counts,
+    sequences_overlap,
+    sequence_exact_match,
+    sequence_superset,
 )
 
 
@@ -574,3 +582,33 @@ class TestMetrics(unittest.TestCase):
                 span_type=span_type,
             )
 
+
+
+class TestSpanCountParity(unittest.TestCase):
+
+    def random_annotations(self, text, rng):
+        annotations = []
+        for _ in range(rng.randint(0, 10)):
+            start = rng.randint(0, len(text) - 2)
+            end = rng.randint(start, min(len(text), start + 30))
+            annotations.append({"start": start, "end": end, "text": text[start:end], "label": rng.choice("ab")})
+        return annotations
+
+    def test_matches_pairwise_counts(self):
+        rng = random.Random(0)
+        text = "Alert: Pepsi Company stocks are up today April 5, 2010 and no one profited.  " * 4
+        for equality_fn, span_type in [
+            (sequences_overlap, "overlap"),
+            (sequence_exact_match, "exact"),
+            (sequence_superset, "superset"),
+        ]:
+            pairwise_fn = partial(sequence_labeling_counts, equality_fn=equality_fn)
+            for _ in range(50):
+                true = [self.random_annotations(text, rng) for _ in range(3)]
+                predicted = [self.random_annotations(text, rng) for _ in range(3)]
+                # ensure there are some exact matches
+                predicted[0] = predicted[0] + copy.deepcopy(true[0])
+                self.assertEqual(
+                    pairwise_fn(copy.deepcopy(true), copy.deepcopy(predicted)),
+                    get_seq_count_fn(span_type)(copy.deepcopy(true), copy.deepcopy(predicted)),
+                )
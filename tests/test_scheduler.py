@@ -2,7 +2,9 @@ import os
 import unittest
 import time
 import shutil
+import gc
 import warnings
+from unittest.mock import patch
 
 # prevent excessive warning logs
 warnings.filterwarnings('ignore')
@@ -11,6 +13,8 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 from finetune.base_models import RoBERTa, GPT
 from finetune import Classifier
 from finetune.scheduler import Scheduler
+from finetune.util.base_weight_pool import BASE_WEIGHT_POOL
+from finetune.util.eviction import ModelStats, LRUPolicy, LFUPolicy, GreedyDualSizePolicy
 
 
 class TestScheduler(unittest.TestCase):
@@ -79,3 +83,105 @@ class TestScheduler(unittest.TestCase):
         self.assertEqual(pred1a, pred1b)
         pred2a = shed.predict(m2, ["A"]) # Load another model.
         self.assertEqual(len(shed.loaded_models), 1)
+
+    def test_scheduler_eviction_policy(self):
+        m1 = os.path.join(self.folder, self.model1)
+        m2 = os.path.join(self.folder, self.model2)
+        shed = Scheduler(max_models=1, eviction_policy="greedy_dual")
+        shed.predict(m1, ["A"])
+        shed.predict(m1, ["A"])
+        stats = shed.model_stats[m1]
+        self.assertEqual((stats.requests, stats.hits, stats.loads), (2, 1, 1))
+        self.assertGreater(stats.load_cost, 0)
+        self.assertIsNotNone(stats.host_bytes)
+        shed.predict(m2, ["A"])
+        self.assertEqual(shed.loaded_models, [m2])
+
+
+    def test_scheduler_prefetch(self):
+        m1 = os.path.join(self.folder, self.model1)
+        m2 = os.path.join(self.folder, self.model2)
+        shed = Scheduler(warmup_x=["warm up"])
+        future = shed.prefetch(m1)
+        self.assertIs(shed.prefetch(m1), future) # no duplicate load while loading
+        future.result()
+        self.assertEqual(shed.loaded_models, [m1])
+
+        pred1 = shed.predict(m1, ["A"])
+        self.assertEqual(shed.model_stats[m1].hits, 1)
+
+        futures = [shed.predict_async(m2, ["A"]), shed.predict_async(m1, ["A"])]
+        self.assertEqual(futures[1].result(), pred1)
+        futures[0].result()
+        self.assertEqual(shed.model_stats[m2].loads, 1)
+
+
+    def test_scheduler_releases_base_weights(self):
+        m2 = os.path.join(self.folder, self.model2)
+        gc.collect()
+        base_model_path = Classifier.load(m2).config.base_model_path
+        gc.collect()
+        refcount = BASE_WEIGHT_POOL.refcount(base_model_path)
+        for keep_weights, expected in [(False, refcount), (True, refcount + 1)]:
+            shed = Scheduler(keep_weights=keep_weights)
+            shed.predict(m2, ["A"])
+            self.assertEqual(BASE_WEIGHT_POOL.refcount(base_model_path), expected)
+            shed.close_all()
+
+    def test_make_room(self):
+        shed = Scheduler(max_models=3)
+        shed.loaded_models = ["a", "b"]
+        # "c" is being loaded and "d" is queued behind it, only "c" needs a slot
+        shed._loading = {"c": None, "d": None}
+        shed._loads_in_progress = {"c"}
+        evict = lambda: bool(shed.loaded_models.pop(0))
+        with patch.object(shed, "_memory_estimate", return_value=(0, None)), patch.object(
+            shed, "_memory_for_one_more", return_value=True
+        ), patch.object(shed, "_close_oldest_model", side_effect=evict):
+            shed._make_room("c")
+        self.assertEqual(shed.loaded_models, ["a", "b"])
+
+        # models are evicted until there is memory for the load, estimating its size once
+        with patch.object(shed, "_memory_estimate", return_value=(0, None)) as memory_estimate, patch.object(
+            shed, "_memory_for_one_more", side_effect=[False, True]
+        ), patch.object(shed, "_close_oldest_model", side_effect=evict):
+            shed._make_room("c")
+        self.assertEqual(shed.loaded_models, ["b"])
+        self.assertEqual(memory_estimate.call_count, 1)
+
+    def test_scheduler_micro_batching(self):
+        m1 = os.path.join(self.folder, self.model1)
+        shed = Scheduler(batch_window=0.1, max_batch_size=8)
+        expected = Scheduler().predict(m1, ["A", "B", "C"])
+        futures = [shed.predict_async(m1, [x]) for x in ["A", "B", "C"]]
+        self.assertEqual([list(f.result()) for f in futures], [[p] for p in expected])
+
+
+class TestEvictionPolicies(unittest.TestCase):
+
+    def make_stats(self, requests, last_used, load_cost=None, host_bytes=None):
+        stats = ModelStats()
+        stats.requests = requests
+        stats.last_used = last_used
+        stats.load_cost = load_cost
+        stats.host_bytes = host_bytes
+        return stats
+
+    def test_lru_lfu(self):
+        stats = {"a": self.make_stats(requests=5, last_used=1), "b": self.make_stats(requests=1, last_used=2)}
+        self.assertEqual(LRUPolicy().victim(["a", "b"], stats), "a")
+        self.assertEqual(LFUPolicy().victim(["a", "b"], stats), "b")
+
+    def test_greedy_dual(self):
+        policy = GreedyDualSizePolicy()
+        stats = {
+            # expensive to reload and small
+            "a": self.make_stats(requests=1, last_used=1, load_cost=10.0, host_bytes=100),
+            # cheap to reload and large
+            "b": self.make_stats(requests=1, last_used=2, load_cost=1.0, host_bytes=1000),
+        }
+        for name in stats:
+            policy.on_access(name, stats)
+        self.assertEqual(policy.victim(["a", "b"], stats), "b")
+        policy.on_evict("b", stats)
+        self.assertEqual(policy.inflation, 1.0 / 1000)
@@ -22,10 +22,14 @@ import requests
 from bs4 import BeautifulSoup as bs
 from bs4.element import Tag
 
-from finetune import SequenceLabeler
+from finetune import SequenceLabeler, DistillationSequenceLabeler
 from finetune.base_models import GPT
 from finetune.config import get_config
 from finetune.encoding.sequence_encoder import finetune_to_indico_sequence
+from finetune.encoding.input_encoder import EncodedOutput
+from finetune.encoding.target_encoders import SoftSequenceLabelingEncoder
+from finetune.util.distillation import cache_soft_targets, load_soft_targets
+from finetune.nn.crf import viterbi_decode, batch_viterbi_decode
 from finetune.util.metrics import (
     sequence_labeling_token_precision, sequence_labeling_token_recall,
     sequence_labeling_overlap_precision, sequence_labeling_overlap_recall
@@ -34,6 +38,48 @@ from finetune.util.metrics import (
 SKIP_LM_TESTS = get_config().base_model.is_bidirectional
 
 
+class TestBatchViterbi(unittest.TestCase):
+
+    def test_matches_viterbi_decode(self):
+        rng = np.random.RandomState(0)
+        scores = rng.randn(4, 17, 5)
+        transitions = rng.randn(5, 5)
+        lengths = np.array([17, 1, 9, 12])
+        tags, probs = batch_viterbi_decode(scores, transitions, lengths)
+        for i, length in enumerate(lengths):
+            expected_tags, expected_probs = viterbi_decode(scores[i, :length], transitions)
+            self.assertEqual(tags[i, :length].tolist(), list(expected_tags))
+            np.testing.assert_allclose(probs[i, :length], expected_probs, rtol=1e-6)
+
+    def test_no_lengths(self):
+        rng = np.random.RandomState(1)
+        scores = rng.randn(3, 11, 4)
+        transitions = rng.randn(4, 4)
+        tags, _ = batch_viterbi_decode(scores, transitions)
+        for i in range(3):
+            self.assertEqual(tags[i].tolist(), list(viterbi_decode(scores[i], transitions)[0]))
+
+
+class TestSoftSequenceLabelingEncoder(unittest.TestCase):
+
+    def test_transform(self):
+        labels = [
+            {"start": 0, "end": 5, "probabilities": {"<PAD>": 0.1, "A": 0.9}},
+            {"start": 6, "end": 11, "probabilities": {"<PAD>": 0.7, "A": 0.3}},
+        ]
+        encoder = SoftSequenceLabelingEncoder(pad_token="<PAD>")
+        encoder.fit([labels])
+        out = EncodedOutput(
+            tokens=["<s>", "Hel", "lo", " wor", "ld", "!", "</s>"],
+            token_starts=[-1, 0, 3, 5, 9, 11, -1],
+            token_ends=[-1, 3, 5, 9, 11, 12, -1],
+        )
+        targets = encoder.transform(out, labels)
+        np.testing.assert_allclose(targets[:, encoder.lookup["A"]], [0.0, 0.9, 0.9, 0.3, 0.3, 0.0, 0.0])
+        np.testing.assert_allclose(targets.sum(axis=1), 1.0)
+        self.assertEqual(encoder.inverse_transform(targets)[:3], ["<PAD>", "A", "A"])
+
+
 class TestSequenceLabeler(unittest.TestCase):
 
     n_sample = 100
@@ -184,6 +230,35 @@ class TestSequenceLabeler(unittest.TestCase):
 
         self.assertGreater(reweighted_token_recall['Named Entity'], token_recall['Named Entity'])
 
+    def test_distillation(self):
+        """
+        Ensure a student can be trained from a teacher's cached per token probabilities
+        """
+        raw_docs = ["".join(text) for text in self.texts]
+        texts, annotations = finetune_to_indico_sequence(raw_docs, self.texts, self.labels,
+                                                         none_value=self.model.config.pad_token)
+        train_texts, test_texts, train_annotations, _ = train_test_split(
+            texts, annotations, test_size=0.1, random_state=42
+        )
+        cache_file = 'tests/saved-models/test-soft-targets.jl'
+        self.model.fit(train_texts, train_annotations)
+        try:
+            cache_soft_targets(self.model, test_texts, cache_file)
+            X, soft_targets = load_soft_targets(cache_file)
+        finally:
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+        self.assertEqual(len(soft_targets), len(test_texts))
+        self.assertIn('Named Entity', soft_targets[0][0]['probabilities'])
+
+        student = DistillationSequenceLabeler(**self.default_config())
+        student.fit(X, soft_targets)
+        predictions = student.predict(test_texts)
+        self.assertEqual(len(predictions), len(test_texts))
+        for doc_predictions in predictions:
+            for prediction in doc_predictions:
+                self.assertEqual(prediction['label'], 'Named Entity')
+
     def test_cached_predict(self):
         """
         Ensure model training does not error out
@@ -242,6 +317,26 @@ class TestSequenceLabeler(unittest.TestCase):
         self.assertTrue(1 <= len(predictions[0]) <= 3)
         self.assertTrue(any(pred["text"].strip() == "dog" for pred in predictions[0]))
 
+    def test_offset_sequence_reconstruction(self):
+        """
+        Ensure annotations built from subtoken offsets match those found by searching the raw text
+        """
+        test_sequence = ["I am a dog. A dog that's incredibly bright. I can talk, read, and write!"]
+        path = os.path.join(os.path.dirname(__file__), "data", "testdata.json")
+
+        with open(path, "rt") as fp:
+            text, labels = json.load(fp)
+
+        self.model.fit(text * 10, labels * 10)
+        predictions = self.model.predict(test_sequence)
+        self.model.config.offset_sequence_reconstruction = True
+        offset_predictions = self.model.predict(test_sequence)
+
+        spans = lambda preds: [(pred["start"], pred["end"], pred["label"], pred["text"]) for pred in preds]
+        self.assertEqual(spans(predictions[0]), spans(offset_predictions[0]))
+        for pred in offset_predictions[0]:
+            self.assertEqual(pred["text"], pred["text"].strip())
+
     def test_chunk_long_sequences(self):
         test_sequence = ["I am a dog. A dog that's incredibly bright. I can talk, read, and write! " * 10]
         path = os.path.join(os.path.dirname(__file__), "data", "testdata.json")
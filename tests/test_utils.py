@@ -4,6 +4,11 @@ import random
 import json
 from collections import Counter
 import math
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
 import numpy as np
 import tensorflow as tf
@@ -13,11 +18,28 @@ import joblib as jl
 import unicodedata
 
 import finetune
-from finetune.encoding.sequence_encoder import finetune_to_indico_sequence
+from finetune.encoding.sequence_encoder import (
+    finetune_to_indico_sequence,
+    round_to_nearest_start_and_end,
+    round_to_nearest_word_boundary,
+    word_boundaries,
+)
 from finetune.optimizers.gradient_accumulation import get_grad_accumulation_optimizer
 from finetune.util.imbalance import compute_class_weights
 from finetune.util.optimize_loss import OPTIMIZERS
 from finetune.util.timing import ProgressBar
+from finetune.util.tokenization_cache import TokenizationCache
+from finetune.saver import Saver
+from finetune.util.delta_weights import DeltaWeights
+from finetune.util.base_weight_pool import BASE_WEIGHT_POOL
+from finetune.util.micro_batching import MicroBatcher
+from finetune.util.feature_cache import FeatureCache
+from finetune.util.grid_search import run_grid_search_trials
+from finetune.config import get_config
+from finetune.util.mmap_weights import save_weights, load_weights, is_mmap_weights_file, PAGE_SIZE
+from finetune.nn.quantization import quantize_per_channel, dequantize_per_channel, int8_matmul, QuantizedWeights
+from finetune.util.pruning import keep_indices, prune_variables
+from finetune.base_models.bert.modeling import transformer_model, PruningMasks, EarlyExit
 from finetune.errors import FinetuneError
 from finetune import Classifier, SequenceLabeler
 from finetune.base_models import GPT, GPT2, BERT
@@ -136,6 +158,41 @@ class TestFinetuneIndicoConverters(unittest.TestCase):
         self.assertEqual(indicoy_pred, expectedy)
         
 
+    def test_subseq_positions(self):
+        raw = ["Train and test tokenization must be equivalent"]
+        finetunex = [["Train", "and test", "tokenization must be", "equivalent"]]
+        positions = [[(0, 5), (6, 14), (15, 35), (36, 46)]]
+        finetuney = [[("1",), ("1", "2"), ("2",), ("<PAD>",)]]
+        expected = finetune_to_indico_sequence(raw, finetunex, finetuney, none_value="<PAD>")
+        from_offsets = finetune_to_indico_sequence(
+            raw, finetunex, finetuney, none_value="<PAD>", subseq_positions=positions
+        )
+        self.assertEqual(expected, from_offsets)
+
+    def test_subseq_positions_whitespace(self):
+        # the offsets of a subtoken can start at the whitespace before its word
+        raw = ["a fox"]
+        positions = [[(0, 1), (1, 5)]]
+        annotations = finetune_to_indico_sequence(
+            raw, [["a", " fox"]], [["<PAD>", "animal"]], none_value="<PAD>", subseq_positions=positions
+        )[1]
+        self.assertEqual(annotations, [[{"start": 2, "end": 5, "label": "animal", "text": "fox"}]])
+
+    def test_word_boundary_rounding(self):
+        text = "The U.S. quick-brown fox, jumped over the lazy dog's back!  Then it ran."
+        word_starts, word_ends = word_boundaries(text)
+        rng = np.random.RandomState(0)
+        for _ in range(200):
+            start = rng.randint(0, len(text) - 1)
+            end = rng.randint(start + 1, len(text))
+            expected = {"start": start, "end": end}
+            rounded = dict(expected)
+            if not len(word_starts[word_starts < word_ends[np.argmin(np.abs(word_ends - end))]]):
+                continue
+            round_to_nearest_start_and_end(expected, word_starts, word_ends, text)
+            round_to_nearest_word_boundary(rounded, word_starts, word_ends, text)
+            self.assertEqual(expected, rounded)
+
     def test_overlapping(self):
         raw = ["Indico Is the best hey"]
         finetunex = [
@@ -315,5 +372,434 @@ class TestOptimizers(unittest.TestCase):
             self.assertLess(sess.run(loss), original_loss)
 
 
+class TestTokenizationCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TokenizationCache(max_size=2)
+        keys = [TokenizationCache.key(text, ("sig",)) for text in ["a", "b", "c"]]
+        cache.put(keys[0], ["a"])
+        cache.put(keys[1], ["b"])
+        self.assertEqual(cache.get(keys[0]), ["a"])  # "a" is now most recently used
+        cache.put(keys[2], ["c"])
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertEqual(cache.get(keys[0]), ["a"])
+        self.assertEqual(cache.get(keys[2]), ["c"])
+        self.assertEqual(len(cache), 2)
+
+    def test_signature_in_key(self):
+        self.assertNotEqual(
+            TokenizationCache.key("text", ("sig", 512)),
+            TokenizationCache.key("text", ("sig", 256)),
+        )
+
+    def test_save_load(self):
+        path = "tests/data/tokenization_cache.jl"
+        cache = TokenizationCache(max_size=10, path=path)
+        key = TokenizationCache.key("text", ("sig",))
+        cache.put(key, ["encoded"])
+        cache.save()
+        try:
+            self.assertEqual(TokenizationCache(max_size=10, path=path).get(key), ["encoded"])
+        finally:
+            os.remove(path)
+
+
+class TestMmapWeights(unittest.TestCase):
+
+    def test_round_trip(self):
+        path = "tests/data/test_weights.weights"
+        variables = {
+            "model/a:0": np.random.rand(3, 5).astype(np.float32),
+            "model/b:0": np.arange(7, dtype=np.int64),
+            "global_step:0": np.array(12, dtype=np.int64),
+            "model/c:0": np.random.rand(2, 3).astype(np.float16),
+        }
+        save_weights(path, variables)
+        try:
+            self.assertTrue(is_mmap_weights_file(path))
+            loaded = load_weights(path)
+            self.assertEqual(set(loaded), set(variables))
+            for name, value in variables.items():
+                self.assertEqual(loaded[name].dtype, value.dtype)
+                np.testing.assert_array_equal(loaded[name], value)
+                self.assertEqual(loaded[name].__array_interface__["data"][0] % PAGE_SIZE, 0)
+                self.assertFalse(loaded[name].flags.writeable)
+        finally:
+            os.remove(path)
+
+
+class TestRemoveUnchanged(unittest.TestCase):
+
+    def test_remove_unchanged(self):
+        fallback = {
+            "a:0": np.random.rand(64, 64).astype(np.float32),
+            "b:0": np.random.rand(64).astype(np.float32),
+            "c:0": np.random.rand(3, 3).astype(np.float32),
+        }
+        variables = {
+            "a:0": fallback["a:0"].copy(),
+            "b:0": fallback["b:0"] + 1.0,
+            "c:0": np.random.rand(4, 3).astype(np.float32),
+            "d:0": np.random.rand(5).astype(np.float32),
+        }
+        variables["a:0"][0, 0] += 1e-9
+        for save_workers in [None, 4]:
+            saver = Saver(save_workers=save_workers)
+            names, values = saver.remove_unchanged(variables.keys(), variables.values(), fallback)
+            self.assertEqual(names, ["b:0", "c:0", "d:0"])
+            for name, value in zip(names, values):
+                self.assertIs(value, variables[name])
+
+
+class TestDeltaWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.fallback = {
+            "a:0": np.random.randn(32, 32).astype(np.float32),
+            "b:0": np.random.randn(32).astype(np.float32),
+            "step:0": np.array(5, dtype=np.int64),
+        }
+        self.variables = {
+            "a:0": self.fallback["a:0"] + np.random.randn(32, 32).astype(np.float32) * 1e-3,
+            "b:0": self.fallback["b:0"].astype(np.float16),
+            "step:0": np.array(10, dtype=np.int64),
+            "new:0": np.random.randn(4).astype(np.float32),
+        }
+
+    def test_lossless(self):
+        delta = DeltaWeights.encode(self.variables, self.fallback)
+        self.assertEqual(set(delta.deltas), {"a:0", "b:0"})
+        reconstructed = delta.reconstruct(self.fallback)
+        for name, value in self.variables.items():
+            self.assertEqual(reconstructed[name].dtype, value.dtype)
+            np.testing.assert_array_equal(reconstructed[name], value)
+
+    def test_tolerance(self):
+        tolerance = 1e-4
+        delta = DeltaWeights.encode(self.variables, self.fallback, tolerance=tolerance)
+        reconstructed = delta.reconstruct(self.fallback)
+        for name, value in self.variables.items():
+            self.assertEqual(reconstructed[name].dtype, value.dtype)
+            np.testing.assert_allclose(reconstructed[name], value, rtol=0, atol=tolerance * 1.01)
+
+
+class TestQuantization(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel = np.random.randn(64, 16).astype(np.float32)
+        self.kernel[:, 3] *= 100
+        self.kernel[:, 5] = 0
+
+    def test_quantize_per_channel(self):
+        quantized, scale = quantize_per_channel(self.kernel)
+        self.assertEqual(quantized.dtype, np.uint8)
+        self.assertEqual(scale.shape, (16,))
+        reconstructed = dequantize_per_channel(quantized, scale)
+        # per channel scales keep the error of each column relative to that column
+        np.testing.assert_array_less(np.abs(reconstructed - self.kernel), scale / 127 / 2 + 1e-6)
+        np.testing.assert_array_equal(reconstructed[:, 5], 0)
+
+    def test_quantized_weights(self):
+        weights = QuantizedWeights({"model/dense/kernel:0": self.kernel, "model/c_fc/w:0": self.kernel[None]}.get)
+        quantized, scale = quantize_per_channel(self.kernel)
+        np.testing.assert_array_equal(weights.get("model/dense/kernel_int8:0"), quantized)
+        np.testing.assert_array_equal(weights.get("model/dense/kernel_scale:0"), scale)
+        np.testing.assert_array_equal(weights.get("model/c_fc/w_int8:0"), quantized)
+        self.assertIsNone(weights.get("model/dense/bias:0"))
+        self.assertIsNone(weights.get("model/missing/kernel_int8:0"))
+
+    def test_int8_matmul(self):
+        x = np.random.randn(8, 64).astype(np.float32)
+        quantized, scale = quantize_per_channel(self.kernel)
+        with tf.Graph().as_default():
+            out = int8_matmul(tf.constant(x), tf.constant(quantized), tf.constant(scale))
+            with tf.compat.v1.Session() as sess:
+                result = sess.run(out)
+        expected = x @ self.kernel
+        np.testing.assert_allclose(result, expected, rtol=0, atol=0.05 * np.abs(expected).max())
+
+
+class TestPruning(unittest.TestCase):
+
+    def test_keep_indices(self):
+        keep = keep_indices([np.array([0.1, 0.9, 0.2]), np.array([5.0, 1.0, 0.1, 0.2])], 3)
+        np.testing.assert_array_equal(keep[0], [1, 2])
+        np.testing.assert_array_equal(keep[1], [0, 1])
+        # the highest scoring entry of every layer is kept
+        keep = keep_indices([np.array([0.1, 0.9]), np.array([5.0, 1.0])], 10)
+        np.testing.assert_array_equal(keep[0], [1])
+        np.testing.assert_array_equal(keep[1], [0])
+
+    def test_pruned_weights_match_masked_model(self):
+        hidden_size, n_heads, intermediate_size = 8, 2, 6
+        keep_heads, keep_units = [np.array([1])], [np.array([0, 2, 5])]
+        x = np.random.randn(2, 5, hidden_size).astype(np.float32)
+
+        def build(num_attention_heads, intermediate_size, pruning_masks=None):
+            with tf.compat.v1.variable_scope("model/featurizer/bert/encoder"):
+                return transformer_model(
+                    tf.constant(x),
+                    hidden_size=hidden_size,
+                    num_hidden_layers=1,
+                    num_attention_heads=num_attention_heads,
+                    intermediate_size=intermediate_size,
+                    attention_head_size=hidden_size // n_heads,
+                    hidden_dropout_prob=0.0,
+                    attention_probs_dropout_prob=0.0,
+                    pruning_masks=pruning_masks,
+                )
+
+        with tf.Graph().as_default():
+            masks = PruningMasks()
+            output = build(n_heads, intermediate_size, masks)
+            head_mask = np.zeros([2, n_heads], dtype=np.float32)
+            head_mask[:, keep_heads[0]] = 1
+            ffn_mask = np.zeros([2, intermediate_size], dtype=np.float32)
+            ffn_mask[:, keep_units[0]] = 1
+            with tf.compat.v1.Session() as sess:
+                sess.run(tf.compat.v1.global_variables_initializer())
+                variables = {var.name: sess.run(var) for var in tf.compat.v1.global_variables()}
+                masked = sess.run(output, {masks.head_masks[0]: head_mask, masks.ffn_masks[0]: ffn_mask})
+
+        pruned_variables = prune_variables(variables, {}, keep_heads, keep_units, head_size=hidden_size // n_heads)
+        with tf.Graph().as_default():
+            output = build([1], [3])
+            with tf.compat.v1.Session() as sess:
+                for var in tf.compat.v1.global_variables():
+                    var.load(pruned_variables[var.name], sess)
+                pruned = sess.run(output)
+        np.testing.assert_allclose(pruned, masked, atol=1e-5)
+
+
+class TestEarlyExit(unittest.TestCase):
+
+    def build(self, threshold):
+        x = np.random.RandomState(0).randn(2, 5, 8).astype(np.float32)
+        early_exit = EarlyExit(exit_layers=[1, 2], n_outputs=2, threshold=threshold)
+        output = transformer_model(
+            tf.constant(x),
+            hidden_size=8,
+            num_hidden_layers=3,
+            num_attention_heads=2,
+            intermediate_size=16,
+            hidden_dropout_prob=0.0,
+            attention_probs_dropout_prob=0.0,
+            early_exit=early_exit,
+        )
+        return output, early_exit
+
+    def test_threshold(self):
+        with tf.Graph().as_default():
+            self.build(threshold=None)
+            variable_names = sorted(var.name for var in tf.compat.v1.global_variables())
+
+        # never confident, or always confident at the first exit
+        for threshold, expected_layer in [(1.1, 3), (0.0, 1)]:
+            with tf.Graph().as_default():
+                output, early_exit = self.build(threshold=threshold)
+                # the conditional layers are the only copy of each layer
+                self.assertEqual(sorted(var.name for var in tf.compat.v1.global_variables()), variable_names)
+                with tf.compat.v1.Session() as sess:
+                    sess.run(tf.compat.v1.global_variables_initializer())
+                    output, exit_layer = sess.run([output, early_exit.exit_layer])
+            self.assertEqual(exit_layer, expected_layer)
+            self.assertEqual(output.shape, (2, 5, 8))
+
+
+class TestBaseWeightPool(unittest.TestCase):
+
+    def test_shared_fallback(self):
+        path = "tests/data/test_base_weights.jl"
+        jl.dump({"a:0": np.ones(3, dtype=np.float32)}, path)
+        try:
+            saver_1 = Saver(fallback_filename=path)
+            saver_2 = Saver(fallback_filename=path)
+            self.assertEqual(BASE_WEIGHT_POOL.refcount(path), 2)
+            self.assertIs(saver_1.fallback["a:0"], saver_2.fallback["a:0"])
+            self.assertFalse(saver_1.fallback["a:0"].flags.writeable)
+
+            saver_1.release_fallback()
+            self.assertEqual(BASE_WEIGHT_POOL.refcount(path), 1)
+            del saver_2
+            self.assertEqual(BASE_WEIGHT_POOL.refcount(path), 0)
+        finally:
+            os.remove(path)
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_coalesce(self):
+        calls = []
+        running = threading.Event()
+        release = threading.Event()
+
+        def run_fn(key, x):
+            calls.append(list(x))
+            if "slow" in x:
+                running.set()
+                release.wait()
+            if "bad" in x:
+                raise ValueError("bad input")
+            return [key + ":" + doc for doc in x]
+
+        def submit_behind_slow_batch(requests):
+            # requests submitted while a batch runs wait for it to finish and then run together
+            running.clear()
+            release.clear()
+            with ThreadPoolExecutor(len(requests) + 1) as executor:
+                slow = executor.submit(batcher.submit, "m", ["slow"])
+                running.wait()
+                futures = [executor.submit(batcher.submit, "m", x) for x in requests]
+                while batcher._open.get("m") is None or batcher._open["m"].n_requests < len(requests):
+                    time.sleep(0.01)
+                release.set()
+                self.assertEqual(slow.result(), ["m:slow"])
+                return futures
+
+        # the window is never waited out, a lone request runs at once and queued requests run when the model is free
+        batcher = MicroBatcher(run_fn, window=60, max_batch_size=8)
+        self.assertEqual(batcher.submit("m", ["a"]), ["m:a"])
+        self.assertEqual(calls, [["a"]])
+
+        calls.clear()
+        futures = submit_behind_slow_batch([["b"], ["c", "d"], ["e"]])
+        self.assertEqual([future.result() for future in futures], [["m:b"], ["m:c", "m:d"], ["m:e"]])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(calls[1]), ["b", "c", "d", "e"])
+
+        # a failing batch is retried per request
+        good, bad = submit_behind_slow_batch([["f"], ["bad"]])
+        self.assertEqual(good.result(), ["m:f"])
+        with self.assertRaises(ValueError):
+            bad.result()
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def test_load_or_compute(self):
+        calls = []
+
+        def featurize_fn(examples, keys):
+            calls.append(len(examples))
+            for feats, _ in examples:
+                # featurizer outputs are padded to the longest example in the batch
+                length = len(feats["tokens"]) + 2
+                yield {
+                    "features": np.full(4, len(feats["tokens"]), dtype=np.float32),
+                    "sequence_features": np.random.randn(length, 4).astype(np.float32),
+                }
+
+        examples = [({"tokens": np.arange(n)}, np.array([1.0, 0.0])) for n in [3, 5, 2]]
+        path = tempfile.mkdtemp()
+        cache = FeatureCache(path, ("features", "sequence_features"), featurize_fn, signature=("RoBERTa",))
+        computed = cache.load_or_compute(examples)
+        loaded = cache.load_or_compute(examples)
+        self.assertEqual(calls, [3])
+        for (computed_feats, _), (feats, target), n in zip(computed, loaded, [3, 5, 2]):
+            np.testing.assert_array_equal(target, [1.0, 0.0])
+            self.assertEqual(feats["cached_lengths"], n)
+            self.assertEqual(feats["cached_sequence_features"].shape, (n, 4))
+            self.assertEqual(feats["cached_sequence_features"].dtype, np.float16)
+            np.testing.assert_array_equal(feats["cached_features"], np.full(4, n))
+            np.testing.assert_array_equal(feats["cached_sequence_features"], computed_feats["cached_sequence_features"])
+
+        # a different featurizer is not served from the cache
+        FeatureCache(path, ("features",), featurize_fn, signature=("BERT",)).load_or_compute(examples)
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(len(os.listdir(path)), 2)
+
+
+
+class ThreadCountModel:
+    """
+    Stands in for a model in grid search trials, predicting the name of its config and the thread limits it was given.
+    """
+
+    def __init__(self, **config):
+        self.config = config
+
+    def finetune(self, *Xs, Y=None):
+        pass
+
+    def predict(self, *Xs):
+        return self.config["name"], os.environ.get("OMP_NUM_THREADS"), self.config.get("num_threads")
+
+
+class TestGridSearch(unittest.TestCase):
+
+    def trials(self, n):
+        return [({"name": i}, [["a"]], [0], [["b"]]) for i in range(n)]
+
+    def test_sequential_in_order(self):
+        for n_workers in [None, 1]:
+            results = list(run_grid_search_trials(ThreadCountModel, self.trials(4), probs=False, n_workers=n_workers))
+            self.assertEqual([trial_idx for trial_idx, _ in results], [0, 1, 2, 3])
+            self.assertEqual([pred[0] for _, pred in results], [0, 1, 2, 3])
+
+    def test_workers_thread_count(self):
+        results = dict(
+            run_grid_search_trials(ThreadCountModel, self.trials(4), probs=False, n_workers=2, threads_per_worker=1)
+        )
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        for trial_idx, (name, omp_threads, num_threads) in results.items():
+            self.assertEqual(name, trial_idx)
+            self.assertEqual(omp_threads, "1")
+            self.assertEqual(num_threads, 1)
+
+    def test_num_threads_session_config(self):
+        session_config = Classifier(num_threads=1)._get_estimator_config().session_config
+        self.assertEqual(session_config.intra_op_parallelism_threads, 1)
+        self.assertEqual(session_config.inter_op_parallelism_threads, 1)
+        session_config = Classifier()._get_estimator_config().session_config
+        self.assertEqual(session_config.intra_op_parallelism_threads, 0)
+
+    def test_iter_grid_search_sequential(self):
+        """
+        Ensure a single worker runs the trials in order, in this process and without pretokenizing
+        """
+        configs = [get_config(lr=lr) for lr in [1e-4, 1e-5]]
+
+        def run_trials(model_cls, trials, probs, n_workers=None, threads_per_worker=None):
+            self.assertEqual(n_workers, 1)
+            for trial_idx, (config, _, _, _) in enumerate(trials):
+                yield trial_idx, config["lr"]
+
+        with patch.object(Classifier, "_grid_configs", return_value=configs), patch.object(
+            Classifier, "_pretokenize_for_grid_search"
+        ) as pretokenize, patch("finetune.base.run_grid_search_trials", side_effect=run_trials):
+            results = list(
+                Classifier.iter_grid_search(
+                    ["a", "b", "c", "d"],
+                    [0, 1, 0, 1],
+                    test_size=2,
+                    n_splits=2,
+                    eval_fn=lambda pred, truth: pred,
+                    n_workers=1,
+                )
+            )
+        pretokenize.assert_not_called()
+        self.assertEqual(
+            [(grid_idx, split_idx, result) for grid_idx, split_idx, _, result in results],
+            [(0, 0, 1e-4), (1, 0, 1e-5), (0, 1, 1e-4), (1, 1, 1e-5)],
+        )
+
+    def test_iter_grid_search_pretokenize(self):
+        """
+        Ensure documents are only pretokenized for worker processes and for models with a single input field
+        """
+        configs = [get_config(lr=1e-4)]
+
+        def run_trials(model_cls, trials, probs, n_workers=None, threads_per_worker=None):
+            for trial_idx, _ in enumerate(trials):
+                yield trial_idx, 1.0
+
+        for Xs, expect_pretokenize in [(["a", "b", "c", "d"], True), ([["a", "b", "c", "d"], ["e", "f", "g", "h"]], False)]:
+            with patch.object(Classifier, "_grid_configs", return_value=configs), patch.object(
+                Classifier, "_pretokenize_for_grid_search"
+            ) as pretokenize, patch("finetune.base.run_grid_search_trials", side_effect=run_trials):
+                list(Classifier.iter_grid_search(Xs, [0, 1, 0, 1], test_size=2, eval_fn=lambda pred, truth: pred, n_workers=2))
+            self.assertEqual(pretokenize.called, expect_pretokenize)
+
+
 if __name__ == '__main__':
     unittest.main()